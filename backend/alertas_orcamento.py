@@ -0,0 +1,112 @@
+# alertas de orçamento (80% / 100% do valor_limite) gerados na hora da escrita da transação
+#
+# _EfeitosTransacoes.aplicar (main.py) chama verificar_orcamentos_transacoes depois de atualizar o rollup:
+# o gasto do mês sai de resumo_mensal (total corrente por usuário/mês/categoria), sem varrer transações,
+# e só as categorias tocadas pela escrita que têm Orcamento ativo são avaliadas
+#
+# cada aviso leva `referencia` = 'orcamento:<id>:<AAAAMM>:<80|100>': no máximo um aviso de cada nível
+# por orçamento e mês. O timer VerificarOrcamentos (notificacoes-function) grava a mesma referência
+# e fica como rede de segurança (ex.: transações só com categoria em texto, sem categoria_id)
+
+from datetime import date, datetime
+from typing import Iterable
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from categorias import categoria_por_texto
+from database import Orcamento, ResumoMensal, Notificacao
+from notificacoes_tempo_real import avisar_apos_commit
+from resumo_mensal import ano_mes_de, campo_de
+
+
+def referencia_orcamento(orcamento_id: int, ano_mes: int, nivel: int) -> str:
+    return f"orcamento:{orcamento_id}:{ano_mes}:{nivel}"
+
+
+def _aviso(orcamento, gasto: float):
+    """(nível, tipo, título, mensagem) do aviso devido, ou None abaixo de 80%. Textos iguais aos do timer."""
+    limite = float(orcamento.valor_limite)
+    percentual = gasto / limite * 100
+    categoria = (orcamento.categoria_chave or "").capitalize()
+    if percentual >= 100:
+        return (100, "orcamento_estourado", "Orçamento Estourado",
+                f"🚨 Limite de {categoria} excedido! Gasto: R$ {gasto:.2f} / Limite: R$ {limite:.2f}")
+    if percentual >= 80:
+        return (80, "orcamento_alerta", "Alerta de Gastos",
+                f"⚠️ Atenção: Você já consumiu {int(percentual + 0.5)}% do orçamento de {categoria}.")
+    return None
+
+
+def verificar_orcamentos_transacoes(db: Session, usuario_id: int, adicionadas: Iterable) -> int:
+    """
+    Grava os avisos de orçamento devidos pelas despesas do mês atual em `adicionadas`
+    (objetos Transacao ou dicts). Chamar depois de atualizar_resumo_mensal, na mesma transação; não faz commit.
+    Retorna o nº de notificações criadas.
+    """
+    hoje = date.today()
+    ano_mes = ano_mes_de(hoje)
+    categorias = {
+        campo_de(l, "categoria_id") for l in adicionadas
+        if campo_de(l, "tipo") == "despesa"
+        and campo_de(l, "data") is not None
+        and ano_mes_de(campo_de(l, "data")) == ano_mes
+    }
+    categorias.discard(None)
+    if not categorias:
+        return 0
+
+    orcamentos = db.query(
+        Orcamento.id, Orcamento.categoria_id, Orcamento.categoria_chave, Orcamento.valor_limite
+    ).filter(
+        Orcamento.usuario_id == usuario_id,
+        Orcamento.ativo == True,  # noqa: E712
+        Orcamento.valor_limite > 0,
+    ).all()
+
+    # orçamento -> categoria; sem categoria_id, a chave (ex: 'mercado') é resolvida pelo cache de categorias
+    por_categoria = {}
+    for o in orcamentos:
+        categoria_id = o.categoria_id
+        if categoria_id is None:
+            categoria = categoria_por_texto(db, o.categoria_chave)
+            categoria_id = categoria.id if categoria else None
+        if categoria_id in categorias:
+            por_categoria.setdefault(categoria_id, []).append(o)
+    if not por_categoria:
+        return 0
+
+    gastos = dict(db.query(ResumoMensal.categoria_id, ResumoMensal.total).filter(
+        ResumoMensal.usuario_id == usuario_id,
+        ResumoMensal.ano_mes == ano_mes,
+        ResumoMensal.tipo == "despesa",
+        ResumoMensal.categoria_id.in_(list(por_categoria)),
+    ).all())
+
+    avisos = {}
+    for categoria_id, orcs in por_categoria.items():
+        gasto = round(float(gastos.get(categoria_id) or 0.0), 2)
+        for o in orcs:
+            aviso = _aviso(o, gasto)
+            if aviso:
+                nivel, tipo, titulo, mensagem = aviso
+                avisos[referencia_orcamento(o.id, ano_mes, nivel)] = (tipo, titulo, mensagem)
+    if not avisos:
+        return 0
+
+    ja_avisados = {r for (r,) in db.query(Notificacao.referencia).filter(
+        Notificacao.usuario_id == usuario_id,
+        Notificacao.referencia.in_(list(avisos)),
+    ).all()}
+
+    agora = datetime.utcnow()
+    novos = [
+        {"usuario_id": usuario_id, "tipo": tipo, "titulo": titulo, "mensagem": mensagem,
+         "lida": False, "created_at": agora, "referencia": referencia}
+        for referencia, (tipo, titulo, mensagem) in avisos.items() if referencia not in ja_avisados
+    ]
+    if novos:
+        db.execute(insert(Notificacao.__table__), novos)
+        # conexões de GET /notificacoes/stream recebem o aviso logo depois do commit
+        avisar_apos_commit(db)
+    return len(novos)
@@ -1,10 +1,17 @@
 import jwt
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
-from fastapi import HTTPException, Depends
+from fastapi import HTTPException, Depends, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import hashlib
+import multiprocessing
 import os
+import threading
+
+from cache import CacheLRU
 
 """
 hash = função que transforma um texto em um codigo irreversivel
@@ -23,9 +30,21 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "chave-super-secreta-mude-em-producao-123")
 ALGORITHM = "HS256"
 TOKEN_EXPIRATION_DAYS = 7
+# token de curta duração só para abrir o stream de notificações (vai na URL, ver pegar_usuario_stream)
+STREAM_TOKEN_SEGUNDOS = int(os.getenv("STREAM_TOKEN_SEGUNDOS", "60"))
+ESCOPO_STREAM = "stream"
 
 # Sistema de segurança HTTP Bearer
 security = HTTPBearer()
+security_opcional = HTTPBearer(auto_error=False)
+
+# tokens já verificados (chave = sha256 do token, nunca o token em si)
+# o mesmo token de 7 dias chega em toda requisição do dashboard --> o HMAC do jwt.decode roda uma vez só
+# cada item expira no 'exp' do próprio token (ou em TOKEN_CACHE_TTL, o que vier antes)
+_tokens_verificados = CacheLRU(
+    max_itens=int(os.getenv("TOKEN_CACHE_MAX", "10000")),
+    ttl=int(os.getenv("TOKEN_CACHE_TTL", "3600")),
+)
 
 #recebe a senha e devolve com o hash que voce salva no banco 
 def criar_hash_senha(senha: str) -> str:
@@ -38,6 +57,11 @@ def criar_hash_senha(senha: str) -> str:
     """
     return pwd_context.hash(senha)
 
+# marcador gravado em senha_hash de usuários criados pelo Google (a coluna é NOT NULL)
+# não é um hash bcrypt válido --> verificar_senha sempre recusa, e não custa um bcrypt para gerar
+SENHA_INUTILIZAVEL = "!oauth"
+
+
 # compara o que o usuario digitiou com o hash salvo 
 def verificar_senha(senha_plana: str, senha_hash: str) -> bool:
     """
@@ -48,8 +72,79 @@ def verificar_senha(senha_plana: str, senha_hash: str) -> bool:
     senha_hash = "$2b$12$abc..." (o que está no banco)
     retorna = True ou False
     """
+    # conta sem senha local (login só via Google) nunca aceita senha
+    if not senha_hash or senha_hash.startswith(SENHA_INUTILIZAVEL):
+        return False
     return pwd_context.verify(senha_plana, senha_hash)
 
+
+"""
+bcrypt é lento de propósito (~0,25s de CPU por hash) e as rotas síncronas rodam no threadpool
+compartilhado do FastAPI: uma rajada de logins ocuparia as threads e travaria até os GETs simples.
+As rotas de login/cadastro usam as versões async abaixo, que rodam o bcrypt num pool de processos
+separado e limitado (SENHA_WORKERS); com mais de SENHA_MAX_PENDENTES na fila, responde 503 na hora
+em vez de empilhar requisições.
+"""
+SENHA_WORKERS = int(os.getenv("SENHA_WORKERS", "2"))
+SENHA_MAX_PENDENTES = int(os.getenv("SENHA_MAX_PENDENTES", "32"))
+
+_pool_senhas = None
+_pool_lock = threading.Lock()
+_senhas_pendentes = 0
+
+
+def _obter_pool_senhas() -> ProcessPoolExecutor:
+    global _pool_senhas
+    if _pool_senhas is None:
+        with _pool_lock:
+            if _pool_senhas is None:
+                # spawn: fork de um processo com threads (threadpool, event loop, conexões do pool do
+                # SQLAlchemy) copia locks no estado em que estavam e pode travar o filho
+                _pool_senhas = ProcessPoolExecutor(
+                    max_workers=SENHA_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pool_senhas
+
+
+def encerrar_pool_senhas() -> None:
+    """Chamado no shutdown da aplicação."""
+    global _pool_senhas
+    with _pool_lock:
+        if _pool_senhas is not None:
+            _pool_senhas.shutdown(wait=False, cancel_futures=True)
+            _pool_senhas = None
+
+
+async def _no_pool_senhas(funcao, *args):
+    global _senhas_pendentes
+    # controle de admissão: fila cheia --> 503 imediato (o cliente tenta de novo)
+    with _pool_lock:
+        if _senhas_pendentes >= SENHA_MAX_PENDENTES:
+            raise HTTPException(
+                status_code=503,
+                detail="Servidor ocupado. Tente novamente em instantes.",
+                headers={"Retry-After": "2"},
+            )
+        _senhas_pendentes += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_obter_pool_senhas(), funcao, *args)
+    finally:
+        with _pool_lock:
+            _senhas_pendentes -= 1
+
+
+async def criar_hash_senha_async(senha: str) -> str:
+    """criar_hash_senha fora do event loop e do threadpool"""
+    return await _no_pool_senhas(criar_hash_senha, senha)
+
+
+async def verificar_senha_async(senha_plana: str, senha_hash: str) -> bool:
+    """verificar_senha fora do event loop e do threadpool"""
+    if not senha_hash or senha_hash.startswith(SENHA_INUTILIZAVEL):
+        return False
+    return await _no_pool_senhas(verificar_senha, senha_plana, senha_hash)
+
 """
 JWT = JSON Web Token = string com 3 partes
 - header: algoritmo (ex.: "alg":"HS256").
@@ -77,22 +172,50 @@ def criar_token(user_id: int) -> str:
     return token
 
 
+def criar_token_stream(user_id: int) -> str:
+    """
+    Token JWT que só vale para GET /notificacoes/stream (claim 'escopo' = 'stream')
+    e expira em STREAM_TOKEN_SEGUNDOS: se vazar em log de proxy ou no histórico, já não serve
+    """
+    agora = datetime.utcnow()
+    payload = {
+        'user_id': user_id,
+        'escopo': ESCOPO_STREAM,
+        'exp': agora + timedelta(seconds=STREAM_TOKEN_SEGUNDOS),
+        'iat': agora
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
 def verificar_token(token: str) -> Dict[str, Any]:
     """
     Valida token e retorna informações
     
     Se token inválido ou expirado, lança exceção
     """
+    chave = hashlib.sha256(token.encode()).digest()
+    payload = _tokens_verificados.obter(chave)
+    if payload is not None:
+        return dict(payload)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        # só tokens válidos entram no cache; inválidos sempre passam pela verificação completa
+        _tokens_verificados.definir(chave, payload, expira_em=payload.get('exp'))
+        return dict(payload)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expirado. Faça login novamente.")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Token inválido.")
 
 
-def pegar_usuario_atual(credentials: HTTPAuthorizationCredentials = Depends(security)) -> int:
+def estatisticas_cache_tokens() -> Dict[str, Any]:
+    """hits/misses do cache de tokens verificados (exibido em GET /)"""
+    return _tokens_verificados.estatisticas()
+
+
+# async def: só CPU (cache + HMAC, microssegundos) --> roda direto no event loop,
+# sem ocupar uma thread do threadpool a cada requisição
+async def pegar_usuario_atual(credentials: HTTPAuthorizationCredentials = Depends(security)) -> int:
     """
     Extrai user_id do token
     
@@ -103,6 +226,8 @@ def pegar_usuario_atual(credentials: HTTPAuthorizationCredentials = Depends(secu
     """
     token = credentials.credentials #extrai o token do header
     payload = verificar_token(token) #valida assinatura/expiração
+    if payload.get('escopo') == ESCOPO_STREAM:
+        raise HTTPException(status_code=401, detail="Token de stream só vale em /notificacoes/stream")
     # Garantir que o payload contenha user_id
     try:
         return int(payload['user_id']) #devolve o id 
@@ -110,6 +235,27 @@ def pegar_usuario_atual(credentials: HTTPAuthorizationCredentials = Depends(secu
         raise HTTPException(status_code=401, detail="Token inválido: user_id ausente")
     
 
+
+# EventSource (SSE) do navegador não envia headers: aceita o token também em ?token=
+# na URL só vale o token de stream (criar_token_stream), nunca o de 7 dias
+async def pegar_usuario_stream(
+    token: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security_opcional)
+) -> int:
+    """Como pegar_usuario_atual, mas com o token no header Authorization ou um token de stream em ?token="""
+    if credentials:
+        payload = verificar_token(credentials.credentials)
+    elif token:
+        payload = verificar_token(token)
+        if payload.get('escopo') != ESCOPO_STREAM:
+            raise HTTPException(status_code=401, detail="Use um token de POST /notificacoes/stream/token em ?token=")
+    else:
+        raise HTTPException(status_code=401, detail="Token ausente")
+    try:
+        return int(payload['user_id'])
+    except Exception:
+        raise HTTPException(status_code=401, detail="Token inválido: user_id ausente")
+
 """
 passo a passo 
 
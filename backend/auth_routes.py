@@ -1,13 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from authlib.integrations.starlette_client import OAuth
 import os
 
 # Imports from your project structure
-from database import get_db, UsuarioTable
+from database import get_db, get_async_db, UsuarioTable
 from models import UsuarioCreate, UsuarioLogin, LoginResponse, Usuario
-from auth import criar_hash_senha, verificar_senha, criar_token, pegar_usuario_atual
+from auth import (
+    criar_hash_senha_async, verificar_senha_async, criar_token, pegar_usuario_atual,
+    SENHA_INUTILIZAVEL
+)
 
 # Configuração do Router
 router = APIRouter(prefix="/auth", tags=["Autenticação"])
@@ -35,18 +39,31 @@ oauth.register(
 # ----------------------------------
 
 
+# rotas async: o bcrypt roda no pool de processos (auth.py) e as queries no threadpool,
+# então nenhum dos dois segura o event loop nem as threads das outras rotas
+def _buscar_por_email(db: Session, email: str):
+    return db.query(UsuarioTable).filter(UsuarioTable.email == email).first()
+
+
+def _salvar_usuario(db: Session, usuario: UsuarioTable) -> UsuarioTable:
+    db.add(usuario)
+    db.commit()
+    db.refresh(usuario)
+    return usuario
+
+
 @router.post("/registro", status_code=201)
-def registrar_usuario(dados: UsuarioCreate, db: Session = Depends(get_db)):
+async def registrar_usuario(dados: UsuarioCreate, db: Session = Depends(get_db)):
     """
     Criar nova conta (Email/Senha)
     """
     # Verificar se email já existe
-    usuario_existe = db.query(UsuarioTable).filter(UsuarioTable.email == dados.email).first()
+    usuario_existe = await run_in_threadpool(_buscar_por_email, db, dados.email)
     if usuario_existe:
         raise HTTPException(status_code=400, detail="Este email já está cadastrado")
     
     # Criar hash da senha
-    senha_hash = criar_hash_senha(dados.senha)
+    senha_hash = await criar_hash_senha_async(dados.senha)
     
     # Criar usuário no banco
     novo_usuario = UsuarioTable(
@@ -55,9 +72,7 @@ def registrar_usuario(dados: UsuarioCreate, db: Session = Depends(get_db)):
         senha_hash=senha_hash
     )
     
-    db.add(novo_usuario)
-    db.commit()
-    db.refresh(novo_usuario)
+    novo_usuario = await run_in_threadpool(_salvar_usuario, db, novo_usuario)
     
     return {
         "mensagem": "Conta criada com sucesso! 🎉",
@@ -66,18 +81,18 @@ def registrar_usuario(dados: UsuarioCreate, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=LoginResponse)
-def fazer_login(dados: UsuarioLogin, db: Session = Depends(get_db)):
+async def fazer_login(dados: UsuarioLogin, db: Session = Depends(get_db)):
     """
     Fazer login (Email/Senha)
     """
     # Buscar usuário
-    usuario = db.query(UsuarioTable).filter(UsuarioTable.email == dados.email).first()
+    usuario = await run_in_threadpool(_buscar_por_email, db, dados.email)
     
     if not usuario:
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
     # Verificar senha
-    if not verificar_senha(dados.senha, usuario.senha_hash):
+    if not await verificar_senha_async(dados.senha, usuario.senha_hash):
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
     # Gerar token
@@ -90,14 +105,16 @@ def fazer_login(dados: UsuarioLogin, db: Session = Depends(get_db)):
 
 
 @router.get("/me", response_model=Usuario)
-def meu_perfil(
+async def meu_perfil(
     user_id: int = Depends(pegar_usuario_atual),
-    db: Session = Depends(get_db)
+    db = Depends(get_async_db)
 ):
     """
     Ver meu perfil (Rota Protegida)
     """
-    usuario = db.query(UsuarioTable).filter(UsuarioTable.id == user_id).first()
+    usuario = await db.run_sync(
+        lambda s: s.query(UsuarioTable).filter(UsuarioTable.id == user_id).first()
+    )
     
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
@@ -164,15 +181,12 @@ async def google_callback(request: Request, db: Session = Depends(get_db)):
         usuario = db.query(UsuarioTable).filter(UsuarioTable.email == email).first()
         
         if not usuario:
-            # Gera uma senha aleatória forte para cumprir o requisito de senha_hash do banco
-            # O usuário Google nunca usará essa senha, ele loga via OAuth
-            senha_aleatoria = os.urandom(16).hex()
-            senha_hash = criar_hash_senha(senha_aleatoria)
-            
+            # O usuário Google nunca usa senha local, ele loga via OAuth:
+            # grava o marcador de senha inutilizável (sem gastar um bcrypt à toa)
             usuario = UsuarioTable(
                 nome=nome, 
                 email=email, 
-                senha_hash=senha_hash,
+                senha_hash=SENHA_INUTILIZAVEL,
                 onboarding_step=0
             )
             db.add(usuario)
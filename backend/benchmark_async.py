@@ -0,0 +1,86 @@
+# benchmark de carga das rotas de leitura mais chamadas (transacoes, metas, notificacoes, auth/me)
+# compara a API com o engine síncrono (threadpool) e com o engine assíncrono (DB_ASYNC=1):
+#
+#     DB_ASYNC=0 uvicorn main:app --port 8000      # antes
+#     python benchmark_async.py --url http://localhost:8000 --clientes 200 --segundos 20
+#
+#     DB_ASYNC=1 uvicorn main:app --port 8000      # depois
+#     python benchmark_async.py --url http://localhost:8000 --clientes 200 --segundos 20
+#
+# cria (ou reaproveita) um usuário de teste, faz login uma vez e dispara `--clientes` clientes
+# concorrentes em loop pelas rotas abaixo; imprime req/s, latências p50/p95/p99 e erros
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+ROTAS = ["/transacoes?limit=50", "/transacoes/pagina?limit=50", "/metas", "/notificacoes", "/auth/me"]
+
+
+async def _token(cliente: httpx.AsyncClient, email: str, senha: str) -> str:
+    await cliente.post("/auth/registro", json={"nome": "Benchmark", "email": email, "senha": senha})
+    r = await cliente.post("/auth/login", json={"email": email, "senha": senha})
+    r.raise_for_status()
+    return r.json()["token"]
+
+
+async def _cliente(cliente: httpx.AsyncClient, headers: dict, fim: float, latencias: list, erros: list, deslocamento: int):
+    i = deslocamento
+    while time.perf_counter() < fim:
+        rota = ROTAS[i % len(ROTAS)]
+        i += 1
+        inicio = time.perf_counter()
+        try:
+            r = await cliente.get(rota, headers=headers)
+            if r.status_code >= 400:
+                erros.append(r.status_code)
+                continue
+        except httpx.HTTPError as e:
+            erros.append(type(e).__name__)
+            continue
+        latencias.append(time.perf_counter() - inicio)
+
+
+async def executar(url: str, clientes: int, segundos: float, email: str, senha: str) -> None:
+    limites = httpx.Limits(max_connections=clientes, max_keepalive_connections=clientes)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as cliente:
+        headers = {"Authorization": f"Bearer {await _token(cliente, email, senha)}"}
+        info = (await cliente.get("/")).json()
+
+        # aquecimento: abre as conexões antes de medir
+        await asyncio.gather(*[cliente.get(ROTAS[i % len(ROTAS)], headers=headers) for i in range(clientes)])
+
+        latencias, erros = [], []
+        inicio = time.perf_counter()
+        fim = inicio + segundos
+        await asyncio.gather(*[
+            _cliente(cliente, headers, fim, latencias, erros, i) for i in range(clientes)
+        ])
+        duracao = time.perf_counter() - inicio
+
+    latencias.sort()
+
+    def percentil(p):
+        return latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000 if latencias else 0.0
+
+    print(f"banco: {info.get('banco')} | engine async: {info.get('banco_async')}")
+    print(f"clientes: {clientes} | duração: {duracao:.1f}s | rotas: {', '.join(ROTAS)}")
+    print(f"requisições ok: {len(latencias)} | erros: {len(erros)}")
+    print(f"req/s: {len(latencias) / duracao:.1f}")
+    if latencias:
+        print(f"latência ms: média {statistics.mean(latencias) * 1000:.1f} | p50 {percentil(0.50):.1f} "
+              f"| p95 {percentil(0.95):.1f} | p99 {percentil(0.99):.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de leitura com N clientes concorrentes")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--segundos", type=float, default=20)
+    parser.add_argument("--email", default="benchmark@monevo.com.br")
+    parser.add_argument("--senha", default="benchmark123")
+    args = parser.parse_args()
+    asyncio.run(executar(args.url, args.clientes, args.segundos, args.email, args.senha))
@@ -0,0 +1,76 @@
+# cache em memória, por processo: LRU com limite de itens + expiração (TTL) por item
+# seguro entre threads (rotas síncronas do FastAPI rodam num threadpool)
+#
+# uso:
+#     tokens = CacheLRU(max_itens=10000, ttl=600)
+#     tokens.definir(chave, valor)                 --> expira em ttl segundos
+#     tokens.definir(chave, valor, expira_em=ts)   --> expira no timestamp (time.time()) informado
+#     valor = tokens.obter(chave)                  --> None se ausente/expirado
+#     tokens.estatisticas()                        --> hits, misses, itens...
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional
+import time
+
+
+class CacheLRU:
+    def __init__(self, max_itens: int = 1000, ttl: Optional[float] = 300):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens: "OrderedDict[Hashable, tuple]" = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.descartados = 0  # removidos por falta de espaço (LRU)
+
+    def obter(self, chave: Hashable, padrao: Any = None) -> Any:
+        agora = time.time()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.misses += 1
+                return padrao
+            expira_em, valor = item
+            if expira_em is not None and expira_em <= agora:
+                del self._itens[chave]
+                self.expirados += 1
+                self.misses += 1
+                return padrao
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def definir(self, chave: Hashable, valor: Any, ttl: Optional[float] = None, expira_em: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        limite = time.time() + ttl if ttl is not None else None
+        if expira_em is not None:
+            limite = expira_em if limite is None else min(limite, expira_em)
+        with self._lock:
+            self._itens[chave] = (limite, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self.descartados += 1
+
+    def remover(self, chave: Hashable) -> None:
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "itens": len(self._itens),
+                "max_itens": self.max_itens,
+                "hits": self.hits,
+                "misses": self.misses,
+                "taxa_acerto": round(self.hits / total, 4) if total else 0.0,
+                "expirados": self.expirados,
+                "descartados": self.descartados,
+            }
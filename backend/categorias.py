@@ -0,0 +1,126 @@
+# cache em memória da tabela categorias (pequena e quase estática)
+# carregada inteira numa query e consultada pelas rotas de escrita de transações, importação e onboarding:
+# no caminho quente nenhuma query em categorias é feita
+#
+# - texto livre ("Alimentação", "alimentacao", "ALIMENTAÇÃO") casa com chave ou nome sem acento/caixa
+# - as rotas de categoria chamam invalidar_categorias() depois do commit
+# - com vários workers cada processo tem o seu cache; o TTL limita quanto tempo os outros ficam desatualizados
+#   para a árvore do GET /categorias. id ou texto que não está no cache força uma recarga antes de ser
+#   tratado como desconhecido: categoria criada/renomeada por outro worker não se perde numa transação
+#   (falta no cache é rara: só categoria nova ou texto livre que não é categoria)
+# - a árvore de GET /categorias (JSON pronto + ETag) é montada junto, uma vez por recarga
+
+from collections import namedtuple
+from threading import Lock
+from typing import Dict, Optional, Tuple
+import hashlib
+import json
+import time
+
+from sqlalchemy.orm import Session
+
+from database import Categoria
+from importacao import normalizar_texto
+
+
+CATEGORIAS_TTL_SEGUNDOS = 300
+
+CategoriaInfo = namedtuple("CategoriaInfo", ["id", "tipo", "chave", "nome", "icone", "ordem", "ativo", "parent_id"])
+
+
+class _CacheCategorias:
+    def __init__(self, ttl: int = CATEGORIAS_TTL_SEGUNDOS):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._por_id: Dict[int, CategoriaInfo] = {}
+        self._por_texto: Dict[str, CategoriaInfo] = {}
+        self._arvore: Tuple[bytes, str] = (b"[]", "")
+        self._carregado_em = None
+
+    def _garantir(self, db: Session, forcar: bool = False) -> bool:
+        """Recarrega se o TTL venceu (ou se `forcar`). Retorna True se esta chamada recarregou."""
+        if not forcar and self._carregado_em is not None and time.monotonic() - self._carregado_em < self.ttl:
+            return False
+        with self._lock:
+            # outra thread pode ter recarregado enquanto esperávamos o lock
+            if not forcar and self._carregado_em is not None and time.monotonic() - self._carregado_em < self.ttl:
+                return False
+            linhas = db.query(
+                Categoria.id, Categoria.tipo, Categoria.chave, Categoria.nome,
+                Categoria.icone, Categoria.ordem, Categoria.ativo, Categoria.parent_id
+            ).order_by(Categoria.ordem, Categoria.id).all()
+            todas = [CategoriaInfo(*l) for l in linhas]
+
+            por_texto = {}
+            # nome primeiro, chave depois: em caso de conflito a chave prevalece (era a 1ª condição da busca antiga)
+            for c in todas:
+                por_texto.setdefault(normalizar_texto(c.nome), c)
+            for c in todas:
+                por_texto[normalizar_texto(c.chave)] = c
+
+            # troca as referências de uma vez: leitores sem lock veem o conjunto antigo ou o novo, nunca metade
+            self._por_id = {c.id: c for c in todas}
+            self._por_texto = por_texto
+            self._arvore = _montar_arvore(todas)
+            self._carregado_em = time.monotonic()
+            return True
+
+    def invalidar(self) -> None:
+        self._carregado_em = None
+
+    def por_id(self, db: Session, categoria_id: int) -> Optional[CategoriaInfo]:
+        recarregou = self._garantir(db)
+        cat = self._por_id.get(categoria_id)
+        if cat is None and not recarregou and self._garantir(db, forcar=True):
+            cat = self._por_id.get(categoria_id)
+        return cat
+
+    def por_texto(self, db: Session, texto: str) -> Optional[CategoriaInfo]:
+        chave = normalizar_texto(texto or "")
+        recarregou = self._garantir(db)
+        cat = self._por_texto.get(chave)
+        if cat is None and chave and not recarregou and self._garantir(db, forcar=True):
+            cat = self._por_texto.get(chave)
+        return cat
+
+    def arvore(self, db: Session) -> Tuple[bytes, str]:
+        self._garantir(db)
+        return self._arvore
+
+
+def _montar_arvore(todas) -> Tuple[bytes, str]:
+    """Categorias ativas como árvore pai -> filhos, já serializada; ETag forte = hash do corpo."""
+    nos = {
+        c.id: {"id": c.id, "tipo": c.tipo, "chave": c.chave, "nome": c.nome, "icone": c.icone,
+               "ordem": c.ordem or 0, "parent_id": c.parent_id, "filhos": []}
+        for c in todas if c.ativo is not False
+    }
+    raizes = []
+    for no in nos.values():  # `todas` já vem ordenada por (ordem, id)
+        pai = nos.get(no["parent_id"])
+        (pai["filhos"] if pai else raizes).append(no)
+
+    corpo = json.dumps(raizes, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # mesmo conteúdo --> mesmo ETag em todos os workers
+    return corpo, '"' + hashlib.sha256(corpo).hexdigest()[:32] + '"'
+
+
+_cache = _CacheCategorias()
+
+
+def categoria_por_id(db: Session, categoria_id: int) -> Optional[CategoriaInfo]:
+    return _cache.por_id(db, categoria_id)
+
+
+def categoria_por_texto(db: Session, texto: str) -> Optional[CategoriaInfo]:
+    """'Alimentação', 'alimentacao' ou 'ALIMENTACAO' -> categoria de chave 'alimentacao' (ou de mesmo nome)."""
+    return _cache.por_texto(db, texto)
+
+
+def arvore_categorias(db: Session) -> Tuple[bytes, str]:
+    """(JSON da árvore de categorias, ETag) para GET /categorias."""
+    return _cache.arvore(db)
+
+
+def invalidar_categorias() -> None:
+    _cache.invalidar()
@@ -0,0 +1,117 @@
+# contexto financeiro do usuário enviado ao Gemini pelas rotas de IA (/ia/chat, /ia/chat/stream, /ia/metas/sugerir)
+#
+# montado com agregações no banco (nenhuma transação é carregada em Python) e guardado por usuário
+# num CacheLRU com TTL curto: turnos seguidos do chat reaproveitam o mesmo contexto sem nenhuma query
+# - escritas em transações, metas e contas chamam invalidar_contexto_ia(user_id) (ver main.py)
+# - com vários workers cada processo tem o seu cache; o TTL limita quanto tempo os outros ficam desatualizados
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import os
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from cache import CacheLRU
+from categorias import categoria_por_id
+from database import Transacao, MetaTable, Conta
+
+
+CONTEXTO_IA_TTL = float(os.getenv("CONTEXTO_IA_TTL", "120"))
+CONTEXTO_IA_MAX = int(os.getenv("CONTEXTO_IA_MAX", "5000"))
+
+_contextos = CacheLRU(max_itens=CONTEXTO_IA_MAX, ttl=CONTEXTO_IA_TTL)
+
+
+def _montar_contexto(user_id: int, db: Session) -> Dict[str, Any]:
+    """3 queries: totais por (categoria, tipo) dos últimos 30 dias, metas ativas e saldo das contas."""
+    data_limite = datetime.now() - timedelta(days=30)
+
+    # totais por (categoria, tipo) num único GROUP BY; receita x despesa é separado aqui em Python
+    # (agrupar pela coluna e não por um CASE: o SQL Server não aceita parâmetros no GROUP BY)
+    linhas = db.query(
+        Transacao.categoria_id,
+        Transacao.categoria_cache,
+        Transacao.tipo,
+        func.sum(Transacao.valor),
+        func.count(Transacao.id),
+    ).filter(
+        Transacao.usuario_id == user_id,
+        Transacao.data >= data_limite
+    ).group_by(Transacao.categoria_id, Transacao.categoria_cache, Transacao.tipo).all()
+
+    gastos_por_categoria = {}
+    receitas_total = 0.0
+    despesas_total = 0.0
+    numero_transacoes = 0
+    for categoria_id, categoria_cache, tipo, total, quantidade in linhas:
+        total = float(total or 0.0)
+        numero_transacoes += int(quantidade or 0)
+        # tudo que não é receita conta como despesa
+        if tipo == "receita":
+            receitas_total += total
+            continue
+        despesas_total += total
+        categoria = categoria_por_id(db, categoria_id) if categoria_id else None
+        categoria_nome = categoria.nome if categoria else (categoria_cache or "Sem categoria")
+        gastos_por_categoria[categoria_nome] = gastos_por_categoria.get(categoria_nome, 0) + total
+
+    # metas ativas (metas não têm coluna de status: ativa = ainda não atingida)
+    metas = db.query(
+        MetaTable.titulo, MetaTable.categoria, MetaTable.valor_objetivo, MetaTable.valor_atual, MetaTable.prazo
+    ).filter(
+        MetaTable.usuario_id == user_id,
+        MetaTable.valor_atual < MetaTable.valor_objetivo
+    ).all()
+
+    metas_info = []
+    for meta in metas:
+        progresso = (meta.valor_atual / meta.valor_objetivo * 100) if meta.valor_objetivo > 0 else 0
+        metas_info.append({
+            "titulo": meta.titulo,
+            "categoria": meta.categoria,
+            "valor_objetivo": meta.valor_objetivo,
+            "valor_atual": meta.valor_atual,
+            "progresso_percentual": round(progresso, 2),
+            "prazo": meta.prazo.strftime("%Y-%m-%d") if meta.prazo else None
+        })
+
+    # saldo das contas (saldo_cache é mantido pelas rotas de transação)
+    saldo_total = db.query(func.coalesce(func.sum(Conta.saldo_cache), 0.0)).filter(
+        Conta.usuario_id == user_id
+    ).scalar() or 0.0
+
+    return {
+        "periodo_analise": "últimos 30 dias",
+        "receitas_total": round(receitas_total, 2),
+        "despesas_total": round(despesas_total, 2),
+        "saldo_periodo": round(receitas_total - despesas_total, 2),
+        "gastos_por_categoria": {k: round(v, 2) for k, v in gastos_por_categoria.items()},
+        "saldo_total_contas": round(saldo_total, 2),
+        "metas_ativas": metas_info,
+        "numero_transacoes": numero_transacoes
+    }
+
+
+def obter_contexto_financeiro(user_id: int, db: Session) -> Dict[str, Any]:
+    """
+    Coleta dados financeiros do usuário para contexto da IA.
+    O dict devolvido é compartilhado pelo cache: quem chama não deve alterá-lo.
+    """
+    contexto = _contextos.obter(user_id)
+    if contexto is None:
+        contexto = _montar_contexto(user_id, db)
+        _contextos.definir(user_id, contexto)
+    return contexto
+
+
+def invalidar_contexto_ia(user_id: Optional[int] = None) -> None:
+    """Descarta o contexto do usuário (ou de todos, sem user_id) depois de uma escrita."""
+    if user_id is None:
+        _contextos.limpar()
+    else:
+        _contextos.remover(user_id)
+
+
+def estatisticas_cache_contexto() -> Dict[str, Any]:
+    return _contextos.estatisticas()
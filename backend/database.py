@@ -1,6 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, Boolean, ForeignKey, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, validates
 from datetime import datetime, date
 import os
 from dotenv import load_dotenv
@@ -145,6 +145,42 @@ engine = create_engine(DATABASE_URL, **engine_kwargs)
 
 # cada requisição abre uma sessão, faz queries/commits e fecha 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# -------------------------
+# Engine assíncrono (opcional)
+# -------------------------
+# DB_ASYNC=1 liga o engine async para as rotas `async def` de leitura mais chamadas
+# (mesmo banco, driver async: aiosqlite no local, aioodbc no Azure SQL, asyncpg no Postgres)
+# desligado ou driver não instalado --> get_async_db entrega a sessão síncrona rodando no threadpool
+def _url_async(url: str):
+    trocas = {
+        "sqlite:": "sqlite+aiosqlite:",
+        "mssql+pyodbc:": "mssql+aioodbc:",
+        "postgresql:": "postgresql+asyncpg:",
+        "postgresql+psycopg2:": "postgresql+asyncpg:",
+    }
+    for sincrono, assincrono in trocas.items():
+        if url.startswith(sincrono):
+            return assincrono + url[len(sincrono):]
+    return None
+
+
+async_engine = None
+AsyncSessionLocal = None
+if os.getenv("DB_ASYNC", "0") == "1":
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        url_async = _url_async(DATABASE_URL)
+        if url_async is None:
+            raise ValueError("sem driver async conhecido para esta URL")
+        # connect_args do SQLite (check_same_thread) e fast_executemany são do driver síncrono
+        async_kwargs = {k: v for k, v in engine_kwargs.items() if k not in ("connect_args", "fast_executemany")}
+        async_engine = create_async_engine(url_async, **async_kwargs)
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        print("Engine assíncrono ativo:", _url_async(_mask_conn_string(DATABASE_URL)))
+    except Exception as e:
+        async_engine = AsyncSessionLocal = None
+        print("Aviso: engine assíncrono indisponível, usando o síncrono no threadpool:", repr(e))
 # === Schema alvo no Azure SQL ===
 # onde criar as tabelas 
 # SQLserver --> tabelas vivem dentro de um schema (dbo.metas) (estrutura que diz como os dados sao organizados)
@@ -187,14 +223,26 @@ UsuarioTable (1)───< (N) MetaTable
            └───< (N) Recorrencia
 """
 
+def normalizar_titulo(titulo):
+    """Chave de comparação de títulos de meta: sem espaços nas pontas e em minúsculas."""
+    return titulo.strip().lower() if titulo is not None else None
+
+
 class MetaTable(Base):
     __tablename__ = "metas"
+    __table_args__ = (
+        # sincronização das metas do perfil (PUT /perfil): busca por título sem diferenciar maiúsculas
+        Index("ix_metas_usuario_titulo_normalizado", "usuario_id", "titulo_normalizado"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     # --- ADICIONADO ---
     # Adiciona a coluna para saber quem é o dono da meta
     # (Assume que 'usuarios.id' é a chave primária da UsuarioTable)
     usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False, index=True)
     titulo = Column(String(120), nullable=False)
+    # normalizar_titulo(titulo), mantido pelo @validates abaixo (INSERT em lote via Core preenche à mão)
+    titulo_normalizado = Column(String(120), nullable=True)
     descricao = Column(String(255), nullable=True)
     categoria = Column(String(40), nullable=False, index=True)
     valor_objetivo = Column(Float, nullable=False)
@@ -202,6 +250,11 @@ class MetaTable(Base):
     prazo = Column(Date, nullable=True)
     data_criacao = Column(DateTime, default=datetime.utcnow)
 
+    @validates("titulo")
+    def _validar_titulo(self, chave, titulo):
+        self.titulo_normalizado = normalizar_titulo(titulo)
+        return titulo
+
 class Conta(Base):
     __tablename__ = "contas"
     id = Column(Integer, primary_key=True, index=True)
@@ -228,6 +281,8 @@ class Recorrencia(Base):
     alocacao_percentual = Column(Float, nullable=True)
     ativo = Column(Boolean, default=True)
     criado_em = Column(DateTime, default=datetime.utcnow)
+    # até que data as ocorrências já viraram transações (ver recorrencias.py)
+    gerada_ate = Column(Date, nullable=True)
 
 class Categoria(Base):
     __tablename__ = "categorias"
@@ -248,6 +303,12 @@ class Categoria(Base):
 
 class Transacao(Base):
     __tablename__ = "transacoes"
+    __table_args__ = (
+        # paginação por cursor (keyset) em /transacoes/pagina: filtra pelo usuário e percorre (data, id)
+        Index("ix_transacoes_usuario_data_id", "usuario_id", "data", "id"),
+        # edição/cancelamento de uma compra parcelada inteira (ver /transacoes/parcelamentos)
+        Index("ix_transacoes_usuario_parcelamento", "usuario_id", "parcelamento_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     usuario_id = Column(Integer, nullable=False, index=True)
@@ -267,6 +328,8 @@ class Transacao(Base):
 
     parcelas_total = Column(Integer, nullable=True)
     parcela_num = Column(Integer, nullable=True)
+    # mesmo uuid em todas as parcelas de uma compra (POST /transacoes/parcelada)
+    parcelamento_id = Column(String(36), nullable=True)
 
     referencia = Column(String(128), nullable=True)
     origem_import = Column(String(32), nullable=True)  # 'manual'|'csv'|'openbanking' etc.
@@ -376,6 +439,12 @@ class Orcamento(Base):
 
 class Notificacao(Base):
     __tablename__ = "notificacoes"
+    __table_args__ = (
+        # contador de não lidas (COUNT só no índice) e listagem das não lidas por data
+        Index("ix_notificacoes_usuario_lida_created", "usuario_id", "lida", "created_at"),
+        # dedup dos alertas de orçamento (ver alertas_orcamento.py)
+        Index("ix_notificacoes_usuario_referencia", "usuario_id", "referencia"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False, index=True)
@@ -384,72 +453,82 @@ class Notificacao(Base):
     mensagem = Column(Text, nullable=False)
     lida = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # identifica o evento que gerou o aviso (ex.: 'orcamento:12:202511:80'); o mesmo evento não gera 2 avisos
+    referencia = Column(String(64), nullable=True)
+
+
+# rollup mensal de transacoes: uma linha por (usuario, mês, categoria, tipo) com soma e contagem
+# mantido pelas rotas de escrita de transações (ver resumo_mensal.py) na mesma transação do banco
+class ResumoMensal(Base):
+    __tablename__ = "resumo_mensal"
+    __table_args__ = (
+        Index("ux_resumo_mensal_chave", "usuario_id", "ano_mes", "categoria_id", "tipo", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, nullable=False)
+    ano_mes = Column(Integer, nullable=False)  # ex.: 202509
+    categoria_id = Column(Integer, nullable=True)
+    tipo = Column(String(20), nullable=False)
+    total = Column(Float, nullable=False, default=0.0)
+    quantidade = Column(Integer, nullable=False, default=0)
+    atualizado_em = Column(DateTime, nullable=True)
+
+
+# faturas de cartão já fechadas: foto imutável do total do ciclo (ver faturas.py)
+# faturas abertas são sempre calculadas na hora; uma vez fechada, a leitura é uma linha desta tabela
+class Fatura(Base):
+    __tablename__ = "faturas"
+    __table_args__ = (
+        Index("ux_faturas_conta_ano_mes", "conta_id", "ano_mes", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, nullable=False, index=True)
+    conta_id = Column(Integer, nullable=False)  # conta do tipo cartão
+    ano_mes = Column(Integer, nullable=False)   # mês de referência, ex.: 202509
+    periodo_inicio = Column(Date, nullable=False)
+    periodo_fim = Column(Date, nullable=False)
+    vencimento = Column(Date, nullable=True)
+    total = Column(Float, nullable=False, default=0.0)
+    quantidade = Column(Integer, nullable=False, default=0)
+    fechada_em = Column(DateTime, default=datetime.utcnow)
 
 
 # -------------------------
 # Helpers (criar/seed/db)
 # -------------------------
-from sqlalchemy import inspect
-
-def create_tables():
-    """Cria/verifica as tabelas no schema configurado."""
-    try:
-        print(f"create_tables(): usando schema='{SCHEMA}'")
-        # checkfirst=True evita recriar; cria o que faltar
-        Base.metadata.create_all(bind=engine, checkfirst=True)
 
-        insp = inspect(engine)
+class _SessaoNoThreadpool:
+    """
+    Sessão síncrona com a mesma interface usada pelas rotas async (`await db.run_sync(funcao, ...)`),
+    para quando o engine assíncrono está desligado: a função roda no threadpool.
+    """
+    def __init__(self, sessao):
+        self.sessao = sessao
+
+    async def run_sync(self, funcao, *args, **kwargs):
+        import anyio
+        return await anyio.to_thread.run_sync(lambda: funcao(self.sessao, *args, **kwargs))
+
+
+async def get_async_db():
+    """
+    Dependency das rotas `async def`. Uso: `await db.run_sync(lambda s: s.query(...).all())`.
+    Com DB_ASYNC=1 é uma AsyncSession (a função roda sobre o driver async, sem ocupar thread);
+    senão, a sessão síncrona de sempre no threadpool.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as sessao:
+            yield sessao
+    else:
+        import anyio
+        sessao = SessionLocal()
         try:
-            print("Tabelas em dbo:", insp.get_table_names(schema="dbo"))
-        except Exception as e:
-            print("Falha ao listar dbo:", repr(e))
-        try:
-            print("Tabelas (sem schema explícito):", insp.get_table_names())
-        except Exception as e:
-            print("Falha ao listar default:", repr(e))
+            yield _SessaoNoThreadpool(sessao)
+        finally:
+            await anyio.to_thread.run_sync(sessao.close)
 
-        # --- Migrações simples (SQLite local) ---
-        # Se o banco local já existia com um schema antigo, algumas colunas podem faltar.
-        # Corrigimos automaticamente casos simples, como a ausência de `senha_hash`.
-        try:
-            if 'usuarios' in insp.get_table_names():
-                cols = [c['name'] for c in insp.get_columns('usuarios')]
-                # Se falta senha_hash, adiciona a coluna e tenta copiar de `senha` se existir
-                if 'senha_hash' not in cols:
-                    print("Migração: coluna 'senha_hash' ausente — adicionando...")
-                    with engine.connect() as conn:
-                        # Adiciona a coluna (SQLite permite ADD COLUMN)
-                        conn.exec_driver_sql("ALTER TABLE usuarios ADD COLUMN senha_hash TEXT")
-                        # Se existia coluna `senha`, copia seu conteúdo para `senha_hash`
-                        if 'senha' in cols:
-                            conn.exec_driver_sql("UPDATE usuarios SET senha_hash = senha WHERE senha_hash IS NULL OR senha_hash = ''")
-                    print("Migração: coluna 'senha_hash' adicionada com sucesso.")
-                # Se falta data_criacao, adiciona com default CURRENT_TIMESTAMP
-                if 'data_criacao' not in cols:
-                    try:
-                        print("Migração: coluna 'data_criacao' ausente — adicionando...")
-                        with engine.connect() as conn:
-                            # SQLite aceita DEFAULT CURRENT_TIMESTAMP
-                            conn.exec_driver_sql("ALTER TABLE usuarios ADD COLUMN data_criacao DATETIME DEFAULT (CURRENT_TIMESTAMP)")
-                        print("Migração: coluna 'data_criacao' adicionada com sucesso.")
-                    except Exception as e:
-                        print("Aviso: falha ao adicionar data_criacao:", repr(e))
-                # Se falta onboarding_step, adiciona com default 0 (compatibilidade)
-                if 'onboarding_step' not in cols:
-                    try:
-                        print("Migração: coluna 'onboarding_step' ausente — adicionando com default 0...")
-                        with engine.connect() as conn:
-                            # SQLite aceita ADD COLUMN
-                            conn.exec_driver_sql("ALTER TABLE usuarios ADD COLUMN onboarding_step INTEGER DEFAULT 0")
-                        print("Migração: coluna 'onboarding_step' adicionada com sucesso.")
-                    except Exception as e:
-                        print("Aviso: falha ao adicionar onboarding_step:", repr(e))
-        except Exception as e:
-            print("Aviso: falha ao aplicar migrações simples:", repr(e))
-
-        print("Tabelas criadas/verificadas com sucesso!")
-    except Exception as e:
-        print(f"Erro ao criar tabelas: {e}")
 
 def get_db():
     """Dependency para sessões do FastAPI"""
@@ -635,7 +714,7 @@ def populate_initial_data():
 Este módulo configura a conexão de banco (SQLite local ou Azure SQL via pyodbc), 
 define o ORM com SQLAlchemy (engine, SessionLocal, Base com schema para SQL Server), 
 declara todas as tabelas do domínio (usuários, metas, contas, categorias, transações, recorrências e onboarding), 
-e expõe helpers para criar o schema (create_tables), abrir/fechar sessão por request (get_db) e popular dados de exemplo em dev (populate_initial_data). 
+e expõe helpers para abrir/fechar sessão por request (get_db) e popular dados de exemplo em dev (populate_initial_data). 
 Há ajustes de pool/reconexão para nuvem, mascaramento de credenciais nos logs e compatibilidade SQLite/SQL Server (schema e connect args).
- Para produção, recomenda-se Alembic para migrações e DECIMAL para valores financeiros.
+ O schema é criado/atualizado pelas migrações versionadas de migracoes.py. Para produção, recomenda-se DECIMAL para valores financeiros.
 """
@@ -0,0 +1,202 @@
+# ciclos de fatura de cartão a partir de Conta.fechamento_cartao_dia / vencimento_cartao_dia
+#
+# convenção: a fatura de referência (ano, mes) fecha no dia de fechamento daquele mês
+# e cobre as compras de [fechamento do mês anterior, fechamento do mês) --> compra feita
+# no próprio dia do fechamento já cai na fatura seguinte ("melhor dia de compra")
+# dia 31 em meses curtos vira o último dia do mês; cartão sem fechamento configurado = mês civil
+#
+# totais saem de um SUM/COUNT no banco; fatura já fechada vira uma linha em `faturas`
+# (snapshot gravado na primeira leitura depois do fechamento), então listar o ano é uma leitura barata
+#
+# o snapshot é um cache, não uma trava: escritas em ciclos já fechados continuam permitidas
+# (lançamento retroativo, importação de extrato, parcelas, recorrências) e apagam os snapshots
+# atingidos com invalidar_faturas(), na mesma transação da escrita; mudar fechamento/vencimento
+# do cartão apaga todos os snapshots dele (PATCH /contas). A próxima leitura soma de novo e regrava
+#
+# leitura e escrita se serializam por um lock na linha do cartão em `contas` (_travar_contas,
+# UPDLOCK no SQL Server): a leitura trava antes de somar e só solta no commit do snapshot, e
+# invalidar_faturas trava antes do DELETE. Sem isso, uma escrita retroativa commitada entre a soma
+# e o INSERT do snapshot não acharia nada para apagar e o total antigo ficaria gravado
+
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, case, or_, and_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import Conta, Transacao, Fatura
+from resumo_mensal import campo_de
+
+
+def somar_meses(ano: int, mes: int, n: int) -> Tuple[int, int]:
+    """(2025, 11) + 3 -> (2026, 2)"""
+    total = ano * 12 + (mes - 1) + n
+    return total // 12, total % 12 + 1
+
+
+def dia_no_mes(ano: int, mes: int, dia: int) -> date:
+    # dia 31 em fevereiro --> último dia do mês
+    return date(ano, mes, min(dia, monthrange(ano, mes)[1]))
+
+
+def data_fechamento(ano: int, mes: int, fechamento_dia: Optional[int]) -> date:
+    """Dia em que a fatura (ano, mes) fecha; sem configuração, fecha no 1º dia do mês seguinte."""
+    if not fechamento_dia:
+        a, m = somar_meses(ano, mes, 1)
+        return date(a, m, 1)
+    return dia_no_mes(ano, mes, fechamento_dia)
+
+
+def fatura_da_compra(data: date, fechamento_dia: Optional[int]) -> Tuple[int, int]:
+    """Fatura (ano, mes) em que cai uma compra feita em `data`."""
+    if isinstance(data, datetime):
+        data = data.date()
+    if data < data_fechamento(data.year, data.month, fechamento_dia):
+        return data.year, data.month
+    return somar_meses(data.year, data.month, 1)
+
+
+def periodo_fatura(ano: int, mes: int, fechamento_dia: Optional[int]) -> Tuple[date, date]:
+    """(inicio, fim) inclusivos das compras da fatura (ano, mes)."""
+    a, m = somar_meses(ano, mes, -1)
+    return data_fechamento(a, m, fechamento_dia), data_fechamento(ano, mes, fechamento_dia) - timedelta(days=1)
+
+
+def data_vencimento(ano: int, mes: int, fechamento_dia: Optional[int], vencimento_dia: Optional[int]) -> Optional[date]:
+    """Primeiro dia de vencimento depois do fechamento da fatura (ano, mes)."""
+    if not vencimento_dia:
+        return None
+    fechamento = data_fechamento(ano, mes, fechamento_dia)
+    vencimento = dia_no_mes(fechamento.year, fechamento.month, vencimento_dia)
+    if vencimento <= fechamento:
+        a, m = somar_meses(fechamento.year, fechamento.month, 1)
+        vencimento = dia_no_mes(a, m, vencimento_dia)
+    return vencimento
+
+
+def somar_periodo(db: Session, conta: Conta, inicio: date, fim: date) -> Tuple[float, int]:
+    """
+    (total, quantidade) das transações do cartão em [inicio, fim], num único SUM/COUNT.
+    Receita lançada no cartão (estorno, crédito) abate do total.
+    """
+    assinado = case((Transacao.tipo == "receita", -Transacao.valor), else_=Transacao.valor)
+    total, quantidade = db.query(
+        func.coalesce(func.sum(assinado), 0.0),
+        func.count(Transacao.id)
+    ).filter(
+        Transacao.usuario_id == conta.usuario_id,
+        or_(Transacao.cartao_id == conta.id, Transacao.conta_id == conta.id),
+        Transacao.data >= datetime.combine(inicio, datetime.min.time()),
+        Transacao.data < datetime.combine(fim + timedelta(days=1), datetime.min.time()),
+    ).one()
+    return round(float(total or 0.0), 2), int(quantidade or 0)
+
+
+def _travar_contas(db: Session, usuario_id: int, conta_ids: Iterable[int]) -> None:
+    """
+    Lock de escrita nas contas, em ordem de id; vale até o commit/rollback.
+    O dialeto mssql ignora with_for_update(): no SQL Server vai a dica WITH (UPDLOCK, ROWLOCK).
+    No SQLite nenhum dos dois é emitido (um único escritor por banco).
+    """
+    db.execute(
+        select(Conta.id).where(Conta.usuario_id == usuario_id, Conta.id.in_(sorted(conta_ids)))
+        .with_hint(Conta, "WITH (UPDLOCK, ROWLOCK)", "mssql")
+        .order_by(Conta.id).with_for_update()
+    ).all()
+
+
+def _fatura_dict(conta: Conta, ano: int, mes: int, inicio: date, fim: date, vencimento, total, quantidade, fechada) -> Dict:
+    return {
+        "conta_cartao_id": conta.id,
+        "referencia": f"{ano:04d}-{mes:02d}",
+        "periodo_inicio": inicio,
+        "periodo_fim": fim,
+        "vencimento": vencimento,
+        "total": total,
+        "count": quantidade,
+        "fechada": fechada,
+    }
+
+
+def obter_faturas(db: Session, conta: Conta, meses: List[Tuple[int, int]], hoje: Optional[date] = None) -> List[Dict]:
+    """
+    Faturas (ano, mes) do cartão, na ordem pedida.
+    Fechadas: lidas de `faturas` (1 SELECT para todas); as que ainda não têm snapshot são somadas
+    uma vez e gravadas. Abertas/futuras: sempre somadas na hora.
+    """
+    hoje = hoje or date.today()
+    fechamento_dia = conta.fechamento_cartao_dia
+    snapshots = {
+        f.ano_mes: f for f in db.query(Fatura).filter(
+            Fatura.conta_id == conta.id,
+            Fatura.ano_mes.in_([a * 100 + m for a, m in meses])
+        ).all()
+    }
+
+    # vai gravar snapshot: trava o cartão antes de somar (ver cabeçalho)
+    if any(ano * 100 + mes not in snapshots and periodo_fatura(ano, mes, fechamento_dia)[1] < hoje
+           for ano, mes in meses):
+        _travar_contas(db, conta.usuario_id, [conta.id])
+
+    resultado, novos = [], []
+    for ano, mes in meses:
+        snap = snapshots.get(ano * 100 + mes)
+        if snap is not None:
+            resultado.append(_fatura_dict(conta, ano, mes, snap.periodo_inicio, snap.periodo_fim,
+                                          snap.vencimento, snap.total, snap.quantidade, True))
+            continue
+
+        inicio, fim = periodo_fatura(ano, mes, fechamento_dia)
+        vencimento = data_vencimento(ano, mes, fechamento_dia, conta.vencimento_cartao_dia)
+        total, quantidade = somar_periodo(db, conta, inicio, fim)
+        fechada = fim < hoje
+        if fechada:
+            novos.append(Fatura(
+                usuario_id=conta.usuario_id, conta_id=conta.id, ano_mes=ano * 100 + mes,
+                periodo_inicio=inicio, periodo_fim=fim, vencimento=vencimento,
+                total=total, quantidade=quantidade,
+            ))
+        resultado.append(_fatura_dict(conta, ano, mes, inicio, fim, vencimento, total, quantidade, fechada))
+
+    if novos:
+        try:
+            db.add_all(novos)
+            db.commit()
+        except IntegrityError:
+            # outra requisição gravou o mesmo snapshot antes; o valor calculado continua válido
+            db.rollback()
+    return resultado
+
+
+def fatura_atual(conta: Conta, hoje: Optional[date] = None) -> Tuple[int, int]:
+    """Fatura (ano, mes) aberta hoje."""
+    return fatura_da_compra(hoje or date.today(), conta.fechamento_cartao_dia)
+
+
+def invalidar_faturas(db: Session, usuario_id: int, linhas: Iterable) -> None:
+    """
+    Apaga os snapshots de fatura atingidos pelas transações em `linhas` (objetos Transacao ou dicts;
+    passe o estado antigo e o novo). Não faz commit.
+    Sem consultar o fechamento do cartão: uma compra só pode cair na fatura do próprio mês ou na
+    seguinte, então apaga as duas; recalcular uma a mais na próxima leitura é barato.
+    """
+    por_conta = {}
+    for l in linhas:
+        data = campo_de(l, "data")
+        if data is None:
+            continue
+        a, m = somar_meses(data.year, data.month, 1)
+        for conta_id in {campo_de(l, "conta_id"), campo_de(l, "cartao_id")}:
+            if conta_id:
+                por_conta.setdefault(conta_id, set()).update((data.year * 100 + data.month, a * 100 + m))
+    if not por_conta:
+        return
+    # espera uma leitura que esteja gravando snapshot destes cartões (ver cabeçalho)
+    _travar_contas(db, usuario_id, por_conta)
+    db.query(Fatura).filter(
+        Fatura.usuario_id == usuario_id,
+        or_(*[and_(Fatura.conta_id == conta_id, Fatura.ano_mes.in_(sorted(meses)))
+              for conta_id, meses in por_conta.items()])
+    ).delete(synchronize_session=False)
@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from threading import Lock
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import hashlib
+import json
 import os
+import re
+import time
 
-from database import get_db, Transacao, MetaTable, Categoria, Conta
+from database import get_db, get_async_db
+from cache import CacheLRU
+from contexto_ia import obter_contexto_financeiro
+from importacao import normalizar_texto
 from auth import pegar_usuario_atual
 from models_ia import (
     IaChatRequest, 
@@ -23,6 +31,58 @@ router = APIRouter(
     tags=["ia"]
 )
 
+# limites das chamadas ao Gemini nas rotas de chat (segundos)
+# primeiro token: quanto esperar o início da resposta | total: teto da resposta inteira
+IA_TIMEOUT_PRIMEIRO_TOKEN = float(os.getenv("IA_TIMEOUT_PRIMEIRO_TOKEN", "15"))
+IA_TIMEOUT_TOTAL = float(os.getenv("IA_TIMEOUT_TOTAL", "60"))
+
+MENSAGEM_ERRO_CHAT = "Desculpe, não consegui processar sua pergunta no momento. Por favor, tente novamente em alguns instantes."
+
+# cache de respostas: mesma pergunta (normalizada) + mesmo contexto financeiro --> mesma resposta,
+# sem pagar a latência/custo do Gemini de novo. Qualquer mudança nas finanças muda o hash do contexto.
+# ?sem_cache=true força uma resposta nova (e regrava o cache); IA_CACHE_RESPOSTAS=0 desliga de vez
+IA_CACHE_RESPOSTAS = os.getenv("IA_CACHE_RESPOSTAS", "1") != "0"
+IA_RESPOSTAS_TTL = float(os.getenv("IA_RESPOSTAS_TTL", "3600"))
+IA_RESPOSTAS_MAX = int(os.getenv("IA_RESPOSTAS_MAX", "2000"))
+
+_respostas = CacheLRU(max_itens=IA_RESPOSTAS_MAX, ttl=IA_RESPOSTAS_TTL)
+_respostas_lock = Lock()
+_respostas_ignoradas = 0  # pedidos com sem_cache (ou cache desligado)
+
+
+def _normalizar_pergunta(mensagem: str) -> str:
+    """'Como ECONOMIZAR?? ' -> 'como economizar'"""
+    return re.sub(r"[\W_]+", " ", normalizar_texto(mensagem)).strip()
+
+
+def chave_resposta_ia(rota: str, user_id: int, contexto_financeiro: Dict[str, Any], *pergunta) -> Tuple:
+    """(rota, usuário, hash do contexto, pergunta normalizada)"""
+    contexto = json.dumps(contexto_financeiro, sort_keys=True, ensure_ascii=False, default=str)
+    hash_contexto = hashlib.sha256(contexto.encode("utf-8")).hexdigest()[:32]
+    normalizada = tuple(_normalizar_pergunta(p) if isinstance(p, str) else p for p in pergunta)
+    return (rota, user_id, hash_contexto) + normalizada
+
+
+def _resposta_em_cache(chave: Tuple, sem_cache: bool):
+    global _respostas_ignoradas
+    if sem_cache or not IA_CACHE_RESPOSTAS:
+        with _respostas_lock:
+            _respostas_ignoradas += 1
+        return None
+    return _respostas.obter(chave)
+
+
+def _guardar_resposta(chave: Tuple, valor) -> None:
+    if IA_CACHE_RESPOSTAS:
+        _respostas.definir(chave, valor)
+
+
+def estatisticas_cache_respostas() -> Dict[str, Any]:
+    estatisticas = _respostas.estatisticas()
+    estatisticas["ignorados"] = _respostas_ignoradas
+    estatisticas["ativo"] = IA_CACHE_RESPOSTAS
+    return estatisticas
+
 # Configurar Gemini API
 def get_gemini_model():
     """Retorna modelo Gemini configurado"""
@@ -36,63 +96,6 @@ def get_gemini_model():
     genai.configure(api_key=api_key)
     return genai.GenerativeModel('gemini-1.5-flash')
 
-def obter_contexto_financeiro(user_id: int, db: Session) -> Dict[str, Any]:
-    """
-    Coleta dados financeiros do usuário para contexto da IA
-    """
-    # Obter transações dos últimos 30 dias
-    data_limite = datetime.now() - timedelta(days=30)
-    transacoes_recentes = db.query(Transacao).filter(
-        Transacao.usuario_id == user_id,
-        Transacao.data >= data_limite
-    ).all()
-    
-    # Calcular totais por categoria
-    gastos_por_categoria = {}
-    receitas_total = 0
-    despesas_total = 0
-    
-    for t in transacoes_recentes:
-        if t.tipo == "receita":
-            receitas_total += t.valor
-        else:
-            despesas_total += t.valor
-            categoria_nome = t.categoria.nome if t.categoria else "Sem categoria"
-            gastos_por_categoria[categoria_nome] = gastos_por_categoria.get(categoria_nome, 0) + t.valor
-    
-    # Obter metas ativas
-    metas = db.query(MetaTable).filter(
-        MetaTable.usuario_id == user_id,
-        MetaTable.status == "ativa"
-    ).all()
-    
-    metas_info = []
-    for meta in metas:
-        progresso = (meta.valor_atual / meta.valor_objetivo * 100) if meta.valor_objetivo > 0 else 0
-        metas_info.append({
-            "titulo": meta.titulo,
-            "categoria": meta.categoria,
-            "valor_objetivo": meta.valor_objetivo,
-            "valor_atual": meta.valor_atual,
-            "progresso_percentual": round(progresso, 2),
-            "prazo": meta.prazo.strftime("%Y-%m-%d") if meta.prazo else None
-        })
-    
-    # Obter saldo das contas
-    contas = db.query(Conta).filter(Conta.usuario_id == user_id).all()
-    saldo_total = sum(conta.saldo for conta in contas)
-    
-    return {
-        "periodo_analise": "últimos 30 dias",
-        "receitas_total": round(receitas_total, 2),
-        "despesas_total": round(despesas_total, 2),
-        "saldo_periodo": round(receitas_total - despesas_total, 2),
-        "gastos_por_categoria": {k: round(v, 2) for k, v in gastos_por_categoria.items()},
-        "saldo_total_contas": round(saldo_total, 2),
-        "metas_ativas": metas_info,
-        "numero_transacoes": len(transacoes_recentes)
-    }
-
 def formatar_prompt_financeiro(mensagem: str, contexto_financeiro: Dict[str, Any]) -> str:
     """
     Formata o prompt para o Gemini incluindo contexto financeiro
@@ -139,6 +142,25 @@ RESPOSTA:
     
     return prompt
 
+def gerar_acoes_sugeridas(mensagem: str) -> List[str]:
+    """Ações sugeridas a partir de palavras-chave da pergunta"""
+    acoes_sugeridas = []
+    mensagem_lower = mensagem.lower()
+    
+    if "economizar" in mensagem_lower or "poupar" in mensagem_lower:
+        acoes_sugeridas.append("Criar meta de economia mensal")
+        acoes_sugeridas.append("Revisar gastos por categoria")
+    
+    if "investir" in mensagem_lower or "investimento" in mensagem_lower:
+        acoes_sugeridas.append("Analisar saldo disponível para investimento")
+        acoes_sugeridas.append("Definir percentual de investimento mensal")
+    
+    if "dívida" in mensagem_lower or "divida" in mensagem_lower:
+        acoes_sugeridas.append("Listar todas as dívidas com juros")
+        acoes_sugeridas.append("Criar plano de quitação")
+    
+    return acoes_sugeridas
+
 @router.get("/ping")
 def ia_ping(
     user_id: int = Depends(pegar_usuario_atual),
@@ -170,51 +192,52 @@ def ia_ping(
             "user_id": user_id
         }
 
+# async: a chamada ao Gemini (segundos) não prende uma thread do threadpool
 @router.post("/chat", response_model=IaChatResponse)
-def chat_financeiro_ia(
+async def chat_financeiro_ia(
     dados: IaChatRequest,
+    response: Response,
+    sem_cache: bool = False,
     user_id: int = Depends(pegar_usuario_atual),
-    db: Session = Depends(get_db)
+    db = Depends(get_async_db)
 ):
     """
     Endpoint de chat financeiro com IA Gemini.
     Analisa a pergunta do usuário e responde com base nos dados financeiros reais.
+    Para receber a resposta aos poucos, use POST /ia/chat/stream.
+    Pergunta repetida com as finanças inalteradas sai do cache (header X-Cache: HIT).
     """
     try:
         # 1. Obter contexto financeiro do usuário
-        contexto_financeiro = obter_contexto_financeiro(user_id, db)
+        contexto_financeiro = await db.run_sync(lambda s: obter_contexto_financeiro(user_id, s))
+        
+        chave = chave_resposta_ia("chat", user_id, contexto_financeiro, dados.mensagem)
+        em_cache = _resposta_em_cache(chave, sem_cache)
+        if em_cache is not None:
+            response.headers["X-Cache"] = "HIT"
+            return em_cache
+        response.headers["X-Cache"] = "MISS"
         
         # 2. Formatar prompt com contexto
         prompt = formatar_prompt_financeiro(dados.mensagem, contexto_financeiro)
         
-        # 3. Chamar Gemini
+        # 3. Chamar Gemini (com teto de tempo)
         model = get_gemini_model()
-        response = model.generate_content(prompt)
+        resultado_ia = await asyncio.wait_for(model.generate_content_async(prompt), timeout=IA_TIMEOUT_TOTAL)
         
         # 4. Extrair resposta
-        resposta_texto = response.text
+        resposta_texto = resultado_ia.text
         
         # 5. Gerar ações sugeridas (opcional, baseado em palavras-chave)
-        acoes_sugeridas = []
-        mensagem_lower = dados.mensagem.lower()
-        
-        if "economizar" in mensagem_lower or "poupar" in mensagem_lower:
-            acoes_sugeridas.append("Criar meta de economia mensal")
-            acoes_sugeridas.append("Revisar gastos por categoria")
+        acoes_sugeridas = gerar_acoes_sugeridas(dados.mensagem)
         
-        if "investir" in mensagem_lower or "investimento" in mensagem_lower:
-            acoes_sugeridas.append("Analisar saldo disponível para investimento")
-            acoes_sugeridas.append("Definir percentual de investimento mensal")
-        
-        if "dívida" in mensagem_lower or "divida" in mensagem_lower:
-            acoes_sugeridas.append("Listar todas as dívidas com juros")
-            acoes_sugeridas.append("Criar plano de quitação")
-        
-        return IaChatResponse(
+        resposta = IaChatResponse(
             resposta=resposta_texto,
             acoes_sugeridas=acoes_sugeridas if acoes_sugeridas else None,
             debug=None  # Em produção, não enviar debug
         )
+        _guardar_resposta(chave, resposta)
+        return resposta
         
     except HTTPException:
         raise
@@ -223,25 +246,153 @@ def chat_financeiro_ia(
         print(f"Erro no chat IA: {str(e)}")
         
         return IaChatResponse(
-            resposta="Desculpe, não consegui processar sua pergunta no momento. Por favor, tente novamente em alguns instantes.",
+            resposta=MENSAGEM_ERRO_CHAT,
             acoes_sugeridas=None,
             debug={"erro": str(e)} if os.getenv("DEBUG") else None
         )
 
+def _evento_sse(evento: str, dados: Dict[str, Any]) -> str:
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+async def _stream_chat(request: Request, prompt: str, mensagem: str, contexto_debug: Optional[Dict[str, Any]],
+                       chave: Tuple, em_cache: Optional[IaChatResponse]):
+    """
+    Repassa os pedaços da resposta do Gemini como eventos SSE assim que chegam:
+        event: token  data: {"texto": "..."}          (vários)
+        event: fim    data: {"acoes_sugeridas": [...], "primeiro_token_ms": ..., "total_ms": ..., "cache": bool}
+        event: erro   data: {"mensagem": "...", "motivo": "timeout" | "falha"}
+    Cliente que desconecta cancela a geração; o teto IA_TIMEOUT_TOTAL vale para a resposta inteira.
+    Resposta em cache sai num único token; resposta completa nova é guardada no mesmo cache de /ia/chat.
+    """
+    inicio = time.monotonic()
+    if em_cache is not None:
+        yield _evento_sse("token", {"texto": em_cache.resposta})
+        yield _evento_sse("fim", {"acoes_sugeridas": em_cache.acoes_sugeridas, "primeiro_token_ms": 0,
+                                  "total_ms": 0, "cache": True})
+        return
+
+    limite = inicio + IA_TIMEOUT_TOTAL
+    primeiro_token_ms = None
+    stream = pedacos = None
+    textos = []
+    try:
+        model = get_gemini_model()
+        stream = await asyncio.wait_for(
+            model.generate_content_async(prompt, stream=True),
+            timeout=min(IA_TIMEOUT_PRIMEIRO_TOKEN, IA_TIMEOUT_TOTAL)
+        )
+        pedacos = stream.__aiter__()
+        while True:
+            # até o primeiro token vale o limite menor; depois, o que sobra do total
+            restante = limite - time.monotonic()
+            if primeiro_token_ms is None:
+                restante = min(restante, inicio + IA_TIMEOUT_PRIMEIRO_TOKEN - time.monotonic())
+            if restante <= 0:
+                raise asyncio.TimeoutError()
+            try:
+                pedaco = await asyncio.wait_for(pedacos.__anext__(), timeout=restante)
+            except StopAsyncIteration:
+                break
+
+            if await request.is_disconnected():
+                # ninguém mais lendo: para de consumir o Gemini
+                return
+            texto = getattr(pedaco, "text", "") or ""
+            if not texto:
+                continue
+            if primeiro_token_ms is None:
+                primeiro_token_ms = round((time.monotonic() - inicio) * 1000)
+            textos.append(texto)
+            yield _evento_sse("token", {"texto": texto})
+
+        acoes_sugeridas = gerar_acoes_sugeridas(mensagem)
+        if textos:
+            _guardar_resposta(chave, IaChatResponse(resposta="".join(textos), acoes_sugeridas=acoes_sugeridas or None))
+        yield _evento_sse("fim", {
+            "acoes_sugeridas": acoes_sugeridas or None,
+            "primeiro_token_ms": primeiro_token_ms,
+            "total_ms": round((time.monotonic() - inicio) * 1000),
+            "cache": False,
+        })
+    except asyncio.TimeoutError:
+        print(f"Timeout no chat IA (stream) após {time.monotonic() - inicio:.1f}s")
+        yield _evento_sse("erro", {"mensagem": MENSAGEM_ERRO_CHAT, "motivo": "timeout"})
+    except asyncio.CancelledError:
+        # desconexão do cliente durante a espera: o servidor cancela esta tarefa
+        raise
+    except Exception as e:
+        print(f"Erro no chat IA (stream): {str(e)}")
+        erro = {"mensagem": MENSAGEM_ERRO_CHAT, "motivo": "falha"}
+        if os.getenv("DEBUG"):
+            erro["debug"] = {"erro": str(e), **(contexto_debug or {})}
+        yield _evento_sse("erro", erro)
+    finally:
+        # desconexão/timeout no meio da resposta: encerra o iterador e cancela a chamada gRPC
+        if pedacos is not None:
+            try:
+                await pedacos.aclose()
+            except Exception:
+                pass
+        cancelar = getattr(getattr(stream, "_iterator", None), "cancel", None)
+        if cancelar is not None:
+            try:
+                cancelar()
+            except Exception:
+                pass
+
+
+@router.post("/chat/stream")
+async def chat_financeiro_ia_stream(
+    dados: IaChatRequest,
+    request: Request,
+    sem_cache: bool = False,
+    user_id: int = Depends(pegar_usuario_atual),
+    db = Depends(get_async_db)
+):
+    """
+    Chat financeiro em streaming (text/event-stream): mesma pergunta/contexto de POST /ia/chat,
+    mas os tokens são enviados conforme o Gemini gera, em vez de esperar a resposta inteira.
+    """
+    contexto_financeiro = await db.run_sync(lambda s: obter_contexto_financeiro(user_id, s))
+    prompt = formatar_prompt_financeiro(dados.mensagem, contexto_financeiro)
+    chave = chave_resposta_ia("chat", user_id, contexto_financeiro, dados.mensagem)
+
+    return StreamingResponse(
+        _stream_chat(request, prompt, dados.mensagem, {"user_id": user_id}, chave, _resposta_em_cache(chave, sem_cache)),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # proxies (nginx/App Service) não seguram o stream em buffer
+        },
+    )
+
 @router.post("/metas/sugerir", response_model=IaMetasResponse)
 def sugerir_metas_ia(
     dados: IaMetasRequest,
+    response: Response,
+    sem_cache: bool = False,
     user_id: int = Depends(pegar_usuario_atual),
     db: Session = Depends(get_db),
 ):
     """
     Sugere metas financeiras personalizadas usando IA Gemini.
     Analisa o perfil financeiro do usuário e gera recomendações.
+    Mesmo objetivo/horizonte com as finanças inalteradas sai do cache (header X-Cache: HIT).
     """
+    contexto_financeiro = None
     try:
         # 1. Obter contexto financeiro
         contexto_financeiro = obter_contexto_financeiro(user_id, db)
         
+        chave = chave_resposta_ia("metas", user_id, contexto_financeiro,
+                                  dados.objetivo_principal or "", dados.horizonte_meses or 6)
+        em_cache = _resposta_em_cache(chave, sem_cache)
+        if em_cache is not None:
+            response.headers["X-Cache"] = "HIT"
+            return em_cache
+        response.headers["X-Cache"] = "MISS"
+        
         # 2. Montar prompt para sugestão de metas
         prompt = f"""Você é a IA Monevo, especialista em planejamento financeiro pessoal.
 
@@ -285,14 +436,14 @@ Seja realista com os valores e prazos considerando a renda do usuário.
         
         # 3. Chamar Gemini
         model = get_gemini_model()
-        response = model.generate_content(prompt)
+        resultado_ia = model.generate_content(prompt)
         
         # 4. Parsear resposta JSON
         import json
         import re
         
         # Extrair JSON da resposta (pode vir com markdown)
-        texto_resposta = response.text
+        texto_resposta = resultado_ia.text
         json_match = re.search(r'\{.*\}', texto_resposta, re.DOTALL)
         
         if json_match:
@@ -309,10 +460,13 @@ Seja realista com os valores e prazos considerando a renda do usuário.
                     passos_semanais=meta_data.get("passos_semanais")
                 ))
             
-            return IaMetasResponse(
+            resposta = IaMetasResponse(
                 metas=metas_sugeridas,
                 resumo_plano=dados_json.get("resumo_plano", "Plano personalizado gerado pela IA")
             )
+            # só respostas do Gemini entram no cache; o fallback genérico não
+            _guardar_resposta(chave, resposta)
+            return resposta
         else:
             # Fallback: criar meta genérica
             raise ValueError("Não foi possível parsear resposta da IA")
@@ -320,8 +474,9 @@ Seja realista com os valores e prazos considerando a renda do usuário.
     except Exception as e:
         print(f"Erro ao sugerir metas: {str(e)}")
         
-        # Fallback: retornar meta genérica baseada no contexto
-        contexto_financeiro = obter_contexto_financeiro(user_id, db)
+        # Fallback: retornar meta genérica baseada no contexto (reaproveita o já montado)
+        if contexto_financeiro is None:
+            contexto_financeiro = obter_contexto_financeiro(user_id, db)
         saldo_disponivel = contexto_financeiro['saldo_total_contas']
         
         meta_generica = IaMetaSugerida(
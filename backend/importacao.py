@@ -0,0 +1,121 @@
+# leitura de extratos bancários (CSV / OFX) para POST /transacoes/importar
+# os leitores são geradores: percorrem o arquivo linha a linha e entregam um lançamento por vez,
+# então a memória fica limitada ao lote que a rota está montando, não ao tamanho do arquivo
+#
+# cada lançamento sai como (numero_da_linha, dict de strings brutas):
+#     {"data": ..., "valor": ..., "descricao": ..., "categoria": ..., "tipo": ..., "referencia": ...}
+# a conversão de valor/tipo e a validação ficam na rota (main.py), que monta o relatório de erros
+
+import csv
+import re
+import unicodedata
+from datetime import datetime
+from typing import Dict, Iterator, Optional, TextIO, Tuple
+
+
+# nomes de coluna aceitos no CSV (já normalizados: minúsculo, sem acento, espaço -> _)
+COLUNAS_CSV = {
+    "data": ["data", "date", "dt", "data_lancamento", "data_transacao", "data_movimento"],
+    "valor": ["valor", "value", "amount", "quantia", "valor_(r$)", "valor_r$"],
+    "descricao": ["descricao", "description", "historico", "memo", "lancamento", "estabelecimento", "titulo"],
+    "categoria": ["categoria", "category"],
+    "tipo": ["tipo", "type"],
+    "referencia": ["referencia", "id", "fitid", "documento", "identificador"],
+}
+
+FORMATOS_DATA = ["%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%d-%m-%Y", "%d.%m.%Y"]
+
+
+def normalizar_texto(texto: str) -> str:
+    """'Data Lançamento ' -> 'data_lancamento'"""
+    sem_acento = unicodedata.normalize("NFKD", texto or "").encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"\s+", "_", sem_acento.strip().lower())
+
+
+def parse_data(texto: str) -> Optional[datetime]:
+    """Aceita os formatos comuns de extrato (dd/mm/aaaa, ISO) e o DTPOSTED do OFX (AAAAMMDD[HHMMSS][.XXX][TZ])."""
+    texto = (texto or "").strip()
+    if not texto:
+        return None
+    if re.match(r"^\d{8}", texto):
+        digitos = re.match(r"^\d+", texto).group()
+        try:
+            if len(digitos) >= 14:
+                return datetime.strptime(digitos[:14], "%Y%m%d%H%M%S")
+            return datetime.strptime(digitos[:8], "%Y%m%d")
+        except ValueError:
+            return None
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            continue
+    return None
+
+
+def ler_csv(arquivo: TextIO) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Lê CSV com cabeçalho; detecta o separador (; , ou tab) pela primeira amostra do arquivo."""
+    amostra = arquivo.read(4096)
+    arquivo.seek(0)
+    try:
+        dialeto = csv.Sniffer().sniff(amostra, delimiters=";,\t")
+    except csv.Error:
+        dialeto = csv.excel
+
+    leitor = csv.reader(arquivo, dialeto)
+    cabecalho = next(leitor, None)
+    if not cabecalho:
+        return
+
+    # posição de cada campo conhecido no cabeçalho
+    posicoes = {}
+    normalizados = [normalizar_texto(c) for c in cabecalho]
+    for campo, aliases in COLUNAS_CSV.items():
+        for i, nome in enumerate(normalizados):
+            if nome in aliases:
+                posicoes[campo] = i
+                break
+    if "data" not in posicoes or "valor" not in posicoes:
+        raise ValueError("CSV precisa das colunas 'data' e 'valor' no cabeçalho")
+
+    for linha in leitor:
+        if not any(c.strip() for c in linha):
+            continue
+        yield leitor.line_num, {
+            campo: (linha[i].strip() if i < len(linha) else "")
+            for campo, i in posicoes.items()
+        }
+
+
+_TAG_OFX = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)")
+
+
+def ler_ofx(arquivo: TextIO) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """
+    Lê os blocos <STMTTRN> de um OFX (SGML 1.x, com ou sem tags de fechamento, ou XML 2.x).
+    Cabeçalho e demais blocos do arquivo são ignorados.
+    """
+    atual = None
+    inicio = 0
+    for numero, linha in enumerate(arquivo, start=1):
+        for fecha, tag, valor in _TAG_OFX.findall(linha):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if fecha and atual is not None:
+                    yield inicio, _lancamento_ofx(atual)
+                    atual = None
+                elif not fecha:
+                    atual, inicio = {}, numero
+            elif atual is not None and not fecha and valor.strip():
+                atual[tag] = valor.strip()
+
+
+def _lancamento_ofx(bloco: Dict[str, str]) -> Dict[str, str]:
+    return {
+        "data": bloco.get("DTPOSTED", ""),
+        "valor": bloco.get("TRNAMT", ""),
+        "descricao": bloco.get("MEMO") or bloco.get("NAME") or "",
+        "referencia": bloco.get("FITID", ""),
+        "categoria": "",
+        "tipo": "",
+    }
@@ -1,11 +1,23 @@
 from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse # ADICIONADO: Para redirecionar no OAuth
+from fastapi.responses import RedirectResponse, Response, StreamingResponse # ADICIONADO: Para redirecionar no OAuth
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import or_, func
+from sqlalchemy import or_, and_, func, extract, insert, select, update, delete, case
+from sqlalchemy.exc import IntegrityError
+from pydantic import ValidationError
 from typing import List, Optional
+from collections import defaultdict
 import os
-from datetime import datetime, date
+import base64
+import codecs
+import csv
+import io
+import asyncio
+import json
+import uuid
+import time
+from datetime import datetime, date, timedelta
 
 # --- NOVAS IMPORTAÇÕES GOOGLE AUTH ---
 from starlette.middleware.sessions import SessionMiddleware
@@ -14,7 +26,7 @@ from jose import jwt
 from dotenv import load_dotenv
 # -------------------------------------
 
-# senha hashing via auth.criar_hash_senha
+# senha hashing via auth.criar_hash_senha_async (pool de processos)
 
 
 from contextlib import asynccontextmanager
@@ -24,14 +36,18 @@ import os, logging
 #validam request e formatam a response
 from models import (
     Meta, MetaCreate, MetaUpdate,
-    CategoriaRead, CategoriaCreate, CategoriaUpdate,
+    CategoriaRead, CategoriaCreate, CategoriaUpdate, CategoriaArvore,
     ContaCreate, ContaRead, ContaUpdate,
     RecorrenciaCreate, RecorrenciaRead, RecorrenciaUpdate,
-    TransacaoCreate, TransacaoRead, TransacaoUpdate,
+    TransacaoCreate, TransacaoRead, TransacaoUpdate, TransacaoPagina,
+    TransacaoLote, TransacaoLoteResultado,
+    TransacaoParceladaCreate, TransacaoParceladaUpdate, TransacaoParceladaRead,
+    ImportacaoResultado,
     FaturaRead,
+    ResumoRead, ResumoMensalRead,
     Usuario, UsuarioCreate, LoginResponse,
     OnboardingCreate, OnboardingRead, OnboardingUpdate,
-    NotificacaoRead, NotificacaoUpdate
+    NotificacaoRead, NotificacaoUpdate, NotificacaoPagina, NotificacoesLer
 )
 
 #importando as entidades e tabelas
@@ -39,19 +55,38 @@ from models import (
 #sqlaclhemy 
 
 from database import (
-    get_db, create_tables, populate_initial_data,
+    get_db, get_async_db, async_engine, populate_initial_data,
     Conta, Recorrencia, Categoria, Transacao, MetaTable, UsuarioTable,
     OnboardingProfileTable, OnboardingGoalTable,
-    Orcamento, Notificacao
+    Orcamento, Notificacao, ResumoMensal, Fatura, normalizar_titulo
 )
+from resumo_mensal import atualizar_resumo_mensal
+from saldos import atualizar_saldos
+from recorrencias import materializar_recorrencias
+from faturas import (
+    fatura_da_compra, periodo_fatura, somar_meses, dia_no_mes,
+    somar_periodo, obter_faturas, fatura_atual, invalidar_faturas
+)
+from categorias import categoria_por_id, categoria_por_texto, invalidar_categorias, arvore_categorias
+from migracoes import preparar_schema
+from contexto_ia import invalidar_contexto_ia, estatisticas_cache_contexto
+from perfil import (
+    carregar_perfil, montar_perfil, serializar_metas, estatisticas_cache_perfil,
+)
+from alertas_orcamento import verificar_orcamentos_transacoes
+from notificacoes_tempo_real import hub as hub_notificacoes, notificacoes_desde, NOTIF_HEARTBEAT
+from importacao import ler_csv, ler_ofx, parse_data, normalizar_texto
 
 #autenticação 
 #rotas de login/registro 
 #usa token JWT 
-from auth import pegar_usuario_atual, criar_hash_senha, criar_token
+from auth import (
+    pegar_usuario_atual, pegar_usuario_stream, criar_hash_senha_async, criar_token, criar_token_stream,
+    estatisticas_cache_tokens, encerrar_pool_senhas, SENHA_INUTILIZAVEL, STREAM_TOKEN_SEGUNDOS
+)
 from auth_routes import router as auth_router
 
-from ia_routes import router as ia_router
+from ia_routes import router as ia_router, estatisticas_cache_respostas
 
 # --- CONFIGURAÇÃO GOOGLE AUTH ---
 load_dotenv()
@@ -93,13 +128,20 @@ def _parse_currency(value):
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("app")
 
+# tempo do startup e versão do schema, expostos no GET /
+estado_startup = {}
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
         #STARTUP: roda ates do app aceitar requisições
         logger.info("Lifespan: startup")
-        create_tables()
+        inicio = time.perf_counter()
+        # banco em dia = 1 query de versão; migrações rodam com `python migracoes.py` (ver migracoes.py)
+        estado_startup["schema"] = preparar_schema()
         populate_initial_data() #so faz sentido localmente
+        estado_startup["ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        logger.info(f"Startup em {estado_startup['ms']} ms (schema: {estado_startup['schema']})")
         if os.getenv("WEBSITE_INSTANCE_ID"):
             logger.info("Azure App Service detectado")
         else:
@@ -110,6 +152,10 @@ async def lifespan(app: FastAPI):
         # raise  # se quiser falhar hard
     finally:
         logger.info("Lifespan: shutdown")
+        encerrar_pool_senhas()
+        await hub_notificacoes.encerrar()
+        if async_engine is not None:
+            await async_engine.dispose()
         #SHUTDOWN: roda quando o app vai encerrar --> fecha conexões, limpa recursos, etc.
 
 
@@ -210,14 +256,11 @@ async def google_auth_callback(request: Request, db: Session = Depends(get_db)):
         user = db.query(UsuarioTable).filter(UsuarioTable.email == email).first()
 
         if not user:
-            # novo usuário via Google
-            temp_senha = os.urandom(16).hex()
-            senha_hash = criar_hash_senha(temp_senha)
-
+            # novo usuário via Google: sem senha local (marcador que verificar_senha recusa)
             novo_usuario = UsuarioTable(
                 email=email,
                 nome=name,
-                senha_hash=senha_hash,
+                senha_hash=SENHA_INUTILIZAVEL,
                 onboarding_step=0,
             )
             db.add(novo_usuario)
@@ -277,7 +320,21 @@ def root():
     #checa o banco usado se for no azure ou local
     banco = "SQL Server" if not os.getenv("DATABASE_URL", "").startswith("sqlite") else "SQLite"
     #devolve o json com as infos corretas 
-    return {"message": "Monevo API - Gestão de Metas Financeiras", "ambiente": ambiente, "banco": banco}
+    return {
+        "message": "Monevo API - Gestão de Metas Financeiras",
+        "ambiente": ambiente,
+        "banco": banco,
+        "banco_async": async_engine is not None,
+        # contadores dos caches em memória deste processo
+        "caches": {
+            "tokens": estatisticas_cache_tokens(),
+            "contexto_ia": estatisticas_cache_contexto(),
+            "respostas_ia": estatisticas_cache_respostas(),
+            "perfil": estatisticas_cache_perfil(),
+        },
+        "notificacoes_stream": hub_notificacoes.estatisticas(),
+        "startup": estado_startup,
+    }
 
 
 #METAS --------------------------------
@@ -291,15 +348,17 @@ def root():
 #depends = injeção de dependencias 
 # podemos reaproveitar lógica em varias rotas 
 #antes de rodar, as dependencias são chamadas automaticamente e o valor retornado é injetado nos parametros (user_id e db)
+# async: rota muito chamada pelo dashboard (ver get_async_db em database.py)
 @app.get("/metas", response_model=List[Meta])
-def listar_metas(
+async def listar_metas(
     user_id: int = Depends(pegar_usuario_atual), #autentica o usuario via token
-    db: Session = Depends(get_db) #abre uma sesao com o banco e fecha automaticamente
+    db = Depends(get_async_db) #abre uma sesao com o banco e fecha automaticamente
 ):
-    metas = db.query(MetaTable).filter(
-        MetaTable.usuario_id == user_id
-    ).order_by(MetaTable.data_criacao.desc()).all()
-    return metas
+    def consultar(s: Session):
+        return s.query(MetaTable).filter(
+            MetaTable.usuario_id == user_id
+        ).order_by(MetaTable.data_criacao.desc()).all()
+    return await db.run_sync(consultar)
 
 # criar meta 
 # validação de negocio: impede metas incoerentes 
@@ -325,6 +384,7 @@ def criar_meta(
     )
     db.add(nova)
     db.commit()
+    invalidar_contexto_ia(user_id)
     db.refresh(nova)
     return nova
 
@@ -381,6 +441,7 @@ def atualizar_meta(
 
     db.add(m)
     db.commit()
+    invalidar_contexto_ia(user_id)
     db.refresh(m)
     return m
 
@@ -418,6 +479,7 @@ def substituir_meta(
 
     db.add(m)
     db.commit()
+    invalidar_contexto_ia(user_id)
     db.refresh(m)
     return m
 """
@@ -437,6 +499,7 @@ def deletar_meta(
         raise HTTPException(status_code=404, detail="Meta não encontrada")
     db.delete(m)
     db.commit()
+    invalidar_contexto_ia(user_id)
     return {}
 
 #retorna 204 No Content se deleta com sucesso 
@@ -444,6 +507,17 @@ def deletar_meta(
 
 # CATEGORIAS ------------------------------------------
 
+# árvore completa para o seletor de categorias; JSON e ETag vêm prontos do cache (categorias.py)
+# If-None-Match igual --> 304 sem corpo; em regime normal nenhuma query no banco
+@app.get("/categorias", response_model=List[CategoriaArvore])
+def listar_categorias(request: Request, db: Session = Depends(get_db)):
+    corpo, etag = arvore_categorias(db)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [e.strip() for e in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=corpo, media_type="application/json", headers=headers)
+
 @app.get("/categorias/{categoria_id}", response_model=CategoriaRead)
 def buscar_categoria(categoria_id: int, db: Session = Depends(get_db)):
     c = db.query(Categoria).filter(Categoria.id == categoria_id).first()
@@ -467,6 +541,7 @@ def criar_categoria(payload: CategoriaCreate, db: Session = Depends(get_db)):
     db.add(c)
     db.commit()
     db.refresh(c)
+    invalidar_categorias()
     return c
 
 # atualiza parcial com exclude_unset
@@ -481,6 +556,7 @@ def atualizar_categoria(categoria_id: int, payload: CategoriaUpdate, db: Session
     db.add(c)
     db.commit()
     db.refresh(c)
+    invalidar_categorias()
     return c
 
 @app.delete("/categorias/{categoria_id}", status_code=204)
@@ -490,6 +566,7 @@ def deletar_categoria(categoria_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Categoria não encontrada")
     db.delete(c)
     db.commit()
+    invalidar_categorias()
     return {}
 
 #possiveis ajustes:
@@ -506,6 +583,7 @@ def listar_contas(
     db: Session = Depends(get_db)
 ):
     # Sempre filtra pelo usuário do token, não pelo query param
+    # saldo_cache já vem atualizado pelas rotas de transação (saldos.py) --> nenhuma soma por requisição
     q = db.query(Conta).filter(Conta.usuario_id == user_id)
     return q.order_by(Conta.id.desc()).all()
 
@@ -522,6 +600,7 @@ def criar_conta(payload: ContaCreate, user_id: int = Depends(pegar_usuario_atual
     )
     db.add(c)
     db.commit()
+    invalidar_contexto_ia(user_id)
     db.refresh(c)
     return c
 
@@ -550,10 +629,17 @@ def atualizar_conta(conta_id: int, payload: ContaUpdate, user_id: int = Depends(
     if c.usuario_id != user_id:
         raise HTTPException(status_code=403, detail="Você não pode editar esta conta")
     data = payload.dict(exclude_unset=True)
+    ciclo_mudou = any(
+        k in data and data[k] != getattr(c, k) for k in ("fechamento_cartao_dia", "vencimento_cartao_dia")
+    )
     for k, v in data.items():
         setattr(c, k, v)
+    if ciclo_mudou:
+        # períodos/vencimentos das faturas mudam: snapshots antigos não valem mais
+        db.query(Fatura).filter(Fatura.conta_id == c.id).delete(synchronize_session=False)
     db.add(c)
     db.commit()
+    invalidar_contexto_ia(user_id)
     db.refresh(c)
     return c
 
@@ -565,8 +651,12 @@ def deletar_conta(conta_id: int, user_id: int = Depends(pegar_usuario_atual), db
         raise HTTPException(status_code=404, detail="Conta não encontrada")
     if c.usuario_id != user_id:
         raise HTTPException(status_code=403, detail="Você não pode deletar esta conta")
+    # as transações da conta caem junto (cascade) --> tira do rollup mensal
+    atualizar_resumo_mensal(db, removidas=list(c.transacoes))
+    db.query(Fatura).filter(Fatura.conta_id == c.id).delete(synchronize_session=False)
     db.delete(c)
     db.commit()
+    invalidar_contexto_ia(user_id)
     return {}
 
 
@@ -584,8 +674,15 @@ def listar_recorrencias(
 
 
 
+# a materialização debita/credita conta_id: só vale conta do próprio usuário
+def _verificar_conta_do_usuario(db: Session, user_id: int, conta_id: Optional[int]) -> None:
+    if conta_id and not db.query(Conta.id).filter(Conta.id == conta_id, Conta.usuario_id == user_id).first():
+        raise HTTPException(status_code=404, detail="Conta não encontrada")
+
+
 @app.post("/recorrencias", response_model=RecorrenciaRead, status_code=201)
 def criar_recorrencia(payload: RecorrenciaCreate, user_id: int = Depends(pegar_usuario_atual), db: Session = Depends(get_db)):
+    _verificar_conta_do_usuario(db, user_id, payload.conta_id)
     # Usa o usuário autenticado como dono da recorrência
     r = Recorrencia(
         usuario_id=user_id,
@@ -604,6 +701,22 @@ def criar_recorrencia(payload: RecorrenciaCreate, user_id: int = Depends(pegar_u
     return r
 
 
+@app.post("/recorrencias/materializar")
+def materializar_minhas_recorrencias(
+    ate: Optional[date] = None,  # horizonte AAAA-MM-DD (padrão: hoje)
+    user_id: int = Depends(pegar_usuario_atual),
+    db: Session = Depends(get_db),
+):
+    # gera agora as transações das recorrências do usuário (o job noturno faz o mesmo para todos)
+    horizonte = ate or date.today()
+    if horizonte > date.today() + timedelta(days=366):
+        raise HTTPException(status_code=422, detail="Horizonte máximo de 1 ano")
+    geradas = materializar_recorrencias(db, horizonte, usuario_id=user_id)
+    if geradas:
+        invalidar_contexto_ia(user_id)
+    return {"geradas": geradas, "ate": horizonte.isoformat()}
+
+
 @app.get("/recorrencias/{rec_id}", response_model=RecorrenciaRead)
 def buscar_recorrencia(
     rec_id: int, 
@@ -627,6 +740,7 @@ def atualizar_recorrencia(rec_id: int, payload: RecorrenciaUpdate, user_id: int
     if r.usuario_id != user_id:
         raise HTTPException(status_code=403, detail="Você não pode editar esta recorrência")
     data = payload.dict(exclude_unset=True)
+    _verificar_conta_do_usuario(db, user_id, data.get("conta_id"))
     for k, v in data.items():
         setattr(r, k, v)
     db.add(r)
@@ -642,6 +756,10 @@ def deletar_recorrencia(rec_id: int, user_id: int = Depends(pegar_usuario_atual)
         raise HTTPException(status_code=404, detail="Recorrência não encontrada")
     if r.usuario_id != user_id:
         raise HTTPException(status_code=403, detail="Você não pode deletar esta recorrência")
+    # transações já geradas ficam; só perdem o vínculo
+    db.query(Transacao).filter(Transacao.recorrencia_id == r.id).update(
+        {Transacao.recorrencia_id: None}, synchronize_session=False
+    )
     db.delete(r)
     db.commit()
     return {}
@@ -651,7 +769,7 @@ def deletar_recorrencia(rec_id: int, user_id: int = Depends(pegar_usuario_atual)
 # Transações (CRUD + filtros + lógica de meta)
 # -------------------------
 @app.get("/transacoes", response_model=List[TransacaoRead])
-def listar_transacoes(
+async def listar_transacoes(
     # Parâmetros de filtro
     conta_id: Optional[int] = None,
     tipo: Optional[str] = None,
@@ -663,12 +781,19 @@ def listar_transacoes(
     limit: int = 100,
     # Segurança
     user_id: int = Depends(pegar_usuario_atual),
-    db: Session = Depends(get_db)
+    db = Depends(get_async_db)
 ):
-    # Filtra sempre pelo usuário do token
-    q = db.query(Transacao).filter(Transacao.usuario_id == user_id) 
-    
-    # Filtros adicionais (opcionais)
+    def consultar(s: Session):
+        # Filtra sempre pelo usuário do token
+        q = s.query(Transacao).filter(Transacao.usuario_id == user_id)
+        q = _filtrar_transacoes(q, conta_id, tipo, categoria_id, meta_id, date_from, date_to)
+        q = q.order_by(Transacao.data.desc()).offset(skip).limit(limit)
+        return q.all()
+    return await db.run_sync(consultar)
+
+
+# filtros opcionais compartilhados por /transacoes e /transacoes/pagina
+def _filtrar_transacoes(q, conta_id, tipo, categoria_id, meta_id, date_from, date_to):
     if conta_id:
         q = q.filter(Transacao.conta_id == conta_id)
     if tipo:
@@ -681,20 +806,139 @@ def listar_transacoes(
         q = q.filter(Transacao.data >= date_from)
     if date_to:
         q = q.filter(Transacao.data <= date_to)
-    
-    q = q.order_by(Transacao.data.desc()).offset(skip).limit(limit)
-    return q.all()
+    return q
 
 
-@app.post("/transacoes", response_model=TransacaoRead, status_code=201)
-def criar_transacao(
-    payload: TransacaoCreate,
+# cursor opaco: (data, id) da última linha entregue, em base64 urlsafe
+def _codificar_cursor(data: datetime, id_: int) -> str:
+    bruto = json.dumps({"d": data.isoformat(), "i": id_}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip("=")
+
+
+def _decodificar_cursor(cursor: str):
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        dados = json.loads(bruto)
+        return datetime.fromisoformat(dados["d"]), int(dados["i"])
+    except Exception:
+        raise HTTPException(status_code=422, detail="cursor inválido")
+
+
+# paginação por cursor (keyset): em vez de OFFSET, continua a partir do último (data, id) entregue
+# usa o índice (usuario_id, data, id) --> página 50 custa o mesmo que a página 1
+@app.get("/transacoes/pagina", response_model=TransacaoPagina)
+async def listar_transacoes_pagina(
+    conta_id: Optional[int] = None,
+    tipo: Optional[str] = None,
+    categoria_id: Optional[int] = None,
+    meta_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
     user_id: int = Depends(pegar_usuario_atual),
-    db: Session = Depends(get_db)
+    db = Depends(get_async_db)
 ):
+    limit = max(1, min(limit, 500))
+    posicao = _decodificar_cursor(cursor) if cursor else None
+
+    def consultar(s: Session):
+        q = s.query(Transacao).filter(Transacao.usuario_id == user_id)
+        q = _filtrar_transacoes(q, conta_id, tipo, categoria_id, meta_id, date_from, date_to)
+        if posicao:
+            data_cursor, id_cursor = posicao
+            q = q.filter(or_(
+                Transacao.data < data_cursor,
+                and_(Transacao.data == data_cursor, Transacao.id < id_cursor)
+            ))
+        # busca uma linha a mais só para saber se existe próxima página
+        return q.order_by(Transacao.data.desc(), Transacao.id.desc()).limit(limit + 1).all()
+
+    itens = await db.run_sync(consultar)
+    next_cursor = None
+    if len(itens) > limit:
+        itens = itens[:limit]
+        next_cursor = _codificar_cursor(itens[-1].data, itens[-1].id)
+
+    return {"items": itens, "next_cursor": next_cursor}
+
+
+# efeitos colaterais de escritas em transacoes (rollup mensal, saldo das contas, progresso das metas)
+# acumulados durante a requisição e aplicados uma única vez no final, antes do commit:
+# no lote (/transacoes/batch) cada meta e cada conta recebe um só UPDATE, não um por operação
+class _EfeitosTransacoes:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.removidas = []                     # snapshots do estado anterior
+        self.adicionadas = []                   # transações novas/atualizadas
+        self.delta_metas = defaultdict(float)   # meta_id -> ajuste em valor_atual
+        self._titulos_metas = {}                # memo: meta_id -> título (None = não é do usuário)
+        self._nomes_contas = {}                 # memo: conta_id -> nome
+
+    def titulo_meta(self, db: Session, meta_id: int):
+        if meta_id not in self._titulos_metas:
+            self._titulos_metas[meta_id] = db.query(MetaTable.titulo).filter(
+                MetaTable.id == meta_id,
+                MetaTable.usuario_id == self.user_id
+            ).scalar()
+        return self._titulos_metas[meta_id]
+
+    def nome_conta(self, db: Session, conta_id: int):
+        if conta_id not in self._nomes_contas:
+            self._nomes_contas[conta_id] = db.query(Conta.nome).filter(
+                Conta.id == conta_id,
+                Conta.usuario_id == self.user_id
+            ).scalar()
+        return self._nomes_contas[conta_id]
+
+    def exigir_conta(self, db: Session, conta_id: Optional[int]):
+        """404 se conta_id não é uma conta do usuário (antes de mexer em qualquer coisa)."""
+        if conta_id and self.nome_conta(db, conta_id) is None:
+            raise HTTPException(status_code=404, detail="Conta não encontrada")
+
+    def aplicar(self, db: Session):
+        atualizar_resumo_mensal(db, removidas=self.removidas, adicionadas=self.adicionadas)
+        # com o rollup já atualizado: avisos de 80%/100% do orçamento saem junto com a escrita
+        verificar_orcamentos_transacoes(db, self.user_id, self.adicionadas)
+        atualizar_saldos(db, self.user_id, removidas=self.removidas, adicionadas=self.adicionadas)
+        # faturas fechadas atingidas (ex.: lançamento retroativo) são recalculadas na próxima leitura
+        invalidar_faturas(db, self.user_id, list(self.removidas) + list(self.adicionadas))
+        for meta_id, delta in self.delta_metas.items():
+            if abs(delta) < 1e-9:
+                continue
+            # valor_atual nunca fica negativo
+            novo_valor = func.coalesce(MetaTable.valor_atual, 0.0) + delta
+            db.execute(
+                update(MetaTable).where(
+                    MetaTable.id == meta_id,
+                    MetaTable.usuario_id == self.user_id
+                ).values(
+                    valor_atual=case((novo_valor < 0, 0.0), else_=novo_valor)
+                ).execution_options(synchronize_session=False)
+            )
+        # contexto da IA (contexto_ia.py) é recalculado na próxima pergunta
+        invalidar_contexto_ia(self.user_id)
+
+
+# cópia dos campos que alimentam os agregados, tirada antes de um PATCH/DELETE alterar a transação
+def _snapshot_transacao(t: Transacao) -> dict:
+    return {
+        "usuario_id": t.usuario_id,
+        "data": t.data,
+        "valor": t.valor,
+        "tipo": t.tipo,
+        "categoria_id": t.categoria_id,
+        "conta_id": t.conta_id,
+        "cartao_id": t.cartao_id,
+    }
+
+
+# monta e adiciona a transação na sessão (sem commit); efeitos ficam acumulados em `efeitos`
+def _criar_transacao(db: Session, payload: TransacaoCreate, efeitos: _EfeitosTransacoes) -> Transacao:
+    efeitos.exigir_conta(db, payload.conta_id)
     data = payload.data or datetime.utcnow()
     novo = Transacao(
-        usuario_id=user_id,
+        usuario_id=efeitos.user_id,
         data=data,
         valor=payload.valor,
         tipo=payload.tipo,
@@ -715,18 +959,15 @@ def criar_transacao(
     # ---------------------------
     categoria_nome = None
 
+    # resolvida pelo cache em memória (categorias.py), sem query por transação
     if payload.categoria_id:
-        cat = db.query(Categoria).filter(Categoria.id == payload.categoria_id).first()
+        cat = categoria_por_id(db, payload.categoria_id)
         if cat:
             novo.categoria_id = cat.id
             categoria_nome = cat.nome
 
     elif payload.categoria:
-        # ex.: "Transporte" -> chave "transporte"
-        chave = payload.categoria.strip().lower().replace(" ", "_")
-        cat = db.query(Categoria).filter(
-            or_(Categoria.chave == chave, Categoria.nome.ilike(payload.categoria.strip()))
-        ).first()
+        cat = categoria_por_texto(db, payload.categoria)
         if cat:
             novo.categoria_id = cat.id
             categoria_nome = cat.nome
@@ -753,22 +994,69 @@ def criar_transacao(
 
     # conta cache
     if novo.conta_id:
-        conta = db.query(Conta).filter(Conta.id == novo.conta_id).first()
-        if conta:
-            novo.conta_nome_cache = conta.nome
+        novo.conta_nome_cache = efeitos.nome_conta(db, novo.conta_id)
 
     # atualizar meta incremental
-    if novo.meta_id and novo.alocado_valor:
-        meta = db.query(MetaTable).filter(
-            MetaTable.id == novo.meta_id,
-            MetaTable.usuario_id == user_id
-        ).first()
-        if meta:
-            novo.meta_nome_cache = meta.titulo
-            meta.valor_atual = (meta.valor_atual or 0.0) + novo.alocado_valor
-            db.add(meta)
+    if novo.meta_id:
+        titulo = efeitos.titulo_meta(db, novo.meta_id)
+        if titulo is not None:
+            novo.meta_nome_cache = titulo
+            if novo.alocado_valor:
+                efeitos.delta_metas[novo.meta_id] += novo.alocado_valor
 
     db.add(novo)
+    efeitos.adicionadas.append(novo)
+    return novo
+
+
+# aplica o PATCH na transação já carregada (sem commit)
+def _atualizar_transacao(db: Session, t: Transacao, payload: TransacaoUpdate, efeitos: _EfeitosTransacoes) -> Transacao:
+    data = payload.dict(exclude_unset=True)
+    if data.get("conta_id"):
+        efeitos.exigir_conta(db, data["conta_id"])
+
+    old_alocado = t.alocado_valor or 0.0
+    old_meta_id = t.meta_id
+    efeitos.removidas.append(_snapshot_transacao(t))
+
+    for k, v in data.items():
+        setattr(t, k, v)
+
+    # recalcular alocado_valor
+    try:
+        t.alocado_valor = float(t.valor) * float(t.alocacao_percentual or 0.0) / 100.0
+    except Exception:
+        t.alocado_valor = 0.0
+
+    # ajustar metas: devolve o alocado antigo e soma o novo (mesma meta ou meta diferente)
+    if old_meta_id and old_alocado:
+        efeitos.delta_metas[old_meta_id] -= old_alocado
+    if t.meta_id and t.alocado_valor:
+        efeitos.delta_metas[t.meta_id] += t.alocado_valor
+
+    # move o valor no rollup/saldo se mudou mês, categoria, tipo, conta ou valor
+    # (snapshot, não o objeto: a mesma transação pode ser editada de novo no mesmo lote)
+    efeitos.adicionadas.append(_snapshot_transacao(t))
+    db.add(t)
+    return t
+
+
+def _deletar_transacao(db: Session, t: Transacao, efeitos: _EfeitosTransacoes) -> None:
+    if t.meta_id and (t.alocado_valor or 0.0):
+        efeitos.delta_metas[t.meta_id] -= t.alocado_valor
+    efeitos.removidas.append(_snapshot_transacao(t))
+    db.delete(t)
+
+
+@app.post("/transacoes", response_model=TransacaoRead, status_code=201)
+def criar_transacao(
+    payload: TransacaoCreate,
+    user_id: int = Depends(pegar_usuario_atual),
+    db: Session = Depends(get_db)
+):
+    efeitos = _EfeitosTransacoes(user_id)
+    novo = _criar_transacao(db, payload, efeitos)
+    efeitos.aplicar(db)
     db.commit()
     db.refresh(novo)
 
@@ -779,6 +1067,151 @@ def criar_transacao(
     return novo
 
 
+# -------------------------
+# Importação de extratos (CSV / OFX)
+# -------------------------
+IMPORTACAO_TAMANHO_LOTE = 500   # linhas por INSERT em lote (executemany) e por commit
+IMPORTACAO_MAX_ERROS = 200      # erros detalhados na resposta; o total é sempre contado
+
+TIPOS_POR_ROTULO = {
+    "credito": "receita", "credit": "receita", "c": "receita", "entrada": "receita",
+    "debito": "despesa", "debit": "despesa", "d": "despesa", "saida": "despesa",
+}
+
+
+# converte uma linha bruta do leitor em colunas de transacoes; ValueError vira erro da linha no relatório
+def _linha_importada(bruto: dict, user_id: int, conta, origem: str, categorias: dict, db: Session) -> dict:
+    data = parse_data(bruto.get("data"))
+    if not data:
+        raise ValueError(f"data inválida: '{bruto.get('data', '')}'")
+    valor = _parse_currency(bruto.get("valor"))
+    if not valor:
+        raise ValueError(f"valor inválido: '{bruto.get('valor', '')}'")
+
+    # tipo explícito na coluna, senão o sinal do valor decide (negativo = saída)
+    rotulo_tipo = normalizar_texto(bruto.get("tipo") or "")
+    tipo = rotulo_tipo if rotulo_tipo in ("despesa", "receita", "transferencia", "investimento") else TIPOS_POR_ROTULO.get(rotulo_tipo)
+    if not tipo:
+        tipo = "despesa" if valor < 0 else "receita"
+
+    # categoria resolvida uma única vez por rótulo distinto do arquivo
+    categoria_id, categoria_nome = None, None
+    rotulo = (bruto.get("categoria") or "").strip()
+    if rotulo:
+        chave = normalizar_texto(rotulo)
+        if chave not in categorias:
+            cat = categoria_por_texto(db, rotulo)
+            categorias[chave] = (cat.id, cat.nome) if cat else (None, rotulo)
+        categoria_id, categoria_nome = categorias[chave]
+
+    return {
+        "usuario_id": user_id,
+        "data": data,
+        "valor": abs(float(valor)),
+        "tipo": tipo,
+        "categoria_id": categoria_id,
+        "categoria_cache": categoria_nome,
+        "descricao": (bruto.get("descricao") or None),
+        "conta_id": conta.id if conta else None,
+        "conta_nome_cache": conta.nome if conta else None,
+        "referencia": (bruto.get("referencia") or None) and bruto["referencia"][:128],
+        "origem_import": origem,
+        "alocado_valor": 0.0,
+        "status": "confirmado",
+        "created_at": datetime.utcnow(),
+    }
+
+
+# recebe o extrato em multipart e lê em streaming: nunca carrega o arquivo inteiro em memória
+# grava em lotes com um INSERT executemany (fast_executemany no pyodbc) + agregados + commit por lote
+# linhas inválidas não interrompem a importação: voltam no relatório com o número da linha
+@app.post("/transacoes/importar", response_model=ImportacaoResultado)
+def importar_transacoes(
+    arquivo: UploadFile = File(...),
+    conta_id: Optional[int] = None,
+    formato: Optional[str] = None,   # 'csv' | 'ofx' (padrão: extensão do arquivo)
+    encoding: str = "utf-8-sig",
+    user_id: int = Depends(pegar_usuario_atual),
+    db: Session = Depends(get_db)
+):
+    conta = None
+    if conta_id:
+        conta = db.query(Conta).filter(Conta.id == conta_id, Conta.usuario_id == user_id).first()
+        if not conta:
+            raise HTTPException(status_code=404, detail="Conta não encontrada")
+
+    formato = (formato or os.path.splitext(arquivo.filename or "")[1].lstrip(".")).lower()
+    if formato not in ("csv", "ofx"):
+        raise HTTPException(status_code=422, detail="formato deve ser 'csv' ou 'ofx'")
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        raise HTTPException(status_code=422, detail=f"encoding desconhecido: {encoding}")
+
+    resultado = {"importadas": 0, "duplicadas": 0, "total_erros": 0, "erros": []}
+    categorias = {}
+
+    def registrar_erro(linha: int, erro: str):
+        resultado["total_erros"] += 1
+        if len(resultado["erros"]) < IMPORTACAO_MAX_ERROS:
+            resultado["erros"].append({"linha": linha, "erro": erro})
+
+    def gravar(lote: list):
+        # reimportar o mesmo extrato não duplica: referencia (FITID no OFX) já gravada na conta é ignorada
+        refs = {l["referencia"] for l in lote if l["referencia"]}
+        existentes = set()
+        if refs:
+            existentes = set(db.execute(
+                select(Transacao.referencia).where(
+                    Transacao.usuario_id == user_id,
+                    Transacao.conta_id == conta.id if conta else Transacao.conta_id.is_(None),
+                    Transacao.referencia.in_(refs),
+                )
+            ).scalars())
+        novos = []
+        for l in lote:
+            if l["referencia"] and l["referencia"] in existentes:
+                resultado["duplicadas"] += 1
+                continue
+            if l["referencia"]:
+                existentes.add(l["referencia"])
+            novos.append(l)
+        if novos:
+            db.execute(insert(Transacao.__table__), novos)
+            atualizar_resumo_mensal(db, adicionadas=novos)
+            atualizar_saldos(db, user_id, adicionadas=novos)
+            invalidar_faturas(db, user_id, novos)
+            verificar_orcamentos_transacoes(db, user_id, novos)
+            db.commit()
+            invalidar_contexto_ia(user_id)
+            resultado["importadas"] += len(novos)
+
+    texto = io.TextIOWrapper(arquivo.file, encoding=encoding, errors="replace", newline="")
+    leitor = ler_csv(texto) if formato == "csv" else ler_ofx(texto)
+    lote = []
+    try:
+        for numero, bruto in leitor:
+            try:
+                lote.append(_linha_importada(bruto, user_id, conta, formato, categorias, db))
+            except ValueError as e:
+                registrar_erro(numero, str(e))
+                continue
+            if len(lote) >= IMPORTACAO_TAMANHO_LOTE:
+                gravar(lote)
+                lote = []
+        if lote:
+            gravar(lote)
+    except ValueError as e:
+        # arquivo sem as colunas obrigatórias
+        raise HTTPException(status_code=422, detail=str(e))
+    except csv.Error as e:
+        registrar_erro(0, f"arquivo malformado: {e}")
+    finally:
+        texto.detach()
+
+    logger.info(f"Importação {formato} usuário {user_id}: {resultado['importadas']} importadas, {resultado['total_erros']} erros")
+    return resultado
+
 
 @app.get("/transacoes/{transacao_id}", response_model=TransacaoRead)
 def buscar_transacao(
@@ -803,38 +1236,9 @@ def atualizar_transacao(transacao_id: int, payload: TransacaoUpdate, user_id: in
     if t.usuario_id != user_id:
         raise HTTPException(status_code=403, detail="Você não pode editar esta transação")
 
-    old_alocado = t.alocado_valor or 0.0
-    old_meta_id = t.meta_id
-
-    data = payload.dict(exclude_unset=True)
-    for k, v in data.items():
-        setattr(t, k, v)
-
-    # recalcular alocado_valor
-    try:
-        t.alocado_valor = float(t.valor) * float(t.alocacao_percentual or 0.0) / 100.0
-    except Exception:
-        t.alocado_valor = 0.0
-
-    new_alocado = t.alocado_valor or 0.0
-    new_meta_id = t.meta_id
-
-    # ajustar metas
-    if old_meta_id and old_meta_id != new_meta_id and old_alocado:
-        old_meta = db.query(MetaTable).filter(MetaTable.id == old_meta_id).first()
-        if old_meta:
-            old_meta.valor_atual = max(0.0, (old_meta.valor_atual or 0.0) - old_alocado)
-            db.add(old_meta)
-
-    if new_meta_id:
-        meta = db.query(MetaTable).filter(MetaTable.id == new_meta_id).first()
-        if meta:
-            if old_meta_id == new_meta_id and old_alocado:
-                meta.valor_atual = max(0.0, (meta.valor_atual or 0.0) - old_alocado)
-            meta.valor_atual = (meta.valor_atual or 0.0) + new_alocado
-            db.add(meta)
-
-    db.add(t)
+    efeitos = _EfeitosTransacoes(user_id)
+    _atualizar_transacao(db, t, payload, efeitos)
+    efeitos.aplicar(db)
     db.commit()
     db.refresh(t)
     return t
@@ -847,27 +1251,380 @@ def deletar_transacao(transacao_id: int, user_id: int = Depends(pegar_usuario_at
         raise HTTPException(status_code=404, detail="Transação não encontrada")
     if t.usuario_id != user_id:
         raise HTTPException(status_code=403, detail="Você não pode deletar esta transação")
-    if t.meta_id and (t.alocado_valor or 0.0):
-        meta = db.query(MetaTable).filter(MetaTable.id == t.meta_id).first()
-        if meta:
-            meta.valor_atual = max(0.0, (meta.valor_atual or 0.0) - (t.alocado_valor or 0.0))
-            db.add(meta)
-    db.delete(t)
+    efeitos = _EfeitosTransacoes(user_id)
+    _deletar_transacao(db, t, efeitos)
+    efeitos.aplicar(db)
     db.commit()
     return {}
 
 
+# lote de operações (sincronização offline do app): várias criações/edições/remoções numa só requisição
+# tudo numa única transação do banco; metas e contas afetadas recebem um UPDATE cada, no final
+# operações inválidas (payload, id inexistente, de outro usuário) voltam como erro no resultado do item,
+# as demais são aplicadas normalmente
+@app.post("/transacoes/batch", response_model=TransacaoLoteResultado)
+def lote_transacoes(
+    payload: TransacaoLote,
+    user_id: int = Depends(pegar_usuario_atual),
+    db: Session = Depends(get_db)
+):
+    # uma única leitura para todas as transações que serão editadas/removidas
+    ids = {op.id for op in payload.operacoes if op.op in ("update", "delete") and op.id}
+    existentes = {}
+    if ids:
+        existentes = {
+            t.id: t for t in db.query(Transacao).filter(
+                Transacao.id.in_(ids),
+                Transacao.usuario_id == user_id
+            ).all()
+        }
+
+    efeitos = _EfeitosTransacoes(user_id)
+    resultados = []
+    criadas = []  # (posição em resultados, Transacao) --> id só existe depois do flush
+    removidas = set()
+
+    for indice, op in enumerate(payload.operacoes):
+        item = {"indice": indice, "op": op.op, "ok": False, "id": op.id, "erro": None}
+        resultados.append(item)
+        try:
+            if op.op == "create":
+                novo = _criar_transacao(db, TransacaoCreate(**(op.dados or {})), efeitos)
+                criadas.append((item, novo))
+            else:
+                t = existentes.get(op.id)
+                if t is None or op.id in removidas:
+                    item["erro"] = "Transação não encontrada"
+                    continue
+                if op.op == "update":
+                    _atualizar_transacao(db, t, TransacaoUpdate(**(op.dados or {})), efeitos)
+                else:
+                    _deletar_transacao(db, t, efeitos)
+                    removidas.add(op.id)
+            item["ok"] = True
+        except ValidationError as e:
+            item["erro"] = "; ".join(f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors())
+        except HTTPException as e:
+            # ex.: conta_id de outro usuário --> só este item falha
+            item["erro"] = e.detail
+
+    efeitos.aplicar(db)
+    db.flush()
+    for item, novo in criadas:
+        item["id"] = novo.id
+    db.commit()
+
+    aplicadas = sum(1 for r in resultados if r["ok"])
+    return {"aplicadas": aplicadas, "falhas": len(resultados) - aplicadas, "resultados": resultados}
+
+
 # -------------------------
-# Fatura (gerar relatório, somente leitura)
+# Compras parceladas (cartão)
 # -------------------------
-@app.get("/faturas/generar", response_model=FaturaRead)
-def gerar_fatura(
-    conta_cartao_id: int, 
-    inicio: date, 
-    fim: date, 
-    user_id: int = Depends(pegar_usuario_atual), # <-- CORRIGIDO
+# uma compra em N vezes vira N transações num único INSERT em lote, ligadas pelo mesmo parcelamento_id;
+# cada parcela cai numa fatura do cartão (alinhada a fechamento_cartao_dia) e a edição/cancelamento
+# da compra inteira é um único UPDATE/DELETE por parcelamento_id
+def _valores_parcelas(valor_total: float, parcelas: int):
+    # divide em centavos; a sobra vai para a 1ª parcela (100 em 3x --> 33,34 + 33,33 + 33,33)
+    base, sobra = divmod(int(round(valor_total * 100)), parcelas)
+    return (base + sobra) / 100.0, base / 100.0
+
+
+def _categoria_do_payload(db: Session, categoria_id: Optional[int], categoria: Optional[str]):
+    # mesma regra de _criar_transacao: id da tabela, senão texto livre (procurado por chave/nome)
+    if categoria_id:
+        cat = categoria_por_id(db, categoria_id)
+        return (cat.id, cat.nome) if cat else (None, None)
+    if categoria:
+        cat = categoria_por_texto(db, categoria)
+        return (cat.id, cat.nome) if cat else (None, categoria.strip())
+    return None, None
+
+
+def _ler_parcelamento(db: Session, user_id: int, parcelamento_id: str) -> dict:
+    parcelas = db.query(Transacao).filter(
+        Transacao.usuario_id == user_id,
+        Transacao.parcelamento_id == parcelamento_id
+    ).order_by(Transacao.parcela_num).all()
+    if not parcelas:
+        raise HTTPException(status_code=404, detail="Parcelamento não encontrado")
+    return {
+        "parcelamento_id": parcelamento_id,
+        "valor_total": round(sum(p.valor for p in parcelas), 2),
+        "parcelas": parcelas,
+    }
+
+
+def _snapshots_parcelamento(db: Session, user_id: int, parcelamento_id: str) -> list:
+    # só as colunas que alimentam rollup/saldo (sem carregar as entidades)
+    linhas = db.query(
+        Transacao.usuario_id, Transacao.data, Transacao.valor, Transacao.tipo,
+        Transacao.categoria_id, Transacao.conta_id, Transacao.cartao_id, Transacao.parcela_num
+    ).filter(
+        Transacao.usuario_id == user_id,
+        Transacao.parcelamento_id == parcelamento_id
+    ).all()
+    if not linhas:
+        raise HTTPException(status_code=404, detail="Parcelamento não encontrado")
+    return [dict(l._mapping) for l in linhas]
+
+
+@app.post("/transacoes/parcelada", response_model=TransacaoParceladaRead, status_code=201)
+def criar_transacao_parcelada(
+    payload: TransacaoParceladaCreate,
+    user_id: int = Depends(pegar_usuario_atual),
+    db: Session = Depends(get_db)
+):
+    cartao = db.query(Conta).filter(Conta.id == payload.cartao_id, Conta.usuario_id == user_id).first()
+    if not cartao:
+        raise HTTPException(status_code=404, detail="Cartão não encontrado")
+    if cartao.tipo != "cartao":
+        raise HTTPException(status_code=422, detail="A conta informada não é um cartão")
+
+    data_compra = payload.data or datetime.utcnow()
+    categoria_id, categoria_nome = _categoria_do_payload(db, payload.categoria_id, payload.categoria)
+    primeira, demais = _valores_parcelas(payload.valor_total, payload.parcelas)
+    ano, mes = fatura_da_compra(data_compra.date(), cartao.fechamento_cartao_dia)
+    parcelamento_id = str(uuid.uuid4())
+    agora = datetime.utcnow()
+
+    linhas = []
+    for i in range(payload.parcelas):
+        if i == 0:
+            data = data_compra
+        else:
+            # parcela i entra na i-ésima fatura seguinte: data = abertura daquele ciclo
+            # (cartão sem fechamento configurado: mesmo dia nos meses seguintes)
+            a, m = somar_meses(ano, mes, i)
+            if cartao.fechamento_cartao_dia:
+                dia = periodo_fatura(a, m, cartao.fechamento_cartao_dia)[0]
+            else:
+                dia = dia_no_mes(a, m, data_compra.day)
+            data = datetime.combine(dia, data_compra.time())
+        linhas.append({
+            "usuario_id": user_id,
+            "data": data,
+            "valor": primeira if i == 0 else demais,
+            "tipo": "despesa",
+            "categoria_id": categoria_id,
+            "categoria_cache": categoria_nome,
+            "descricao": payload.descricao,
+            "conta_id": cartao.id,
+            "cartao_id": cartao.id,
+            "conta_nome_cache": cartao.nome,
+            "parcelas_total": payload.parcelas,
+            "parcela_num": i + 1,
+            "parcelamento_id": parcelamento_id,
+            "origem_import": "manual",
+            "alocado_valor": 0.0,
+            "status": payload.status or "pendente",
+            "created_at": agora,
+        })
+
+    db.execute(insert(Transacao.__table__), linhas)
+    efeitos = _EfeitosTransacoes(user_id)
+    efeitos.adicionadas.extend(linhas)
+    efeitos.aplicar(db)
+    db.commit()
+    return _ler_parcelamento(db, user_id, parcelamento_id)
+
+
+@app.get("/transacoes/parcelamentos/{parcelamento_id}", response_model=TransacaoParceladaRead)
+def buscar_parcelamento(parcelamento_id: str, user_id: int = Depends(pegar_usuario_atual), db: Session = Depends(get_db)):
+    return _ler_parcelamento(db, user_id, parcelamento_id)
+
+
+@app.patch("/transacoes/parcelamentos/{parcelamento_id}", response_model=TransacaoParceladaRead)
+def atualizar_parcelamento(
+    parcelamento_id: str,
+    payload: TransacaoParceladaUpdate,
+    user_id: int = Depends(pegar_usuario_atual),
     db: Session = Depends(get_db)
 ):
+    antigas = _snapshots_parcelamento(db, user_id, parcelamento_id)
+    data = payload.dict(exclude_unset=True)
+
+    valores = {}
+    if "descricao" in data:
+        valores["descricao"] = data["descricao"]
+    if data.get("status"):
+        valores["status"] = data["status"]
+    if "categoria_id" in data or "categoria" in data:
+        categoria_id, categoria_nome = _categoria_do_payload(db, data.get("categoria_id"), data.get("categoria"))
+        valores["categoria_id"] = categoria_id
+        valores["categoria_cache"] = categoria_nome
+    if data.get("valor_total"):
+        primeira, demais = _valores_parcelas(data["valor_total"], len(antigas))
+        valores["valor"] = case((Transacao.parcela_num == 1, primeira), else_=demais)
+
+    if valores:
+        valores["updated_at"] = datetime.utcnow()
+        db.execute(
+            update(Transacao).where(
+                Transacao.usuario_id == user_id,
+                Transacao.parcelamento_id == parcelamento_id
+            ).values(**valores).execution_options(synchronize_session=False)
+        )
+
+        # rollup/saldo: tira o estado antigo e soma o novo (categoria e valor podem ter mudado)
+        novas = []
+        for antiga in antigas:
+            nova = dict(antiga)
+            if "categoria_id" in valores:
+                nova["categoria_id"] = valores["categoria_id"]
+            if "valor" in valores:
+                nova["valor"] = primeira if antiga["parcela_num"] == 1 else demais
+            novas.append(nova)
+        efeitos = _EfeitosTransacoes(user_id)
+        efeitos.removidas.extend(antigas)
+        efeitos.adicionadas.extend(novas)
+        efeitos.aplicar(db)
+        db.commit()
+
+    return _ler_parcelamento(db, user_id, parcelamento_id)
+
+
+@app.delete("/transacoes/parcelamentos/{parcelamento_id}", status_code=204)
+def deletar_parcelamento(parcelamento_id: str, user_id: int = Depends(pegar_usuario_atual), db: Session = Depends(get_db)):
+    # cancela a compra inteira: todas as parcelas, passadas e futuras
+    antigas = _snapshots_parcelamento(db, user_id, parcelamento_id)
+    db.execute(
+        delete(Transacao).where(
+            Transacao.usuario_id == user_id,
+            Transacao.parcelamento_id == parcelamento_id
+        ).execution_options(synchronize_session=False)
+    )
+    efeitos = _EfeitosTransacoes(user_id)
+    efeitos.removidas.extend(antigas)
+    efeitos.aplicar(db)
+    db.commit()
+    return {}
+
+
+# -------------------------
+# Resumo (totais do dashboard/relatórios agregados no banco)
+# -------------------------
+# uma única query GROUP BY (ano, mês, tipo, categoria) --> o front recebe poucos bytes
+# em vez de baixar todas as transações do período para somar no navegador
+@app.get("/resumo", response_model=ResumoRead)
+def resumo_transacoes(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    conta_id: Optional[int] = None,
+    user_id: int = Depends(pegar_usuario_atual),
+    db: Session = Depends(get_db)
+):
+    ano = extract("year", Transacao.data)
+    mes = extract("month", Transacao.data)
+    q = db.query(
+        ano.label("ano"),
+        mes.label("mes"),
+        Transacao.tipo,
+        Transacao.categoria_id,
+        Categoria.nome,
+        Transacao.categoria_cache,
+        func.sum(Transacao.valor).label("total"),
+        func.count(Transacao.id).label("quantidade"),
+    ).outerjoin(Categoria, Categoria.id == Transacao.categoria_id).filter(
+        Transacao.usuario_id == user_id
+    )
+    q = _filtrar_transacoes(q, conta_id, None, None, None, date_from, date_to)
+    linhas = q.group_by(
+        ano, mes, Transacao.tipo, Transacao.categoria_id, Categoria.nome, Transacao.categoria_cache
+    ).all()
+
+    totais = {"receita": 0.0, "despesa": 0.0, "investimento": 0.0}
+    por_categoria = {}
+    por_mes = {}
+    quantidade = 0
+    for l in linhas:
+        total = float(l.total or 0.0)
+        quantidade += l.quantidade
+        if l.tipo in totais:
+            totais[l.tipo] += total
+
+        nome = l.nome or l.categoria_cache or "Sem categoria"
+        cat = por_categoria.setdefault(
+            (l.categoria_id, nome, l.tipo),
+            {"categoria_id": l.categoria_id, "categoria": nome, "tipo": l.tipo, "total": 0.0, "quantidade": 0}
+        )
+        cat["total"] += total
+        cat["quantidade"] += l.quantidade
+
+        chave_mes = f"{int(l.ano):04d}-{int(l.mes):02d}"
+        m = por_mes.setdefault(chave_mes, {"receita": 0.0, "despesa": 0.0, "investimento": 0.0})
+        if l.tipo in m:
+            m[l.tipo] += total
+
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "receitas": round(totais["receita"], 2),
+        "despesas": round(totais["despesa"], 2),
+        "investimentos": round(totais["investimento"], 2),
+        "saldo": round(totais["receita"] - totais["despesa"], 2),
+        "quantidade": quantidade,
+        "por_categoria": [
+            {**c, "total": round(c["total"], 2)}
+            for c in sorted(por_categoria.values(), key=lambda c: c["total"], reverse=True)
+        ],
+        "por_mes": [
+            {
+                "ano_mes": k,
+                "receitas": round(v["receita"], 2),
+                "despesas": round(v["despesa"], 2),
+                "investimentos": round(v["investimento"], 2),
+                "saldo": round(v["receita"] - v["despesa"], 2),
+            }
+            for k, v in sorted(por_mes.items())
+        ],
+    }
+
+
+# lê só o rollup mensal (resumo_mensal): custo proporcional a meses x categorias, não a transações
+# inicio/fim no formato 'AAAA-MM' (inclusivos)
+@app.get("/resumo/mensal", response_model=List[ResumoMensalRead])
+def resumo_mensal(
+    inicio: Optional[str] = None,
+    fim: Optional[str] = None,
+    tipo: Optional[str] = None,
+    user_id: int = Depends(pegar_usuario_atual),
+    db: Session = Depends(get_db)
+):
+    def _ano_mes(valor: str) -> int:
+        try:
+            ano, mes = valor.split("-")
+            return int(ano) * 100 + int(mes)
+        except Exception:
+            raise HTTPException(status_code=422, detail="use o formato AAAA-MM")
+
+    q = db.query(ResumoMensal, Categoria.nome).outerjoin(
+        Categoria, Categoria.id == ResumoMensal.categoria_id
+    ).filter(ResumoMensal.usuario_id == user_id, ResumoMensal.quantidade > 0)
+    if inicio:
+        q = q.filter(ResumoMensal.ano_mes >= _ano_mes(inicio))
+    if fim:
+        q = q.filter(ResumoMensal.ano_mes <= _ano_mes(fim))
+    if tipo:
+        q = q.filter(ResumoMensal.tipo == tipo)
+
+    return [
+        {
+            "ano_mes": f"{r.ano_mes // 100:04d}-{r.ano_mes % 100:02d}",
+            "categoria_id": r.categoria_id,
+            "categoria": nome,
+            "tipo": r.tipo,
+            "total": round(r.total or 0.0, 2),
+            "quantidade": r.quantidade,
+        }
+        for r, nome in q.order_by(ResumoMensal.ano_mes, ResumoMensal.tipo).all()
+    ]
+
+
+# -------------------------
+# Fatura (gerar relatório, somente leitura)
+# -------------------------
+def _conta_cartao(db: Session, conta_cartao_id: int, user_id: int) -> Conta:
     # Verificação de Segurança: O usuário é dono desta conta?
     conta = db.query(Conta).filter(
         Conta.id == conta_cartao_id,
@@ -875,41 +1632,78 @@ def gerar_fatura(
     ).first()
     if not conta:
         raise HTTPException(status_code=404, detail="Conta de cartão não encontrada ou não pertence a você")
+    return conta
 
-    inicio_dt = datetime.combine(inicio, datetime.min.time())
-    fim_dt = datetime.combine(fim, datetime.max.time())
 
-    # Filtra transações pelo usuário E pela conta
-    transacoes = db.query(Transacao).filter(
-        Transacao.usuario_id == user_id,
-        Transacao.cartao_id == conta_cartao_id,
-        Transacao.data >= inicio_dt,
-        Transacao.data <= fim_dt
-    ).order_by(Transacao.data.asc()).all()
-
-    total = sum([t.valor for t in transacoes]) if transacoes else 0.0
-    result = {
-        "conta_cartao_id": conta_cartao_id,
-        "periodo_inicio": inicio,
-        "periodo_fim": fim,
-        "total": float(total),
-        "count": len(transacoes)
-    }
-    return result
+# ciclos derivados de fechamento_cartao_dia/vencimento_cartao_dia (ver faturas.py)
+# sem parâmetros --> fatura aberta hoje; ano+mes --> fatura daquele mês; inicio+fim --> período avulso
+@app.get("/faturas/generar", response_model=FaturaRead)
+def gerar_fatura(
+    conta_cartao_id: int,
+    inicio: Optional[date] = None,
+    fim: Optional[date] = None,
+    ano: Optional[int] = None,
+    mes: Optional[int] = None,
+    user_id: int = Depends(pegar_usuario_atual), # <-- CORRIGIDO
+    db: Session = Depends(get_db)
+):
+    conta = _conta_cartao(db, conta_cartao_id, user_id)
+
+    if inicio and fim:
+        total, quantidade = somar_periodo(db, conta, inicio, fim)
+        return {
+            "conta_cartao_id": conta_cartao_id,
+            "periodo_inicio": inicio,
+            "periodo_fim": fim,
+            "total": total,
+            "count": quantidade,
+        }
+
+    if ano and mes:
+        if not 1 <= mes <= 12:
+            raise HTTPException(status_code=422, detail="mes deve estar entre 1 e 12")
+        referencia = (ano, mes)
+    else:
+        referencia = fatura_atual(conta)
+    return obter_faturas(db, conta, [referencia])[0]
+
+
+# faturas do ano (jan..dez): as fechadas vêm da tabela de snapshots, só as abertas são somadas
+@app.get("/faturas", response_model=List[FaturaRead])
+def listar_faturas(
+    conta_cartao_id: int,
+    ano: Optional[int] = None,
+    user_id: int = Depends(pegar_usuario_atual),
+    db: Session = Depends(get_db)
+):
+    conta = _conta_cartao(db, conta_cartao_id, user_id)
+    ano = ano or date.today().year
+    return obter_faturas(db, conta, [(ano, m) for m in range(1, 13)])
 
 
 
+def _email_cadastrado(db: Session, email: str) -> bool:
+    return db.query(UsuarioTable.id).filter(UsuarioTable.email == email).first() is not None
+
+
+def _salvar_novo_usuario(db: Session, novo_usuario: UsuarioTable) -> UsuarioTable:
+    db.add(novo_usuario) #adiciona objeto na sessao
+    db.commit() # grava no banco
+    db.refresh(novo_usuario) #atualiza o objeto em memoria
+    return novo_usuario
+
+
+# async: bcrypt no pool de processos (auth.criar_hash_senha_async), queries no threadpool
 @app.post("/usuarios/", response_model=Usuario, status_code=201)
-def criar_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
+async def criar_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
     """Cria um novo usuário com senha criptografada"""
     # verifica se email já existe (se existe, leva erro 400)
     # evita duplicação de emails 
-    existente = db.query(UsuarioTable).filter(UsuarioTable.email == usuario.email).first()
-    if existente:
+    if await run_in_threadpool(_email_cadastrado, db, usuario.email):
         raise HTTPException(status_code=400, detail="E-mail já cadastrado")
 
     # senha é transformada em hash antes de salvar
-    senha_hash = criar_hash_senha(usuario.senha)
+    senha_hash = await criar_hash_senha_async(usuario.senha)
 
     # cria novo usuario 
     novo_usuario = UsuarioTable(
@@ -917,10 +1711,7 @@ def criar_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
         email=usuario.email,
         senha_hash=senha_hash,
     )
-    db.add(novo_usuario) #adiciona objeto na sessao
-    db.commit() # grava no banco
-    db.refresh(novo_usuario) #atualiza o objeto em memoria
-    return novo_usuario 
+    return await run_in_threadpool(_salvar_novo_usuario, db, novo_usuario)
 
 # melhoras futuras: deixas apenas admins com essa funcionalidade 
 # admin_id: int = Depends(exigir_admin)
@@ -936,7 +1727,7 @@ def listar_usuarios(db: Session = Depends(get_db)):
  
 
 @app.post("/onboarding", response_model=LoginResponse, status_code=201)
-def submit_onboarding(payload: OnboardingCreate, db: Session = Depends(get_db)):
+async def submit_onboarding(payload: OnboardingCreate, db: Session = Depends(get_db)):
     """Recebe todos os passos do onboarding, cria usuário, perfil e metas.
     Retorna token e dados do usuário (mesma forma do /auth/login).
     """
@@ -946,237 +1737,301 @@ def submit_onboarding(payload: OnboardingCreate, db: Session = Depends(get_db)):
     if not step1:
         raise HTTPException(status_code=422, detail="step1 é obrigatório com nome/email/senha")
 
-    # Verifica se usuário já existe
-    existente = db.query(UsuarioTable).filter(UsuarioTable.email == step1.email).first()
-    if existente:
+    # Verifica se usuário já existe (antes de gastar um bcrypt)
+    if await run_in_threadpool(_email_cadastrado, db, step1.email):
         raise HTTPException(status_code=422, detail="Usuário com este email já existe")
 
-    # Criar usuário
-    senha_hash = criar_hash_senha(step1.senha)
-    novo_usuario = UsuarioTable(
-        nome=step1.nome,
-        email=step1.email,
-        senha_hash=senha_hash,
-    )
-    db.add(novo_usuario)
-    db.commit()
-    db.refresh(novo_usuario)
-
-    # Criar perfil de onboarding
-    profile = OnboardingProfileTable(
-        usuario_id=novo_usuario.id,
-        idade=step1.idade,
-        profissao=step1.profissao,
-        cpf=step1.cpf,
-        estado_civil=step1.estadoCivil,
-        saldo_atual=(payload.step2.saldoAtual if payload.step2 else None),
-        tipo_renda_mensal=(payload.step2.tipoRendaMensal if payload.step2 else None),
-        valor_renda_mensal=(payload.step2.valorRendaMensal if payload.step2 else None),
-        faixa_renda_mensal=(payload.step2.faixaRendaMensal if payload.step2 else None),
-        renda_mensal=(payload.step3.rendaMensal if payload.step3 else None),
-        despesa_mensal=(payload.step3.despesaMensal if payload.step3 else None),
-        investimento_mensal=(payload.step3.investimentoMensal if payload.step3 else None),
-        despesas_json=(__import__('json').dumps(payload.step4) if payload.step4 else None)
-    )
-    db.add(profile)
-    db.commit()
-    db.refresh(profile)
-
-    # Criar metas/objetivos
-    # reexibem o onboarding (não são as metas reais do usuário)
-    if payload.step3 and payload.step3.metas:
-        for g in payload.step3.metas:
-            goal = OnboardingGoalTable(
-                onboarding_id=profile.id,
-                nome=g.nome,
-                valor=g.valor,
-                meses=(g.meses or None)
-            )
-            db.add(goal)
-        db.commit()
+    # bcrypt no pool de processos; o resto (só banco) segue no threadpool
+    senha_hash = await criar_hash_senha_async(step1.senha)
+    return await run_in_threadpool(_criar_onboarding, payload, senha_hash, db)
+
+
+def _prazo_em_meses(meses: Optional[int]) -> Optional[date]:
+    """Prazo de uma meta a partir de 'daqui a N meses' (o onboarding envia meses, MetaTable.prazo é Date)."""
+    if not meses:
+        return None
+    hoje = date.today()
+    ano, mes = somar_meses(hoje.year, hoje.month, int(meses))
+    return dia_no_mes(ano, mes, hoje.day)
 
-    if payload.step4:
-        try:
-            # O step4 vem como um dicionário: {"mercado": "500,00", "lazer": "200,00"}
-            despesas_dict = payload.step4
-            
-            for chave_categoria, valor_str in despesas_dict.items():
-                # Converte "R$ 500,00" para float 500.00
-                valor_limite = _parse_currency(valor_str)
-                
-                # Só cria se houver um valor válido
-                if valor_limite and valor_limite > 0:
-                    # Busca a categoria no banco para pegar o ID correto
-                    cat_obj = db.query(Categoria).filter(Categoria.chave == chave_categoria).first()
-                    cat_id = cat_obj.id if cat_obj else None
-
-                    # Cria o orçamento
-                    novo_orcamento = Orcamento(
-                        usuario_id=novo_usuario.id,
-                        categoria_chave=chave_categoria, # ex: 'mercado'
-                        categoria_id=cat_id,
-                        valor_limite=valor_limite,
-                        periodo="mensal"
-                    )
-                    db.add(novo_orcamento)
-            
-            db.commit() # Salva os orçamentos no banco
-            logger.info(f"Orçamentos criados para usuário {novo_usuario.id}")
-            
-        except Exception as e:
-            logger.error(f"Erro ao criar orçamentos do onboarding: {e}")
-
-    # Criar metas reais na MetaTable ligadas ao novo usuário (não apenas ao onboarding)
-    metas_to_create = []
-    transacoes_to_create = []
-    if payload.step3:
-        s3 = payload.step3
-        # Metas: criar MetaTable para cada meta enviada
-        if getattr(s3, 'metas', None):
-            for g in s3.metas:
-                try:
-                    valor_objetivo = _parse_currency(getattr(g, 'valor', None))
-                except Exception:
-                    valor_objetivo = None
-                meta_real = MetaTable(
-                    usuario_id=novo_usuario.id,
-                    titulo=(getattr(g, 'nome', None) or 'Meta'),
-                    descricao=None,
-                    categoria=(getattr(g, 'categoria', None) or "Outros"),
-                    valor_objetivo=(valor_objetivo if valor_objetivo is not None else 0.0),
-                    valor_atual=0.0,
-                    prazo=(getattr(g, 'meses', None) or None)
-                )
-                metas_to_create.append(meta_real)
-
-        # Renda Mensal: adicionar transação de receita inicial se fornecida
-        renda = _parse_currency(getattr(s3, 'rendaMensal', None))
-        if renda and renda > 0:
-            t_receita = Transacao(
-                usuario_id=novo_usuario.id,
-                data=datetime.utcnow(),
-                valor=float(renda),
-                tipo='receita',
-                descricao='Renda Mensal (Onboarding)',
-                conta_id=None
-            )
-            transacoes_to_create.append(t_receita)
-
-        # Despesa Mensal: adicionar transação de despesa inicial se fornecida
-        despesa = _parse_currency(getattr(s3, 'despesaMensal', None))
-        if despesa and despesa > 0:
-            t_despesa = Transacao(
-                usuario_id=novo_usuario.id,
-                data=datetime.utcnow(),
-                valor=float(despesa),
-                tipo='despesa',
-                descricao='Despesa Mensal (Onboarding)',
-                conta_id=None
-            )
-            transacoes_to_create.append(t_despesa)
 
-    # Persistir metas e transações criadas (se houver)
+# onboarding inteiro numa única transação do banco: ou o usuário nasce completo, ou nada é gravado
+# INSERT do usuário e do perfil (precisam do id) + um INSERT em lote por tabela filha + rollup + 1 commit
+# categorias do step4 vêm do cache em memória (categorias.py), sem query por chave
+def _criar_onboarding(payload: OnboardingCreate, senha_hash: str, db: Session):
+    step1 = payload.step1
+    s2, s3 = payload.step2, payload.step3
+    agora = datetime.utcnow()
+
     try:
-        if metas_to_create:
-            for m in metas_to_create:
-                db.add(m)
-        if transacoes_to_create:
-            for t in transacoes_to_create:
-                db.add(t)
-        if metas_to_create or transacoes_to_create:
-            db.commit()
-            # refresh one by one to populate ids
-            for m in metas_to_create:
-                db.refresh(m)
-            for t in transacoes_to_create:
-                db.refresh(t)
+        # Criar usuário
+        novo_usuario = UsuarioTable(
+            nome=step1.nome,
+            email=step1.email,
+            senha_hash=senha_hash,
+        )
+        db.add(novo_usuario)
+        db.flush()  # id do usuário, sem commit
+
+        # Criar perfil de onboarding
+        profile = OnboardingProfileTable(
+            usuario_id=novo_usuario.id,
+            idade=step1.idade,
+            profissao=step1.profissao,
+            cpf=step1.cpf,
+            estado_civil=step1.estadoCivil,
+            saldo_atual=(s2.saldoAtual if s2 else None),
+            tipo_renda_mensal=(s2.tipoRendaMensal if s2 else None),
+            valor_renda_mensal=(s2.valorRendaMensal if s2 else None),
+            faixa_renda_mensal=(s2.faixaRendaMensal if s2 else None),
+            renda_mensal=(s3.rendaMensal if s3 else None),
+            despesa_mensal=(s3.despesaMensal if s3 else None),
+            investimento_mensal=(s3.investimentoMensal if s3 else None),
+            despesas_json=(json.dumps(payload.step4) if payload.step4 else None)
+        )
+        db.add(profile)
+        db.flush()  # id do perfil, para os objetivos
+
+        metas_enviadas = (s3.metas if s3 and s3.metas else [])
+
+        # Objetivos do onboarding: reexibem o onboarding (não são as metas reais do usuário)
+        goals = [
+            {"onboarding_id": profile.id, "nome": g.nome, "valor": g.valor, "meses": (g.meses or None), "created_at": agora}
+            for g in metas_enviadas
+        ]
+
+        # Orçamentos do step4: {"mercado": "500,00", "lazer": "200,00"}; só valores válidos
+        orcamentos = []
+        for chave_categoria, valor_str in (payload.step4 or {}).items():
+            valor_limite = _parse_currency(valor_str)
+            if valor_limite and valor_limite > 0:
+                cat_obj = categoria_por_texto(db, chave_categoria)
+                orcamentos.append({
+                    "usuario_id": novo_usuario.id,
+                    "categoria_chave": chave_categoria,  # ex: 'mercado'
+                    "categoria_id": cat_obj.id if cat_obj else None,
+                    "valor_limite": valor_limite,
+                    "periodo": "mensal",
+                    "ativo": True,
+                    "created_at": agora,
+                })
+
+        # Metas reais na MetaTable ligadas ao novo usuário (não apenas ao onboarding)
+        metas = []
+        for g in metas_enviadas:
+            valor_objetivo = _parse_currency(getattr(g, 'valor', None))
+            metas.append({
+                "usuario_id": novo_usuario.id,
+                "titulo": (getattr(g, 'nome', None) or 'Meta'),
+                "titulo_normalizado": normalizar_titulo(getattr(g, 'nome', None) or 'Meta'),
+                "descricao": None,
+                "categoria": (getattr(g, 'categoria', None) or "Outros"),
+                "valor_objetivo": (valor_objetivo if valor_objetivo is not None else 0.0),
+                "valor_atual": 0.0,
+                "prazo": _prazo_em_meses(getattr(g, 'meses', None)),
+                "data_criacao": agora,
+            })
+
+        # Renda/Despesa Mensal: transações iniciais se fornecidas
+        transacoes = []
+        if s3:
+            for campo, tipo, descricao in (
+                ('rendaMensal', 'receita', 'Renda Mensal (Onboarding)'),
+                ('despesaMensal', 'despesa', 'Despesa Mensal (Onboarding)'),
+            ):
+                valor = _parse_currency(getattr(s3, campo, None))
+                if valor and valor > 0:
+                    transacoes.append({
+                        "usuario_id": novo_usuario.id,
+                        "data": agora,
+                        "valor": float(valor),
+                        "tipo": tipo,
+                        "descricao": descricao,
+                        "conta_id": None,
+                        "status": "pendente",
+                        "created_at": agora,
+                    })
+
+        # um INSERT em lote (executemany) por tabela
+        for tabela, linhas in (
+            (OnboardingGoalTable.__table__, goals),
+            (Orcamento.__table__, orcamentos),
+            (MetaTable.__table__, metas),
+            (Transacao.__table__, transacoes),
+        ):
+            if linhas:
+                db.execute(insert(tabela), linhas)
+        if transacoes:
+            atualizar_resumo_mensal(db, adicionadas=transacoes)
+
+        # resposta montada antes do commit: depois dele o objeto expiraria e exigiria um SELECT
+        usuario = Usuario.model_validate(novo_usuario)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        # outro cadastro com o mesmo email entrou entre a verificação e o INSERT? o nome do índice
+        # violado muda entre SQLite e SQL Server: confere o email de novo em vez de ler a mensagem
+        if _email_cadastrado(db, step1.email):
+            raise HTTPException(status_code=422, detail="Usuário com este email já existe")
+        logger.exception("Falha ao gravar onboarding (violação de constraint)")
+        raise HTTPException(status_code=500, detail="Não foi possível concluir o cadastro. Tente novamente.")
     except Exception:
-        # Não falhar todo o onboarding se o seeding falhar; apenas logar
-        logger.exception('Falha ao criar metas/transacoes iniciais do onboarding')
+        db.rollback()
+        logger.exception("Falha ao gravar onboarding")
+        raise HTTPException(status_code=500, detail="Não foi possível concluir o cadastro. Tente novamente.")
+
+    logger.info(f"Onboarding concluído para usuário {usuario.id}: {len(orcamentos)} orçamentos, {len(metas)} metas")
 
     # Gerar token e retornar resposta compatível com /auth/login
     # front pode logar automaticamente após onboarding
-    token = criar_token(novo_usuario.id)
-    return {"token": token, "usuario": Usuario.from_orm(novo_usuario)}
+    token = criar_token(usuario.id)
+    return {"token": token, "usuario": usuario}
 
 # traz o estado do onboardin e as metas cadastradas
-# busca usuarioTable + OnboardingProfileTable do usuario_id
-# carrega as metas do OnboardingGoalTable para exibir no front 
-# monta dicionarios dos passos 
+# usuarioTable + OnboardingProfileTable + OnboardingGoalTable do usuario_id num único SELECT com JOIN
+# monta dicionarios dos passos (ver perfil.py)
 # retorna um array das metas para o front preencher o forms 
 @app.get("/perfil", response_model=OnboardingRead)
 def obter_perfil(user_id: int = Depends(pegar_usuario_atual), db: Session = Depends(get_db)):
     """Retorna o perfil de onboarding do usuário autenticado (se existir)."""
-    import json
-
-    usuario = db.query(UsuarioTable).filter(UsuarioTable.id == user_id).first()
-    profile = db.query(OnboardingProfileTable).filter(OnboardingProfileTable.usuario_id == user_id).first()
-    metas = []
-    if profile:
-        goals = db.query(OnboardingGoalTable).filter(OnboardingGoalTable.onboarding_id == profile.id).all()
-        for g in goals:
-            metas.append({"nome": g.nome, "valor": g.valor, "meses": g.meses})
-
-    step1 = None
-    if usuario or profile:
-        step1 = {
-            "nome": usuario.nome if usuario else None,
-            "email": usuario.email if usuario else None,
-            "idade": profile.idade if profile else None,
-            "profissao": profile.profissao if profile else None,
-            "cpf": profile.cpf if profile else None,
-            "estadoCivil": profile.estado_civil if profile else None,
-        }
-
-    step2 = None
-    if profile:
-        step2 = {
-            "saldoAtual": profile.saldo_atual,
-            "tipoRendaMensal": profile.tipo_renda_mensal,
-            "valorRendaMensal": profile.valor_renda_mensal,
-            "faixaRendaMensal": profile.faixa_renda_mensal,
-        }
-
-    step3 = None
-    if profile:
-        step3 = {
-            "rendaMensal": profile.renda_mensal,
-            "despesaMensal": profile.despesa_mensal,
-            "investimentoMensal": profile.investimento_mensal,
-            "metas": metas,
-        }
-
-    step4 = None
-    if profile and profile.despesas_json:
-        try:
-            step4 = json.loads(profile.despesas_json)
-        except Exception:
-            step4 = None
-
-    return {"step1": step1, "step2": step2, "step3": step3, "step4": step4, "metas": metas}
+    return carregar_perfil(user_id, db)
 
 # permite que o usuario edite o onboarding e sincronixa isso no app 
 @app.put("/perfil", response_model=OnboardingRead)
-def atualizar_perfil(payload: OnboardingUpdate, user_id: int = Depends(pegar_usuario_atual), db: Session = Depends(get_db)):
+async def atualizar_perfil(payload: OnboardingUpdate, user_id: int = Depends(pegar_usuario_atual), db: Session = Depends(get_db)):
     """Atualiza (ou cria) o perfil de onboarding para o usuário autenticado.
 
     Aceita campos parciais; se `step1.senha` for fornecida, atualiza a senha do usuário.
     Se forem enviadas metas em `step3.metas`, as metas existentes serão substituídas.
     """
+    # troca de senha: bcrypt no pool de processos; o resto (só banco) no threadpool
+    senha_hash = None
+    if payload.step1 and payload.step1.senha:
+        senha_hash = await criar_hash_senha_async(payload.step1.senha)
+    return await run_in_threadpool(_atualizar_perfil, payload, user_id, db, senha_hash)
+
+
+# metas do perfil -> MetaTable, sem apagar nada: título já existente (sem diferenciar maiúsculas)
+# atualiza objetivo/prazo e preserva valor_atual; título novo vira meta nova
+# 1 SELECT pelo índice (usuario_id, titulo_normalizado) + 1 INSERT e 1 UPDATE em lote; não faz commit
+def _sincronizar_metas_perfil(db: Session, user_id: int, metas_perfil) -> None:
+    enviadas = {}
+    for g in metas_perfil:
+        nome = (getattr(g, 'nome', None) or '').strip()
+        if not nome:
+            continue
+        # título repetido na mesma lista: vale o último
+        enviadas[normalizar_titulo(nome)] = (
+            nome, _parse_currency(getattr(g, 'valor', None)), _prazo_em_meses(getattr(g, 'meses', None))
+        )
+    if not enviadas:
+        return
+
+    existentes = {}
+    for meta_id, titulo_normalizado, valor_objetivo, prazo in db.query(
+        MetaTable.id, MetaTable.titulo_normalizado, MetaTable.valor_objetivo, MetaTable.prazo
+    ).filter(
+        MetaTable.usuario_id == user_id,
+        MetaTable.titulo_normalizado.in_(list(enviadas))
+    ).order_by(MetaTable.id).all():
+        # títulos duplicados já gravados: atualiza a mais antiga, como o .first() de antes
+        existentes.setdefault(titulo_normalizado, (meta_id, valor_objetivo, prazo))
+
+    agora = datetime.utcnow()
+    novas, alteradas = [], []
+    for chave, (nome, valor_obj, prazo) in enviadas.items():
+        if chave in existentes:
+            meta_id, valor_atual_objetivo, prazo_atual = existentes[chave]
+            alteradas.append({
+                "id": meta_id,
+                "valor_objetivo": float(valor_obj) if valor_obj is not None else valor_atual_objetivo,
+                "prazo": prazo if prazo is not None else prazo_atual,
+            })
+        else:
+            novas.append({
+                "usuario_id": user_id,
+                "titulo": nome,
+                "titulo_normalizado": chave,
+                "descricao": None,
+                "categoria": "Outros",
+                "valor_objetivo": (valor_obj if valor_obj is not None else 0.0),
+                "valor_atual": 0.0,
+                "prazo": prazo,
+                "data_criacao": agora,
+            })
+
+    if novas:
+        db.execute(insert(MetaTable.__table__), novas)
+    if alteradas:
+        # UPDATE por chave primária em executemany
+        db.execute(update(MetaTable), alteradas)
+
+
+# "Renda Mensal (Onboarding)" / "Despesa Mensal (Onboarding)": 1 SELECT para as duas, atualiza ou cria
+# como as outras escritas em transacoes, passa por _EfeitosTransacoes (rollup, saldo da conta, faturas);
+# sem commit: entra no mesmo commit do perfil
+def _sincronizar_transacoes_onboarding(db: Session, user_id: int, s3) -> None:
+    desejadas = {}
+    for campo, tipo, descricao in (
+        ('rendaMensal', 'receita', 'Renda Mensal (Onboarding)'),
+        ('despesaMensal', 'despesa', 'Despesa Mensal (Onboarding)'),
+    ):
+        valor = _parse_currency(getattr(s3, campo, None))
+        if valor is not None:
+            desejadas[(tipo, descricao)] = float(valor)
+    if not desejadas:
+        return
+
+    existentes = {}
+    for t in db.query(Transacao).filter(
+        Transacao.usuario_id == user_id,
+        Transacao.descricao.in_([descricao for _, descricao in desejadas])
+    ).order_by(Transacao.id).all():
+        existentes.setdefault((t.tipo, t.descricao), t)
+
+    agora = datetime.utcnow()
+    efeitos = _EfeitosTransacoes(user_id)
+    novas = []
+    for (tipo, descricao), valor in desejadas.items():
+        t = existentes.get((tipo, descricao))
+        if t is not None:
+            efeitos.removidas.append(_snapshot_transacao(t))
+            t.valor = valor
+            efeitos.adicionadas.append(t)
+        else:
+            novas.append({
+                "usuario_id": user_id,
+                "data": agora,
+                "valor": valor,
+                "tipo": tipo,
+                "descricao": descricao,
+                "conta_id": None,
+                "status": "pendente",
+                "created_at": agora,
+            })
+
+    if novas:
+        db.execute(insert(Transacao.__table__), novas)
+        efeitos.adicionadas.extend(novas)
+    db.flush()
+    efeitos.aplicar(db)
+
+
+def _atualizar_perfil(payload: OnboardingUpdate, user_id: int, db: Session, senha_hash: Optional[str]):
     import json
-    # garante que o usuario existe
-
-    usuario = db.query(UsuarioTable).filter(UsuarioTable.id == user_id).first()
-    if not usuario:
+    # garante que o usuario existe (usuário e perfil numa query só)
+    linha = db.query(UsuarioTable, OnboardingProfileTable).outerjoin(
+        OnboardingProfileTable, OnboardingProfileTable.usuario_id == UsuarioTable.id
+    ).filter(UsuarioTable.id == user_id).order_by(OnboardingProfileTable.id).first()
+    if not linha:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    usuario, profile = linha
 
-    profile = db.query(OnboardingProfileTable).filter(OnboardingProfileTable.usuario_id == user_id).first()
     created = False
     if not profile:
         profile = OnboardingProfileTable(usuario_id=user_id)
         db.add(profile)
-        db.commit()
-        db.refresh(profile)
+        db.flush()  # id do perfil para os objetivos
         created = True
 
     # Step1: nome/email/senha/idade/profissao/cpf/estadoCivil
@@ -1190,8 +2045,8 @@ def atualizar_perfil(payload: OnboardingUpdate, user_id: int = Depends(pegar_usu
             if existe:
                 raise HTTPException(status_code=400, detail="Email já está em uso por outro usuário")
             usuario.email = s1.email
-        if s1.senha:
-            usuario.senha_hash = criar_hash_senha(s1.senha)
+        if senha_hash:
+            usuario.senha_hash = senha_hash
         # profile fields
         if s1.idade is not None:
             profile.idade = s1.idade
@@ -1223,134 +2078,181 @@ def atualizar_perfil(payload: OnboardingUpdate, user_id: int = Depends(pegar_usu
             profile.despesa_mensal = s3.despesaMensal
         if getattr(s3, "investimentoMensal", None) is not None:
             profile.investimento_mensal = s3.investimentoMensal
-        # metas: substituir se enviadas
+        # metas: substituir se enviadas (objetivos do onboarding + sincronização da MetaTable, sem commit no meio)
         if getattr(s3, "metas", None) is not None:
-            # remover metas antigas
-            # Remove onboarding goals linked to this onboarding profile
-            db.query(OnboardingGoalTable).filter(OnboardingGoalTable.onboarding_id == profile.id).delete()
-            db.commit()
-            for g in s3.metas:
-                goal = OnboardingGoalTable(onboarding_id=profile.id, nome=g.nome, valor=g.valor, meses=(g.meses or None))
-                db.add(goal)
-                # - Sincroniza MetaTable de forma não destrutiva:
-                # * Busca por título (case-insensitive); se existe, atualiza objetivo/prazo preservando valor_atual;
-                # * Se não existe, cria nova MetaTable.
-            
-            try:
-                for g in s3.metas:
-                    nome = (getattr(g, 'nome', None) or '').strip()
-                    if not nome:
-                        continue
-                    try:
-                        valor_obj = _parse_currency(getattr(g, 'valor', None))
-                    except Exception:
-                        valor_obj = None
-                    meses = (getattr(g, 'meses', None) or None)
-
-                    existing_meta = db.query(MetaTable).filter(
-                        MetaTable.usuario_id == user_id,
-                        func.lower(MetaTable.titulo) == nome.lower()
-                    ).first()
-
-                    if existing_meta:
-                        # update objetivo and prazo but keep valor_atual
-                        if valor_obj is not None:
-                            existing_meta.valor_objetivo = float(valor_obj)
-                        if meses is not None:
-                            existing_meta.prazo = meses
-                        db.add(existing_meta)
-                    else:
-                        new_meta = MetaTable(
-                            usuario_id=user_id,
-                            titulo=nome,
-                            descricao=None,
-                            categoria=(getattr(g, 'categoria', None) or "Outros"),
-                            valor_objetivo=(valor_obj if valor_obj is not None else 0.0),
-                            valor_atual=0.0,
-                            prazo=meses
-                        )
-                        db.add(new_meta)
-
-                db.commit()
-            except Exception:
-                logger.exception('Falha ao sincronizar MetaTable durante atualizar_perfil')
-
-            # update/create onboarding renda/despesa transactions below after profile persisted
+            db.query(OnboardingGoalTable).filter(
+                OnboardingGoalTable.onboarding_id == profile.id
+            ).delete(synchronize_session=False)
+            goals = [
+                {"onboarding_id": profile.id, "nome": g.nome, "valor": g.valor, "meses": (g.meses or None),
+                 "created_at": datetime.utcnow()}
+                for g in s3.metas
+            ]
+            if goals:
+                db.execute(insert(OnboardingGoalTable.__table__), goals)
+            _sincronizar_metas_perfil(db, user_id, s3.metas)
 
     # Step4
     if getattr(payload, "step4", None) is not None:
         profile.despesas_json = json.dumps(payload.step4)
 
+    # transações "Renda/Despesa Mensal (Onboarding)" acompanham o step3, no mesmo commit do perfil
+    if payload.step3:
+        _sincronizar_transacoes_onboarding(db, user_id, payload.step3)
+
+    # resposta montada com o que já está na sessão, antes do commit (que expiraria os objetos):
+    # sem o SELECT de refresh nem a releitura completa do GET /perfil
+    if payload.step3 and payload.step3.metas is not None:
+        metas = [{"nome": g.nome, "valor": g.valor, "meses": (g.meses or None)} for g in payload.step3.metas]
+    elif created:
+        metas = []
+    else:
+        metas = serializar_metas(db.query(OnboardingGoalTable).filter(
+            OnboardingGoalTable.onboarding_id == profile.id
+        ).order_by(OnboardingGoalTable.id).all())
+    perfil = montar_perfil(usuario, profile, metas)
+
     db.add(usuario)
     db.add(profile)
     db.commit()
-    db.refresh(profile)
-    db.refresh(usuario)
-
-    # After persisting profile, also synchronize the onboarding monthly transactions (renda/despesa)
-    # Update existing "Renda Mensal (Onboarding)" and "Despesa Mensal (Onboarding)" transactions if present,
-    # otherwise create them so the dashboard reflects the new values.
-    try:
-        if payload.step3:
-            s3 = payload.step3
-            renda_val = _parse_currency(getattr(s3, 'rendaMensal', None))
-            despesa_val = _parse_currency(getattr(s3, 'despesaMensal', None))
-
-            # Renda
-            if renda_val is not None:
-                t_rec = db.query(Transacao).filter(
-                    Transacao.usuario_id == user_id,
-                    Transacao.tipo == 'receita',
-                    Transacao.descricao == 'Renda Mensal (Onboarding)'
-                ).first()
-                if t_rec:
-                    t_rec.valor = float(renda_val)
-                    db.add(t_rec)
-                else:
-                    tr = Transacao(
-                        usuario_id=user_id,
-                        data=datetime.utcnow(),
-                        valor=float(renda_val),
-                        tipo='receita',
-                        descricao='Renda Mensal (Onboarding)',
-                        conta_id=None
-                    )
-                    db.add(tr)
-
-            # Despesa
-            if despesa_val is not None:
-                t_desp = db.query(Transacao).filter(
-                    Transacao.usuario_id == user_id,
-                    Transacao.tipo == 'despesa',
-                    Transacao.descricao == 'Despesa Mensal (Onboarding)'
-                ).first()
-                if t_desp:
-                    t_desp.valor = float(despesa_val)
-                    db.add(t_desp)
-                else:
-                    td = Transacao(
-                        usuario_id=user_id,
-                        data=datetime.utcnow(),
-                        valor=float(despesa_val if despesa_val is not None else 0.0),
-                        tipo='despesa',
-                        descricao='Despesa Mensal (Onboarding)',
-                        conta_id=None
-                    )
-                    db.add(td)
 
-            db.commit()
-    except Exception:
-        logger.exception('Falha ao sincronizar transacoes de onboarding durante atualizar_perfil')
+    # metas e transações de onboarding podem ter mudado
+    invalidar_contexto_ia(user_id)
 
-    # Reuse obter_perfil to build response
-    return obter_perfil(user_id=user_id, db=db)
+    return perfil
 
 @app.get("/notificacoes", response_model=List[NotificacaoRead])
-def listar_notificacoes(user_id: int = Depends(pegar_usuario_atual), db: Session = Depends(get_db)):
+async def listar_notificacoes(user_id: int = Depends(pegar_usuario_atual), db = Depends(get_async_db)):
     """Retorna as últimas 20 notificações do usuário."""
-    return db.query(Notificacao).filter(
-        Notificacao.usuario_id == user_id
-    ).order_by(Notificacao.created_at.desc()).limit(20).all()
+    def consultar(s: Session):
+        return s.query(Notificacao).filter(
+            Notificacao.usuario_id == user_id
+        ).order_by(Notificacao.created_at.desc()).limit(20).all()
+    return await db.run_sync(consultar)
+
+# contador do badge: COUNT coberto pelo índice (usuario_id, lida, created_at), sem ler as linhas
+@app.get("/notificacoes/nao-lidas")
+async def contar_notificacoes_nao_lidas(user_id: int = Depends(pegar_usuario_atual), db = Depends(get_async_db)):
+    """Quantidade de notificações não lidas do usuário."""
+    def consultar(s: Session):
+        return s.query(func.count(Notificacao.id)).filter(
+            Notificacao.usuario_id == user_id,
+            Notificacao.lida == False  # noqa: E712
+        ).scalar()
+    return {"nao_lidas": await db.run_sync(consultar) or 0}
+
+
+# histórico por cursor (keyset) em (created_at, id), mesmo formato de /transacoes/pagina
+@app.get("/notificacoes/pagina", response_model=NotificacaoPagina)
+async def listar_notificacoes_pagina(
+    nao_lidas: bool = False,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    user_id: int = Depends(pegar_usuario_atual),
+    db = Depends(get_async_db)
+):
+    limit = max(1, min(limit, 100))
+    posicao = _decodificar_cursor(cursor) if cursor else None
+
+    def consultar(s: Session):
+        q = s.query(Notificacao).filter(Notificacao.usuario_id == user_id)
+        if nao_lidas:
+            q = q.filter(Notificacao.lida == False)  # noqa: E712
+        if posicao:
+            data_cursor, id_cursor = posicao
+            q = q.filter(or_(
+                Notificacao.created_at < data_cursor,
+                and_(Notificacao.created_at == data_cursor, Notificacao.id < id_cursor)
+            ))
+        # busca uma linha a mais só para saber se existe próxima página
+        return q.order_by(Notificacao.created_at.desc(), Notificacao.id.desc()).limit(limit + 1).all()
+
+    itens = await db.run_sync(consultar)
+    next_cursor = None
+    if len(itens) > limit:
+        itens = itens[:limit]
+        next_cursor = _codificar_cursor(itens[-1].created_at, itens[-1].id)
+
+    return {"items": itens, "next_cursor": next_cursor}
+
+
+def _evento_notificacao(n: dict) -> str:
+    # `id:` vira o Last-Event-ID que o EventSource reenvia sozinho ao reconectar
+    return f"id: {n['id']}\nevent: notificacao\ndata: {json.dumps(n, ensure_ascii=False)}\n\n"
+
+
+# token curto para a URL do EventSource: o JWT de login (7 dias) não vai em query string,
+# que acaba em logs de proxy e no histórico do navegador
+@app.post("/notificacoes/stream/token")
+async def token_stream_notificacoes(user_id: int = Depends(pegar_usuario_atual)):
+    return {"token": criar_token_stream(user_id), "expira_em": STREAM_TOKEN_SEGUNDOS}
+
+
+# push em tempo real (server-sent events), no lugar do polling de GET /notificacoes
+# no navegador: POST /notificacoes/stream/token e new EventSource(`${API}/notificacoes/stream?token=${token}`)
+# o token só é conferido ao conectar; se a conexão cair depois que ele expirou, a reconexão
+# automática recebe 401: pedir um token novo e abrir outro EventSource (com ?desde_id=)
+# ver notificacoes_tempo_real.py (hub por processo, heartbeat, fila limitada, catch-up)
+@app.get("/notificacoes/stream")
+async def stream_notificacoes(
+    request: Request,
+    desde_id: Optional[int] = None,  # catch-up explícito; na reconexão automática vale o header Last-Event-ID
+    user_id: int = Depends(pegar_usuario_stream),
+):
+    ultimo_id = request.headers.get("last-event-id")
+    desde = int(ultimo_id) if ultimo_id and ultimo_id.isdigit() else desde_id
+
+    async def eventos():
+        # assina antes do catch-up: o que chegar durante a consulta fica na fila (repetidos são ignorados)
+        assinante = hub_notificacoes.assinar(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            enviados = set()
+            if desde is not None:
+                for n in await run_in_threadpool(notificacoes_desde, user_id, desde):
+                    enviados.add(n["id"])
+                    yield _evento_notificacao(n)
+            while True:
+                try:
+                    n = await asyncio.wait_for(assinante.fila.get(), timeout=NOTIF_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if assinante.atrasado:
+                        return
+                    # heartbeat: mantém a conexão viva em proxies e detecta cliente que sumiu
+                    yield ": ping\n\n"
+                    continue
+                if n is None:  # shutdown
+                    return
+                if n["id"] not in enviados:
+                    yield _evento_notificacao(n)
+                if assinante.atrasado and assinante.fila.empty():
+                    # fila estourou: encerra; o cliente reconecta com Last-Event-ID e recupera o resto
+                    return
+        finally:
+            hub_notificacoes.cancelar(assinante)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# marca várias (ou todas) como lidas num único UPDATE
+@app.post("/notificacoes/ler")
+def marcar_varias_como_lidas(payload: NotificacoesLer, user_id: int = Depends(pegar_usuario_atual), db: Session = Depends(get_db)):
+    """Marca como lidas as notificações em `ids` (ou todas as não lidas, se `ids` não for enviado)."""
+    filtro = [Notificacao.usuario_id == user_id, Notificacao.lida == False]  # noqa: E712
+    if payload.ids is not None:
+        if not payload.ids:
+            return {"ok": True, "atualizadas": 0}
+        filtro.append(Notificacao.id.in_(payload.ids))
+    res = db.execute(
+        update(Notificacao).where(*filtro).values(lida=True).execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return {"ok": True, "atualizadas": res.rowcount}
+
 
 @app.patch("/notificacoes/{notificacao_id}/ler")
 def marcar_como_lida(notificacao_id: int, user_id: int = Depends(pegar_usuario_atual), db: Session = Depends(get_db)):
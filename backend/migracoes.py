@@ -0,0 +1,278 @@
+# migrações versionadas do schema
+#
+# o startup (lifespan em main.py) faz UMA query: SELECT MAX(versao) FROM schema_versao.
+# com o banco em dia não roda create_all, inspect() nem ALTER TABLE --> cold start e scale-out no
+# Azure SQL não pagam a reflexão do schema a cada instância nova
+#
+# as migrações rodam por comando explícito, no comando de inicialização do App Service (ver readme.md):
+#
+#     python migracoes.py             # aplica as pendentes
+#     python migracoes.py --status    # só mostra a versão do banco e o que está pendente
+#
+# o startup também aplica as pendentes sozinho:
+# - sempre que schema_versao ainda não existe (primeiro deploy com este controle, comando não configurado)
+# - em qualquer versão atrasada se MIGRAR_NO_STARTUP (ligado por padrão só no SQLite)
+#
+# regras:
+# - cada migração roda numa transação junto com o registro da sua versão em schema_versao
+# - no SQL Server quem migra segura um lock do banco (sp_getapplock): as outras instâncias esperam
+#   e, ao pegar o lock, releem a versão e não têm mais nada a aplicar
+# - a 1 é o create_all dos modelos atuais; as seguintes conferem se a coluna/índice já existe, porque
+#   um banco novo já nasce com tudo e bancos anteriores a este controle já têm parte do schema
+# - migração nova = função nova no fim de MIGRACOES com o próximo número; nunca editar uma já aplicada
+
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import Column, Integer, String, DateTime, bindparam, func, inspect, insert, select, text, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from database import (
+    Base, engine, DATABASE_URL,
+    MetaTable, Notificacao, Recorrencia, Transacao, UsuarioTable, normalizar_titulo,
+)
+from resumo_mensal import reconstruir_resumo_mensal
+from saldos import reconciliar_saldos
+
+
+logger = logging.getLogger("app")
+
+MIGRAR_NO_STARTUP = os.getenv(
+    "MIGRAR_NO_STARTUP", "1" if DATABASE_URL.startswith("sqlite") else "0"
+) == "1"
+# quanto uma instância espera o lock enquanto outra migra (ms)
+MIGRACAO_LOCK_TIMEOUT_MS = int(os.getenv("MIGRACAO_LOCK_TIMEOUT_MS", "600000"))
+
+
+class SchemaVersao(Base):
+    __tablename__ = "schema_versao"
+    versao = Column(Integer, primary_key=True, autoincrement=False)
+    descricao = Column(String(200), nullable=False)
+    aplicada_em = Column(DateTime, default=datetime.utcnow)
+
+
+def _garantir_coluna(conn, modelo, coluna, tipo_sql, preencher=None):
+    """
+    create_all não altera tabelas que já existem: adiciona `coluna` se ela faltar.
+    `ALTER TABLE x ADD col tipo` vale tanto no SQLite quanto no SQL Server.
+    `preencher` = (sql, params) opcional para popular as linhas antigas ({tabela} é substituído),
+    ou uma função que recebe a conexão (quando o valor é calculado em Python).
+    """
+    tabela = modelo.__table__
+    cols = [c['name'] for c in inspect(conn).get_columns(tabela.name, schema=tabela.schema)]
+    if coluna in cols:
+        return
+    logger.info(f"Migração: adicionando {tabela.name}.{coluna}")
+    conn.exec_driver_sql(f"ALTER TABLE {tabela.fullname} ADD {coluna} {tipo_sql}")
+    if callable(preencher):
+        preencher(conn)
+    elif preencher:
+        sql, params = preencher
+        conn.execute(text(sql.format(tabela=tabela.fullname)), params)
+
+
+# --- migrações (em ordem; cada uma recebe a conexão da transação) ---
+
+def _m001_tabelas(conn):
+    # checkfirst=True: em banco existente só cria as tabelas que faltam
+    Base.metadata.create_all(bind=conn, checkfirst=True)
+
+
+def _m002_usuarios_onboarding_step(conn):
+    _garantir_coluna(conn, UsuarioTable, "onboarding_step", "INTEGER DEFAULT 0")
+
+
+def _m003_recorrencias_gerada_ate(conn):
+    # recorrências que já existiam começam a gerar transações a partir de hoje (não refaz o histórico)
+    _garantir_coluna(conn, Recorrencia, "gerada_ate", "DATE",
+                     preencher=("UPDATE {tabela} SET gerada_ate = :hoje", {"hoje": date.today()}))
+
+
+def _m004_transacoes_parcelamento_id(conn):
+    _garantir_coluna(conn, Transacao, "parcelamento_id", "VARCHAR(36)")
+
+
+def _m005_notificacoes_referencia(conn):
+    _garantir_coluna(conn, Notificacao, "referencia", "VARCHAR(64)")
+
+
+def _preencher_titulo_normalizado(conn):
+    # em Python: o LOWER do SQLite só converte ASCII ('EDUCAÇÃO' viraria 'educaÇÃo')
+    metas = MetaTable.__table__
+    linhas = conn.execute(select(metas.c.id, metas.c.titulo)).all()
+    if linhas:
+        conn.execute(
+            update(metas).where(metas.c.id == bindparam("b_id")).values(titulo_normalizado=bindparam("b_titulo")),
+            [{"b_id": i, "b_titulo": normalizar_titulo(t)} for i, t in linhas],
+        )
+
+
+def _m006_metas_titulo_normalizado(conn):
+    _garantir_coluna(conn, MetaTable, "titulo_normalizado", "VARCHAR(120)",
+                     preencher=_preencher_titulo_normalizado)
+
+
+def _m007_indices(conn):
+    # create_all não adiciona índices novos em tabelas que já existiam; cria os que faltarem
+    # (depois das colunas novas, já que alguns índices dependem delas)
+    for tabela in Base.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            indice.create(bind=conn, checkfirst=True)
+
+
+def _m008_recalcular_resumo_e_saldos(conn):
+    # resumo_mensal e contas.saldo_cache só recebem deltas das escritas: em banco que já tinha
+    # transações antes deles, recalcula tudo uma vez a partir de transacoes.
+    # os commits por lote das funções viram savepoints (a Session entra na transação da migração)
+    db = Session(bind=conn)
+    try:
+        reconstruir_resumo_mensal(db)
+        reconciliar_saldos(db)
+    finally:
+        db.close()
+
+
+MIGRACOES: List[Tuple[int, str, Callable]] = [
+    (1, "tabelas dos modelos", _m001_tabelas),
+    (2, "usuarios.onboarding_step", _m002_usuarios_onboarding_step),
+    (3, "recorrencias.gerada_ate", _m003_recorrencias_gerada_ate),
+    (4, "transacoes.parcelamento_id", _m004_transacoes_parcelamento_id),
+    (5, "notificacoes.referencia", _m005_notificacoes_referencia),
+    (6, "metas.titulo_normalizado", _m006_metas_titulo_normalizado),
+    (7, "índices em tabelas existentes", _m007_indices),
+    (8, "recalcula resumo_mensal e saldo_cache", _m008_recalcular_resumo_e_saldos),
+]
+
+VERSAO_ESPERADA = MIGRACOES[-1][0]
+
+
+def versao_do_banco() -> Optional[int]:
+    """Maior versão aplicada (0 = controle criado e vazio); None se schema_versao ainda não existe."""
+    with engine.connect() as conn:
+        try:
+            return conn.execute(select(func.max(SchemaVersao.versao))).scalar() or 0
+        except DBAPIError:
+            # banco novo ou anterior a este controle
+            return None
+
+
+def _versao_sem_erro() -> Optional[int]:
+    """versao_do_banco() que devolve None se nem a conexão funcionar."""
+    try:
+        return versao_do_banco()
+    except Exception:
+        return None
+
+
+def pendentes(versao: Optional[int]) -> List[Tuple[int, str, Callable]]:
+    return [m for m in MIGRACOES if m[0] > (versao or 0)]
+
+
+@contextmanager
+def _trava_migracoes():
+    """
+    Lock exclusivo no banco enquanto migra (SQL Server: sp_getapplock com dono = sessão).
+    No SQLite não há várias instâncias: não trava.
+    """
+    if engine.dialect.name != "mssql":
+        yield
+        return
+    with engine.connect() as conn:
+        resultado = conn.execute(text(
+            "DECLARE @r INT; "
+            "EXEC @r = sp_getapplock @Resource = 'monevo_migracoes', @LockMode = 'Exclusive', "
+            "@LockOwner = 'Session', @LockTimeout = :espera; "
+            "SELECT @r"
+        ), {"espera": MIGRACAO_LOCK_TIMEOUT_MS}).scalar()
+        if resultado is None or resultado < 0:
+            raise RuntimeError(f"Não conseguiu o lock das migrações (sp_getapplock = {resultado})")
+        try:
+            yield
+        finally:
+            conn.execute(text(
+                "EXEC sp_releaseapplock @Resource = 'monevo_migracoes', @LockOwner = 'Session'"
+            ))
+            conn.commit()
+
+
+def aplicar_migracoes() -> List[int]:
+    """
+    Aplica as migrações pendentes, uma transação por versão, segurando o lock das migrações.
+    Retorna as versões aplicadas.
+    """
+    with _trava_migracoes():
+        return _aplicar_pendentes()
+
+
+def _aplicar_pendentes() -> List[int]:
+    SchemaVersao.__table__.create(bind=engine, checkfirst=True)
+    aplicadas = []
+    # a versão é lida já com o lock: quem esperou outra instância migrar não reaplica nada
+    for versao, descricao, migrar in pendentes(versao_do_banco()):
+        inicio = time.perf_counter()
+        with engine.begin() as conn:
+            migrar(conn)
+            conn.execute(insert(SchemaVersao.__table__).values(
+                versao=versao, descricao=descricao, aplicada_em=datetime.utcnow()
+            ))
+        logger.info(f"Migração {versao} ({descricao}) aplicada em {(time.perf_counter() - inicio) * 1000:.0f} ms")
+        aplicadas.append(versao)
+    return aplicadas
+
+
+def preparar_schema() -> Dict[str, Any]:
+    """
+    Chamado no startup: confere a versão do schema (1 query) e migra se schema_versao não existe
+    ou se MIGRAR_NO_STARTUP.
+    Retorna o estado para o GET / (versão, pendentes, tempo gasto).
+    """
+    inicio = time.perf_counter()
+    versao, faltando, erro = None, list(MIGRACOES), None
+    try:
+        versao = versao_do_banco()
+        faltando = pendentes(versao)
+        if faltando and (MIGRAR_NO_STARTUP or versao is None):
+            aplicar_migracoes()
+            versao, faltando = VERSAO_ESPERADA, []
+        elif faltando:
+            # versão atrasada sem MIGRAR_NO_STARTUP: rotas que usam colunas novas falham até rodar o comando
+            logger.error(
+                f"Schema do banco na versão {versao}, o código espera {VERSAO_ESPERADA}: "
+                f"rode `python migracoes.py` (pendentes: {[m[0] for m in faltando]})"
+            )
+    except Exception as e:
+        # como antes com create_tables: o app sobe mesmo assim e o erro fica no log e no GET /
+        logger.exception("Falha ao verificar/migrar o schema")
+        erro = repr(e)
+        versao = _versao_sem_erro()
+        faltando = pendentes(versao)
+    return {
+        "versao": versao,
+        "esperada": VERSAO_ESPERADA,
+        "pendentes": [m[0] for m in faltando],
+        "erro": erro,
+        "ms": round((time.perf_counter() - inicio) * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Migrações versionadas do schema do banco")
+    parser.add_argument("--status", action="store_true", help="só mostra a versão do banco e as pendentes")
+    args = parser.parse_args()
+
+    versao_atual = versao_do_banco()
+    print(f"Banco na versão {versao_atual}, código espera {VERSAO_ESPERADA}")
+    if args.status:
+        for versao, descricao, _ in pendentes(versao_atual):
+            print(f"  pendente: {versao} {descricao}")
+    else:
+        aplicadas = aplicar_migracoes()
+        print(f"Aplicadas: {aplicadas}" if aplicadas else "Nada a aplicar")
@@ -140,6 +140,18 @@ class CategoriaRead(CategoriaBase):
         orm_mode = True
 
 
+class CategoriaArvore(BaseModel):
+    """Nó da árvore de GET /categorias (pais com seus filhos)."""
+    id: int
+    tipo: str
+    chave: str
+    nome: str
+    icone: Optional[str] = None
+    ordem: int = 0
+    parent_id: Optional[int] = None
+    filhos: List["CategoriaArvore"] = []
+
+
 class CategoriaUpdate(BaseModel):
     nome: Optional[str] = Field(None, max_length=120)
     ordem: Optional[int] = Field(None, ge=0)
@@ -253,6 +265,7 @@ class TransacaoRead(TransacaoBase):
     categoria_cache: Optional[str] = None
     conta_nome_cache: Optional[str] = None
     meta_nome_cache: Optional[str] = None
+    parcelamento_id: Optional[str] = None
     created_at: Optional[datetime] = None
 
     class Config:
@@ -277,15 +290,142 @@ class TransacaoUpdate(BaseModel):
     status: Optional[str] = None
 
 
+class TransacaoOperacao(BaseModel):
+    """Uma operação de /transacoes/batch; `dados` segue TransacaoCreate (create) ou TransacaoUpdate (update)."""
+    op: str = Field(..., description="'create'|'update'|'delete'")
+    id: Optional[int] = None
+    dados: Optional[dict] = None
+
+    @validator("op")
+    def validar_op(cls, v):
+        allowed = ["create", "update", "delete"]
+        if v not in allowed:
+            raise ValueError(f"op inválida, use uma de: {allowed}")
+        return v
+
+
+class TransacaoLote(BaseModel):
+    operacoes: List[TransacaoOperacao] = Field(..., min_length=1, max_length=500)
+
+
+class TransacaoOperacaoResultado(BaseModel):
+    indice: int
+    op: str
+    ok: bool
+    id: Optional[int] = None
+    erro: Optional[str] = None
+
+
+class TransacaoLoteResultado(BaseModel):
+    aplicadas: int
+    falhas: int
+    resultados: List[TransacaoOperacaoResultado]
+
+
+class TransacaoPagina(BaseModel):
+    """Página de transações para /transacoes/pagina (paginação por cursor)."""
+    items: List[TransacaoRead]
+    next_cursor: Optional[str] = None  # None quando não há mais páginas
+
+
+# -------------------------
+# Compra parcelada no cartão
+# -------------------------
+class TransacaoParceladaCreate(BaseModel):
+    """Compra em N parcelas; cada parcela vira uma transação na fatura correspondente do cartão."""
+    cartao_id: int = Field(..., description="Conta do tipo cartão")
+    valor_total: float = Field(..., gt=0)
+    parcelas: int = Field(..., ge=2, le=72)
+    data: Optional[datetime] = None  # data da compra (padrão: agora)
+    categoria_id: Optional[int] = None
+    categoria: Optional[str] = None
+    descricao: Optional[str] = Field(None, max_length=255)
+    status: Optional[str] = "pendente"
+
+
+class TransacaoParceladaUpdate(BaseModel):
+    """Alterações aplicadas a todas as parcelas da compra."""
+    valor_total: Optional[float] = Field(None, gt=0)
+    categoria_id: Optional[int] = None
+    categoria: Optional[str] = None
+    descricao: Optional[str] = Field(None, max_length=255)
+    status: Optional[str] = None
+
+
+class TransacaoParceladaRead(BaseModel):
+    parcelamento_id: str
+    valor_total: float
+    parcelas: List[TransacaoRead]
+
+
+# -------------------------
+# Importação de extratos (CSV / OFX)
+# -------------------------
+class ImportacaoErro(BaseModel):
+    linha: int
+    erro: str
+
+
+class ImportacaoResultado(BaseModel):
+    importadas: int
+    duplicadas: int  # já importadas antes (mesma referencia/FITID na mesma conta)
+    total_erros: int
+    erros: List[ImportacaoErro]  # limitado às primeiras linhas com erro
+
+
+# -------------------------
+# Resumo (dashboard / relatórios, somente leitura)
+# -------------------------
+class ResumoCategoria(BaseModel):
+    categoria_id: Optional[int] = None
+    categoria: str
+    tipo: str
+    total: float
+    quantidade: int
+
+
+class ResumoMes(BaseModel):
+    ano_mes: str  # 'AAAA-MM'
+    receitas: float
+    despesas: float
+    investimentos: float
+    saldo: float
+
+
+class ResumoRead(BaseModel):
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    receitas: float
+    despesas: float
+    investimentos: float
+    saldo: float  # receitas - despesas
+    quantidade: int
+    por_categoria: List[ResumoCategoria]
+    por_mes: List[ResumoMes]
+
+
+class ResumoMensalRead(BaseModel):
+    """Linha do rollup mensal (tabela resumo_mensal)."""
+    ano_mes: str  # 'AAAA-MM'
+    categoria_id: Optional[int] = None
+    categoria: Optional[str] = None
+    tipo: str
+    total: float
+    quantidade: int
+
+
 # -------------------------
 # Fatura (somente leitura / resumo)
 # -------------------------
 class FaturaRead(BaseModel):
     conta_cartao_id: int
+    referencia: Optional[str] = None  # 'AAAA-MM'; None em período avulso (inicio/fim)
     periodo_inicio: date
     periodo_fim: date
+    vencimento: Optional[date] = None
     total: float
     count: int
+    fechada: bool = False
 
     class Config:
         orm_mode = True
@@ -417,6 +557,15 @@ class NotificacaoRead(NotificacaoBase):
 class NotificacaoUpdate(BaseModel):
     lida: bool
 
+class NotificacaoPagina(BaseModel):
+    """Página do histórico de notificações para /notificacoes/pagina (paginação por cursor)."""
+    items: List[NotificacaoRead]
+    next_cursor: Optional[str] = None  # None quando não há mais páginas
+
+class NotificacoesLer(BaseModel):
+    """POST /notificacoes/ler: ids a marcar como lidas; sem ids, marca todas."""
+    ids: Optional[List[int]] = Field(None, max_length=1000)
+
 """
 Cada entidade (ex.: Meta, Conta, Categoria, Transação, Usuário) tem 3 tipos de schema Pydantic:
 
@@ -0,0 +1,35 @@
+# schemas pydantic das rotas de IA (ia_routes.py)
+
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any
+
+
+# POST /ia/chat e /ia/chat/stream
+class IaChatRequest(BaseModel):
+    mensagem: str = Field(..., min_length=1, max_length=2000, description="Pergunta do usuário para a IA")
+
+
+class IaChatResponse(BaseModel):
+    resposta: str
+    acoes_sugeridas: Optional[List[str]] = None
+    debug: Optional[Dict[str, Any]] = None
+
+
+# POST /ia/metas/sugerir
+class IaMetasRequest(BaseModel):
+    objetivo_principal: Optional[str] = Field(None, max_length=255)
+    horizonte_meses: Optional[int] = Field(None, ge=1, le=120)
+
+
+class IaMetaSugerida(BaseModel):
+    titulo: str
+    descricao: Optional[str] = None
+    categoria: Optional[str] = None
+    valor_objetivo: Optional[float] = None
+    prazo_meses: Optional[int] = None
+    passos_semanais: Optional[List[str]] = None
+
+
+class IaMetasResponse(BaseModel):
+    metas: List[IaMetaSugerida]
+    resumo_plano: str
@@ -0,0 +1,217 @@
+# push de notificações em tempo real: GET /notificacoes/stream (server-sent events)
+#
+# um hub por processo distribui as notificações novas para as conexões abertas de cada usuário:
+# - uma única tarefa lê `notificacoes` por id (marca d'água = maior id já distribuído) a cada
+#   NOTIF_INTERVALO_POLL segundos --> 1 query por processo, não 1 por aba aberta, e pega tanto as
+#   gravadas pela API quanto as do timer VerificarOrcamentos (outro processo, direto no banco)
+# - avisar_apos_commit(db) acorda a tarefa assim que a transação de quem gravou a notificação faz commit
+# - a leitura volta NOTIF_JANELA_IDS ids atrás da marca: uma transação que pegou um id menor e fez
+#   commit depois ainda é entregue; ids já distribuídos ficam num conjunto para não repetir
+# - cada conexão tem uma fila limitada (NOTIF_FILA_MAX); cliente lento que enche a fila é desconectado
+#   e, ao reconectar com Last-Event-ID, recupera o que perdeu pelo catch-up (notificações com id maior)
+# - sem conexões abertas a tarefa para (e a marca é descartada)
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+import asyncio
+import logging
+import os
+
+import anyio
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Notificacao
+
+
+NOTIF_INTERVALO_POLL = float(os.getenv("NOTIF_INTERVALO_POLL", "2"))
+NOTIF_HEARTBEAT = float(os.getenv("NOTIF_HEARTBEAT", "15"))
+NOTIF_FILA_MAX = int(os.getenv("NOTIF_FILA_MAX", "100"))
+NOTIF_JANELA_IDS = int(os.getenv("NOTIF_JANELA_IDS", "100"))
+NOTIF_CATCHUP_MAX = 100
+NOTIF_LOTE_POLL = 500
+
+logger = logging.getLogger("app")
+
+
+def serializar_notificacao(n) -> Dict[str, Any]:
+    return {
+        "id": n.id,
+        "usuario_id": n.usuario_id,
+        "tipo": n.tipo,
+        "titulo": n.titulo,
+        "mensagem": n.mensagem,
+        "lida": bool(n.lida),
+        "created_at": n.created_at.isoformat() if n.created_at else None,
+    }
+
+
+def _ids_recentes() -> List[int]:
+    """ids dentro da janela abaixo do maior id atual: já existiam antes da primeira conexão, não são novas."""
+    db = SessionLocal()
+    try:
+        maior = db.query(func.coalesce(func.max(Notificacao.id), 0)).scalar() or 0
+        ids = [i for (i,) in db.query(Notificacao.id).filter(
+            Notificacao.id > maior - NOTIF_JANELA_IDS
+        ).order_by(Notificacao.id).all()]
+        return ids or [maior]
+    finally:
+        db.close()
+
+
+def _novas_desde(id_minimo: int) -> List[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        linhas = db.query(Notificacao).filter(
+            Notificacao.id > id_minimo
+        ).order_by(Notificacao.id).limit(NOTIF_LOTE_POLL).all()
+        return [serializar_notificacao(n) for n in linhas]
+    finally:
+        db.close()
+
+
+def notificacoes_desde(usuario_id: int, desde_id: int) -> List[Dict[str, Any]]:
+    """Catch-up na reconexão: notificações do usuário com id > desde_id, da mais antiga para a mais nova."""
+    db = SessionLocal()
+    try:
+        linhas = db.query(Notificacao).filter(
+            Notificacao.usuario_id == usuario_id,
+            Notificacao.id > desde_id
+        ).order_by(Notificacao.id).limit(NOTIF_CATCHUP_MAX).all()
+        return [serializar_notificacao(n) for n in linhas]
+    finally:
+        db.close()
+
+
+class Assinante:
+    """Uma conexão SSE aberta. `fila` recebe dicts de notificação; None = encerrar."""
+    def __init__(self, usuario_id: int):
+        self.usuario_id = usuario_id
+        self.fila: asyncio.Queue = asyncio.Queue(maxsize=NOTIF_FILA_MAX)
+        self.atrasado = False
+
+
+class HubNotificacoes:
+    def __init__(self):
+        self._assinantes: Dict[int, Set[Assinante]] = {}
+        self._marca: Optional[int] = None
+        self._distribuidos: "OrderedDict[int, None]" = OrderedDict()
+        self._tarefa: Optional[asyncio.Task] = None
+        self._acordar: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.entregues = 0
+        self.desconectados_por_atraso = 0
+
+    # --- conexões (sempre no event loop) ---
+
+    def assinar(self, usuario_id: int) -> Assinante:
+        assinante = Assinante(usuario_id)
+        self._assinantes.setdefault(usuario_id, set()).add(assinante)
+        if self._tarefa is None or self._tarefa.done():
+            self._loop = asyncio.get_running_loop()
+            self._acordar = asyncio.Event()
+            self._tarefa = asyncio.create_task(self._distribuir())
+        return assinante
+
+    def cancelar(self, assinante: Assinante) -> None:
+        conjunto = self._assinantes.get(assinante.usuario_id)
+        if conjunto is not None:
+            conjunto.discard(assinante)
+            if not conjunto:
+                del self._assinantes[assinante.usuario_id]
+
+    def avisar(self) -> None:
+        """Acorda a leitura agora em vez de esperar o intervalo. Pode ser chamado de qualquer thread."""
+        if self._loop is not None and self._acordar is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._acordar.set)
+
+    async def encerrar(self) -> None:
+        """Shutdown: fecha as conexões abertas e para a tarefa de leitura."""
+        for conjunto in list(self._assinantes.values()):
+            for assinante in list(conjunto):
+                self._entregar(assinante, None)
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._tarefa = None
+
+    def estatisticas(self) -> Dict[str, Any]:
+        return {
+            "conexoes": sum(len(c) for c in self._assinantes.values()),
+            "usuarios": len(self._assinantes),
+            "entregues": self.entregues,
+            "desconectados_por_atraso": self.desconectados_por_atraso,
+            "marca": self._marca,
+        }
+
+    # --- distribuição ---
+
+    def _entregar(self, assinante: Assinante, item: Optional[Dict[str, Any]]) -> None:
+        try:
+            assinante.fila.put_nowait(item)
+        except asyncio.QueueFull:
+            # cliente não está consumindo: derruba a conexão em vez de acumular memória;
+            # ele reconecta com Last-Event-ID e recupera o que perdeu pelo catch-up
+            assinante.atrasado = True
+            self.cancelar(assinante)
+            self.desconectados_por_atraso += 1
+
+    async def _distribuir(self) -> None:
+        try:
+            ids = await anyio.to_thread.run_sync(_ids_recentes)
+            self._distribuidos = OrderedDict.fromkeys(ids)
+            self._marca = ids[-1]
+            while self._assinantes:
+                try:
+                    await asyncio.wait_for(self._acordar.wait(), timeout=NOTIF_INTERVALO_POLL)
+                except asyncio.TimeoutError:
+                    pass
+                self._acordar.clear()
+                if not self._assinantes:
+                    break
+
+                try:
+                    novas = await anyio.to_thread.run_sync(_novas_desde, max(0, self._marca - NOTIF_JANELA_IDS))
+                except Exception:
+                    logger.exception("Falha ao ler notificações novas")
+                    continue
+
+                for n in novas:
+                    if n["id"] in self._distribuidos:
+                        continue
+                    self._distribuidos[n["id"]] = None
+                    self._marca = max(self._marca, n["id"])
+                    for assinante in list(self._assinantes.get(n["usuario_id"], ())):
+                        self._entregar(assinante, n)
+                        self.entregues += 1
+                # só ids dentro da janela (perto da marca) podem aparecer de novo
+                while self._distribuidos and next(iter(self._distribuidos)) <= self._marca - NOTIF_JANELA_IDS:
+                    self._distribuidos.popitem(last=False)
+                if len(novas) >= NOTIF_LOTE_POLL:
+                    self._acordar.set()  # ainda há mais: lê o próximo lote sem esperar
+        finally:
+            # sem conexões: na próxima assinatura a marca é lida de novo
+            self._marca = None
+            self._distribuidos.clear()
+
+
+hub = HubNotificacoes()
+
+
+def avisar_apos_commit(db: Session) -> None:
+    """Marca a sessão: quando ela fizer commit, o hub lê as notificações novas na hora."""
+    db.info["avisar_notificacoes"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _depois_do_commit(sessao: Session) -> None:
+    if sessao.info.pop("avisar_notificacoes", False):
+        hub.avisar()
+
+
+@event.listens_for(Session, "after_rollback")
+def _depois_do_rollback(sessao: Session) -> None:
+    sessao.info.pop("avisar_notificacoes", None)
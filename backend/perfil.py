@@ -0,0 +1,106 @@
+# perfil de onboarding do usuário (GET /perfil e resposta do PUT /perfil)
+#
+# a tela de perfil é carregada em quase toda abertura do app:
+# - usuário + perfil + objetivos vêm num único SELECT com LEFT JOIN (antes: 3 queries), em todo GET:
+#   com vários workers, um cache do perfil montado ficaria desatualizado nos processos que não
+#   receberam o PUT /perfil ou PUT /auth/me
+# - só o despesas_json decodificado fica em cache, por usuário, junto com o texto de onde saiu:
+#   o próprio texto lido na query é a versão (mudou no banco --> decodifica de novo), sem invalidação
+
+from typing import Any, Dict, List, Optional
+import json
+import os
+
+from sqlalchemy.orm import Session
+
+from cache import CacheLRU
+from database import UsuarioTable, OnboardingProfileTable, OnboardingGoalTable
+
+
+PERFIL_TTL = float(os.getenv("PERFIL_TTL", "600"))
+PERFIL_MAX = int(os.getenv("PERFIL_MAX", "10000"))
+
+_despesas = CacheLRU(max_itens=PERFIL_MAX, ttl=PERFIL_TTL)
+
+
+def serializar_metas(goals) -> List[Dict[str, Any]]:
+    return [{"nome": g.nome, "valor": g.valor, "meses": g.meses} for g in goals]
+
+
+def _decodificar_despesas(profile) -> Optional[Dict[str, Any]]:
+    """
+    json.loads(profile.despesas_json), reaproveitado enquanto o texto no banco for o mesmo.
+    O dict devolvido é compartilhado pelo cache: quem chama não deve alterá-lo.
+    """
+    texto = profile.despesas_json
+    if not texto:
+        return None
+    guardado = _despesas.obter(profile.usuario_id)
+    if guardado is not None and guardado[0] == texto:
+        return guardado[1]
+    try:
+        despesas = json.loads(texto)
+    except Exception:
+        despesas = None
+    _despesas.definir(profile.usuario_id, (texto, despesas))
+    return despesas
+
+
+def montar_perfil(usuario, profile, metas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Passos do onboarding (formato de OnboardingRead) a partir das linhas já carregadas."""
+    step1 = None
+    if usuario or profile:
+        step1 = {
+            "nome": usuario.nome if usuario else None,
+            "email": usuario.email if usuario else None,
+            "idade": profile.idade if profile else None,
+            "profissao": profile.profissao if profile else None,
+            "cpf": profile.cpf if profile else None,
+            "estadoCivil": profile.estado_civil if profile else None,
+        }
+
+    step2 = None
+    step3 = None
+    step4 = None
+    if profile:
+        step2 = {
+            "saldoAtual": profile.saldo_atual,
+            "tipoRendaMensal": profile.tipo_renda_mensal,
+            "valorRendaMensal": profile.valor_renda_mensal,
+            "faixaRendaMensal": profile.faixa_renda_mensal,
+        }
+        step3 = {
+            "rendaMensal": profile.renda_mensal,
+            "despesaMensal": profile.despesa_mensal,
+            "investimentoMensal": profile.investimento_mensal,
+            "metas": metas,
+        }
+        step4 = _decodificar_despesas(profile)
+
+    return {"step1": step1, "step2": step2, "step3": step3, "step4": step4, "metas": metas}
+
+
+def carregar_perfil(user_id: int, db: Session) -> Dict[str, Any]:
+    """1 query: usuarios LEFT JOIN onboarding_profiles LEFT JOIN onboarding_goals."""
+    linhas = db.query(
+        UsuarioTable.nome, UsuarioTable.email, OnboardingProfileTable, OnboardingGoalTable
+    ).outerjoin(
+        OnboardingProfileTable, OnboardingProfileTable.usuario_id == UsuarioTable.id
+    ).outerjoin(
+        OnboardingGoalTable, OnboardingGoalTable.onboarding_id == OnboardingProfileTable.id
+    ).filter(
+        UsuarioTable.id == user_id
+    ).order_by(OnboardingProfileTable.id, OnboardingGoalTable.id).all()
+
+    if not linhas:
+        return montar_perfil(None, None, [])
+
+    usuario = linhas[0]
+    # perfis duplicados (legado): vale o primeiro, como no .first() de antes
+    profile = linhas[0][2]
+    goals = [l[3] for l in linhas if l[3] is not None and profile is not None and l[2].id == profile.id]
+    return montar_perfil(usuario, profile, serializar_metas(goals))
+
+
+def estatisticas_cache_perfil() -> Dict[str, Any]:
+    return _despesas.estatisticas()
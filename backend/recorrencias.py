@@ -0,0 +1,176 @@
+# materialização de recorrências (salário, aluguel, assinaturas...) em transações
+# cada Recorrencia ativa vira uma Transacao por ocorrência até o horizonte pedido,
+# ligada por recorrencia_id; Recorrencia.gerada_ate marca até onde já foi gerado,
+# então rodar de novo nunca duplica (e transações apagadas pelo usuário não voltam)
+#
+# job (cron / WebJob), processa os usuários em lotes com INSERT em lote por lote:
+#     python recorrencias.py               --> ocorrências até hoje
+#     python recorrencias.py --dias 30     --> até daqui a 30 dias
+#     python recorrencias.py --usuario 7
+
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+import argparse
+
+from sqlalchemy import select, insert, update, or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Recorrencia, Transacao, Conta
+from faturas import dia_no_mes, somar_meses, invalidar_faturas
+from resumo_mensal import atualizar_resumo_mensal
+from saldos import atualizar_saldos
+
+
+def ocorrencias(rec: Recorrencia, depois_de: date, ate: date) -> List[date]:
+    """
+    Datas da recorrência no intervalo (depois_de, ate].
+    mensal: todo mês no dia_base | semanal: dia_base 1-7 = seg-dom (senão o dia da semana da criação)
+    anual: no mês da criação, no dia_base. Sem periodicidade = mensal.
+    """
+    base = rec.criado_em.date() if rec.criado_em else depois_de
+    periodicidade = (rec.periodicidade or "mensal").lower()
+    datas = []
+
+    if periodicidade == "semanal":
+        dia_semana = rec.dia_base - 1 if rec.dia_base and rec.dia_base <= 7 else base.weekday()
+        d = depois_de + timedelta(days=1)
+        d += timedelta(days=(dia_semana - d.weekday()) % 7)
+        while d <= ate:
+            datas.append(d)
+            d += timedelta(days=7)
+
+    elif periodicidade == "anual":
+        dia = rec.dia_base or base.day
+        for ano in range(depois_de.year, ate.year + 1):
+            d = dia_no_mes(ano, base.month, dia)
+            if depois_de < d <= ate:
+                datas.append(d)
+
+    else:
+        dia = rec.dia_base or base.day
+        ano, mes = depois_de.year, depois_de.month
+        while True:
+            d = dia_no_mes(ano, mes, dia)
+            if d > ate:
+                break
+            if d > depois_de:
+                datas.append(d)
+            ano, mes = somar_meses(ano, mes, 1)
+
+    return datas
+
+
+def _reservar(db: Session, r: Recorrencia, ate: date) -> bool:
+    """
+    Avança gerada_ate só se ainda estiver no valor lido (UPDATE condicional, um por recorrência:
+    o rowcount de um executemany não diz quais linhas bateram). Uma execução concorrente espera o
+    lock da linha e, depois do commit da outra, não encontra mais o valor antigo --> rowcount 0.
+    """
+    ainda_igual = Recorrencia.gerada_ate.is_(None) if r.gerada_ate is None else Recorrencia.gerada_ate == r.gerada_ate
+    resultado = db.execute(
+        update(Recorrencia).where(Recorrencia.id == r.id, ainda_igual).values(gerada_ate=ate)
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount == 1
+
+
+def materializar_recorrencias(db: Session, ate: date, usuario_id: Optional[int] = None, lote_usuarios: int = 500) -> int:
+    """
+    Gera as transações de todas as recorrências ativas até `ate` (inclusive).
+    Por lote de usuários: 1 SELECT das recorrências, 1 SELECT dos nomes de conta,
+    1 UPDATE condicional de gerada_ate por recorrência, 1 INSERT em lote das transações e um commit.
+    Retorna o nº de transações geradas.
+    """
+    hoje = date.today()
+    geradas = 0
+    ultimo_usuario = None
+
+    while True:
+        if usuario_id is not None:
+            usuarios = [usuario_id] if ultimo_usuario is None else []
+        else:
+            q = select(Recorrencia.usuario_id).where(Recorrencia.ativo == True)  # noqa: E712
+            if ultimo_usuario is not None:
+                q = q.where(Recorrencia.usuario_id > ultimo_usuario)
+            usuarios = db.execute(
+                q.group_by(Recorrencia.usuario_id).order_by(Recorrencia.usuario_id).limit(lote_usuarios)
+            ).scalars().all()
+        if not usuarios:
+            break
+        ultimo_usuario = usuarios[-1]
+
+        recs = db.query(Recorrencia).filter(
+            Recorrencia.usuario_id.in_(usuarios),
+            Recorrencia.ativo == True,  # noqa: E712
+            Recorrencia.valor > 0,
+            or_(Recorrencia.gerada_ate.is_(None), Recorrencia.gerada_ate < ate),
+        ).all()
+
+        conta_ids = {r.conta_id for r in recs if r.conta_id}
+        # (conta_id, dono) -> nome: conta de outro usuário não empresta o nome
+        nomes_contas = {
+            (c_id, dono): nome for c_id, dono, nome in
+            db.query(Conta.id, Conta.usuario_id, Conta.nome).filter(Conta.id.in_(conta_ids)).all()
+        } if conta_ids else {}
+
+        linhas = []
+        agora = datetime.utcnow()
+        for r in recs:
+            # reserva o intervalo antes de gerar: o job noturno e POST /recorrencias/materializar podem
+            # rodar juntos e ler o mesmo gerada_ate; quem perder a reserva não gera nada desta recorrência
+            if not _reservar(db, r, ate):
+                continue
+            # primeira execução: conta a partir do dia da criação
+            depois_de = r.gerada_ate or ((r.criado_em.date() if r.criado_em else hoje) - timedelta(days=1))
+            for d in ocorrencias(r, depois_de, ate):
+                valor = float(r.valor)
+                linhas.append({
+                    "usuario_id": r.usuario_id,
+                    "data": datetime(d.year, d.month, d.day),
+                    "valor": valor,
+                    "tipo": r.tipo,
+                    "categoria_id": None,
+                    "categoria_cache": None,
+                    "descricao": r.nome,
+                    "conta_id": r.conta_id,
+                    "conta_nome_cache": nomes_contas.get((r.conta_id, r.usuario_id)),
+                    "alocacao_percentual": r.alocacao_percentual,
+                    "alocado_valor": valor * float(r.alocacao_percentual or 0.0) / 100.0,
+                    "origem_import": "recorrencia",
+                    "status": "confirmado" if d <= hoje else "pendente",
+                    "recorrencia_id": r.id,
+                    "created_at": agora,
+                })
+
+        if linhas:
+            db.execute(insert(Transacao.__table__), linhas)
+            atualizar_resumo_mensal(db, adicionadas=linhas)
+            # saldo só em contas do próprio dono da recorrência
+            por_usuario = {}
+            for l in linhas:
+                por_usuario.setdefault(l["usuario_id"], []).append(l)
+            for dono, linhas_dono in por_usuario.items():
+                atualizar_saldos(db, dono, adicionadas=linhas_dono)
+                invalidar_faturas(db, dono, linhas_dono)
+        db.commit()
+        geradas += len(linhas)
+
+    return geradas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera as transações das recorrências ativas")
+    parser.add_argument("--ate", type=date.fromisoformat, default=None, help="horizonte AAAA-MM-DD (padrão: hoje)")
+    parser.add_argument("--dias", type=int, default=0, help="horizonte = hoje + N dias (ignorado se --ate)")
+    parser.add_argument("--usuario", type=int, default=None, help="apenas este usuario_id")
+    parser.add_argument("--lote", type=int, default=500, help="usuários por lote")
+    args = parser.parse_args()
+
+    horizonte = args.ate or (date.today() + timedelta(days=args.dias))
+    db = SessionLocal()
+    try:
+        inicio = datetime.now()
+        total = materializar_recorrencias(db, horizonte, usuario_id=args.usuario, lote_usuarios=args.lote)
+        print(f"recorrências materializadas até {horizonte}: {total} transações em {(datetime.now() - inicio).total_seconds():.1f}s")
+    finally:
+        db.close()
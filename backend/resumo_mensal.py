@@ -0,0 +1,143 @@
+# rollup mensal das transações (tabela resumo_mensal)
+# cada linha guarda soma e contagem de (usuario_id, ano_mes, categoria_id, tipo)
+# as rotas de escrita aplicam deltas aqui na mesma transação do banco, então relatórios,
+# contexto da IA e orçamentos leem O(meses x categorias) linhas em vez de O(transações)
+#
+# reconstrução completa (ex.: depois do deploy ou se algo escrever direto no banco):
+#     python resumo_mensal.py            --> todos os usuários
+#     python resumo_mensal.py --usuario 7
+
+from collections import defaultdict
+from datetime import datetime
+import argparse
+
+from sqlalchemy import update, insert, delete, select, func, extract, literal_column
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Transacao, ResumoMensal
+
+
+def ano_mes_de(data: datetime) -> int:
+    """datetime(2025, 9, 3) -> 202509"""
+    return data.year * 100 + data.month
+
+
+def campo_de(linha, nome):
+    # aceita tanto objetos ORM (Transacao) quanto dicts (snapshots, linhas de insert em lote)
+    if isinstance(linha, dict):
+        return linha.get(nome)
+    return getattr(linha, nome, None)
+
+
+def atualizar_resumo_mensal(db: Session, removidas=(), adicionadas=()) -> None:
+    """
+    Aplica no rollup o efeito das transações removidas/adicionadas. Não faz commit.
+
+    Num PATCH, passe o snapshot antigo em `removidas` e a transação atualizada em `adicionadas`:
+    mudanças de mês/categoria/tipo viram -1 na chave antiga e +1 na nova; deltas que se anulam são ignorados.
+    """
+    deltas = defaultdict(lambda: [0.0, 0])
+    for sinal, linhas in ((-1, removidas), (1, adicionadas)):
+        for l in linhas:
+            data = campo_de(l, "data")
+            if data is None:
+                continue
+            chave = (campo_de(l, "usuario_id"), ano_mes_de(data), campo_de(l, "categoria_id"), campo_de(l, "tipo"))
+            deltas[chave][0] += sinal * float(campo_de(l, "valor") or 0.0)
+            deltas[chave][1] += sinal
+
+    agora = datetime.utcnow()
+    for (usuario_id, ano_mes, categoria_id, tipo), (total, quantidade) in deltas.items():
+        if quantidade == 0 and abs(total) < 1e-9:
+            continue
+        filtro = [
+            ResumoMensal.usuario_id == usuario_id,
+            ResumoMensal.ano_mes == ano_mes,
+            ResumoMensal.tipo == tipo,
+            ResumoMensal.categoria_id.is_(None) if categoria_id is None else ResumoMensal.categoria_id == categoria_id,
+        ]
+        # UPDATE relativo (total = total + delta) evita perder atualizações concorrentes
+        somar = update(ResumoMensal).where(*filtro).values(
+            total=ResumoMensal.total + total,
+            quantidade=ResumoMensal.quantidade + quantidade,
+            atualizado_em=agora,
+        ).execution_options(synchronize_session=False)
+        if db.execute(somar).rowcount:
+            continue
+        try:
+            # SAVEPOINT: se outra transação criar a mesma chave entre o UPDATE e o INSERT, o erro do
+            # índice único (ux_resumo_mensal_chave) desfaz só o INSERT, não a escrita inteira
+            with db.begin_nested():
+                db.execute(insert(ResumoMensal).values(
+                    usuario_id=usuario_id,
+                    ano_mes=ano_mes,
+                    categoria_id=categoria_id,
+                    tipo=tipo,
+                    total=total,
+                    quantidade=quantidade,
+                    atualizado_em=agora,
+                ))
+        except IntegrityError:
+            # a linha agora existe (commit da outra transação): soma nela
+            db.execute(somar)
+
+
+def reconstruir_resumo_mensal(db: Session, usuario_id: int = None, lote_usuarios: int = 1000) -> int:
+    """
+    Recalcula o rollup a partir de transacoes com INSERT ... SELECT ... GROUP BY.
+    Processa faixas de `lote_usuarios` ids por vez (um commit por faixa). Retorna o nº de linhas geradas.
+    """
+    ano = extract("year", Transacao.data)
+    mes = extract("month", Transacao.data)
+    colunas = ["usuario_id", "ano_mes", "categoria_id", "tipo", "total", "quantidade", "atualizado_em"]
+
+    if usuario_id is not None:
+        faixas = [(usuario_id, usuario_id)]
+    else:
+        menor, maior = db.query(func.min(Transacao.usuario_id), func.max(Transacao.usuario_id)).one()
+        if menor is None:
+            db.execute(delete(ResumoMensal))
+            db.commit()
+            return 0
+        faixas = [(i, min(i + lote_usuarios - 1, maior)) for i in range(menor, maior + 1, lote_usuarios)]
+
+    geradas = 0
+    for inicio, fim in faixas:
+        agregado = select(
+            Transacao.usuario_id,
+            ano * literal_column("100") + mes,
+            Transacao.categoria_id,
+            Transacao.tipo,
+            func.sum(Transacao.valor),
+            func.count(Transacao.id),
+            func.current_timestamp(),
+        ).where(
+            Transacao.usuario_id.between(inicio, fim)
+        ).group_by(Transacao.usuario_id, ano, mes, Transacao.categoria_id, Transacao.tipo)
+
+        db.execute(delete(ResumoMensal).where(ResumoMensal.usuario_id.between(inicio, fim)))
+        res = db.execute(insert(ResumoMensal).from_select(colunas, agregado))
+        geradas += max(res.rowcount or 0, 0)
+        db.commit()
+
+    # usuários fora das faixas (sem transações) não deixam linhas órfãs para trás
+    if usuario_id is None:
+        db.execute(delete(ResumoMensal).where(ResumoMensal.usuario_id.notin_(
+            select(Transacao.usuario_id).distinct()
+        )))
+        db.commit()
+    return geradas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstrói a tabela resumo_mensal a partir de transacoes")
+    parser.add_argument("--usuario", type=int, default=None, help="reconstrói apenas este usuario_id")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        linhas = reconstruir_resumo_mensal(db, usuario_id=args.usuario)
+        print(f"resumo_mensal reconstruído: {linhas} linhas")
+    finally:
+        db.close()
@@ -0,0 +1,94 @@
+# saldo das contas mantido em Conta.saldo_cache
+# cada escrita em transacoes aplica aqui o delta na mesma transação do banco,
+# então /contas devolve o saldo atual sem somar transações a cada requisição
+#
+# reconciliação completa (recalcula tudo a partir de transacoes, em lotes de contas):
+#     python saldos.py
+#     python saldos.py --lote 200
+
+from collections import defaultdict
+import argparse
+
+from sqlalchemy import update, select, func, case
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Conta, Transacao
+from resumo_mensal import campo_de
+
+
+def delta_saldo(tipo: str, valor: float) -> float:
+    """Receita entra na conta; despesa, investimento e transferência saem."""
+    valor = float(valor or 0.0)
+    return valor if tipo == "receita" else -valor
+
+
+def atualizar_saldos(db: Session, usuario_id: int, removidas=(), adicionadas=()) -> None:
+    """
+    Aplica em Conta.saldo_cache o efeito das transações removidas/adicionadas. Não faz commit.
+    Mesma convenção de atualizar_resumo_mensal: no PATCH, snapshot antigo em `removidas`
+    e transação nova em `adicionadas` (troca de conta vira débito numa e crédito na outra).
+    Só mexe em contas de `usuario_id`: um conta_id de outro usuário não altera nada.
+    """
+    deltas = defaultdict(float)
+    for sinal, linhas in ((-1, removidas), (1, adicionadas)):
+        for l in linhas:
+            conta_id = campo_de(l, "conta_id")
+            if conta_id:
+                deltas[conta_id] += sinal * delta_saldo(campo_de(l, "tipo"), campo_de(l, "valor"))
+
+    for conta_id, delta in deltas.items():
+        if abs(delta) < 1e-9:
+            continue
+        # UPDATE relativo: não lê o saldo antes, então escritas concorrentes não se sobrescrevem
+        db.execute(
+            update(Conta).where(Conta.id == conta_id, Conta.usuario_id == usuario_id).values(
+                saldo_cache=func.coalesce(Conta.saldo_cache, 0.0) + delta
+            ).execution_options(synchronize_session=False)
+        )
+
+
+def reconciliar_saldos(db: Session, lote: int = 500) -> int:
+    """
+    Recalcula saldo_cache de todas as contas a partir de transacoes.
+    Percorre as contas em lotes de `lote` ids (uma soma agrupada + um UPDATE em lote por lote, um commit por lote).
+    Retorna o nº de contas atualizadas.
+    """
+    assinado = case((Transacao.tipo == "receita", Transacao.valor), else_=-Transacao.valor)
+    ultimo_id = 0
+    atualizadas = 0
+    while True:
+        ids = db.execute(
+            select(Conta.id).where(Conta.id > ultimo_id).order_by(Conta.id).limit(lote)
+        ).scalars().all()
+        if not ids:
+            break
+
+        somas = dict(db.execute(
+            select(Transacao.conta_id, func.sum(assinado))
+            .where(Transacao.conta_id.in_(ids))
+            .group_by(Transacao.conta_id)
+        ).all())
+
+        # UPDATE por chave primária em executemany
+        db.execute(update(Conta), [
+            {"id": conta_id, "saldo_cache": round(float(somas.get(conta_id) or 0.0), 2)}
+            for conta_id in ids
+        ])
+        db.commit()
+
+        atualizadas += len(ids)
+        ultimo_id = ids[-1]
+    return atualizadas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalcula Conta.saldo_cache a partir de transacoes")
+    parser.add_argument("--lote", type=int, default=500, help="contas por lote")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        total = reconciliar_saldos(db, lote=args.lote)
+        print(f"saldos reconciliados: {total} contas")
+    finally:
+        db.close()
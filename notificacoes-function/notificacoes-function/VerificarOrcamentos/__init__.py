@@ -43,99 +43,109 @@ def main(mytimer: func.TimerRequest) -> None:
     finally:
         if conn: conn.close()
 
+# alertas de orçamento do mês atual num único INSERT ... SELECT (1 round trip, qualquer nº de usuários):
+# - mês como faixa [1º dia, 1º dia do mês seguinte) em t.data --> usa ix_transacoes_usuario_data_id
+#   (MONTH()/YEAR() na coluna impediam o índice)
+# - o OR entre categoria_id e categoria_cache virou dois JOINs por igualdade somados (UNION ALL);
+#   o segundo ignora as transações já contadas pelo id, então nenhuma conta duas vezes
+# - dedup no próprio INSERT (NOT EXISTS) por `referencia` = 'orcamento:<id>:<AAAAMM>:<80|100>',
+#   a mesma chave gravada pelos avisos na hora da escrita da transação (backend/alertas_orcamento.py):
+#   no máximo um aviso de cada nível por orçamento e mês, venha ele do backend ou deste timer
+#   (este timer fica como rede de segurança, ex.: transações só com categoria em texto)
+# mensagens iguais às da versão anterior: categoria.capitalize(), R$ com 2 casas, percentual sem casas
+QUERY_ALERTAS_ORCAMENTO = """
+    WITH mes AS (
+        SELECT
+            DATEFROMPARTS(YEAR(GETDATE()), MONTH(GETDATE()), 1) AS inicio,
+            DATEADD(month, 1, DATEFROMPARTS(YEAR(GETDATE()), MONTH(GETDATE()), 1)) AS fim,
+            YEAR(GETDATE()) * 100 + MONTH(GETDATE()) AS ano_mes
+    ),
+    gastos AS (
+        -- transações ligadas ao orçamento pelo id da categoria
+        SELECT o.id AS orcamento_id, SUM(t.valor) AS total
+        FROM orcamentos o
+        CROSS JOIN mes
+        JOIN transacoes t ON
+            t.usuario_id = o.usuario_id
+            AND t.categoria_id = o.categoria_id
+            AND t.tipo = 'despesa'
+            AND t.data >= mes.inicio AND t.data < mes.fim
+        WHERE o.ativo = 1 AND o.valor_limite > 0
+        GROUP BY o.id
+
+        UNION ALL
+
+        -- transações ligadas pela chave (ex: 'mercado' salvo no onboarding) e não pelo id
+        SELECT o.id, SUM(t.valor)
+        FROM orcamentos o
+        CROSS JOIN mes
+        JOIN transacoes t ON
+            t.usuario_id = o.usuario_id
+            AND t.categoria_cache = o.categoria_chave
+            AND t.tipo = 'despesa'
+            AND t.data >= mes.inicio AND t.data < mes.fim
+        WHERE o.ativo = 1 AND o.valor_limite > 0
+          AND (o.categoria_id IS NULL OR t.categoria_id IS NULL OR t.categoria_id <> o.categoria_id)
+        GROUP BY o.id
+    ),
+    consumo AS (
+        SELECT
+            o.id AS orcamento_id,
+            o.usuario_id,
+            UPPER(LEFT(o.categoria_chave, 1)) + LOWER(SUBSTRING(o.categoria_chave, 2, 50)) AS categoria,
+            CAST(o.valor_limite AS decimal(18, 2)) AS limite,
+            CAST(SUM(g.total) AS decimal(18, 2)) AS gasto,
+            mes.ano_mes,
+            SUM(g.total) * 100.0 / o.valor_limite AS percentual
+        FROM gastos g
+        JOIN orcamentos o ON o.id = g.orcamento_id
+        CROSS JOIN mes
+        GROUP BY o.id, o.usuario_id, o.categoria_chave, o.valor_limite, mes.ano_mes
+    ),
+    alertas AS (
+        -- Regra 1: estourou o orçamento (>= 100%)
+        SELECT
+            usuario_id,
+            'orcamento_estourado' AS tipo,
+            N'Orçamento Estourado' AS titulo,
+            CONCAT(N'🚨 Limite de ', categoria, N' excedido! Gasto: R$ ', gasto, N' / Limite: R$ ', limite) AS mensagem,
+            CONCAT('orcamento:', orcamento_id, ':', ano_mes, ':100') AS referencia
+        FROM consumo
+        WHERE percentual >= 100
+
+        UNION ALL
+
+        -- Regra 2: alerta de perigo (>= 80%)
+        SELECT
+            usuario_id,
+            'orcamento_alerta',
+            N'Alerta de Gastos',
+            CONCAT(N'⚠️ Atenção: Você já consumiu ', CAST(ROUND(percentual, 0) AS int),
+                   N'% do orçamento de ', categoria, N'.'),
+            CONCAT('orcamento:', orcamento_id, ':', ano_mes, ':80')
+        FROM consumo
+        WHERE percentual >= 80 AND percentual < 100
+    )
+    INSERT INTO notificacoes (usuario_id, tipo, titulo, mensagem, lida, created_at, referencia)
+    SELECT a.usuario_id, a.tipo, a.titulo, a.mensagem, 0, GETDATE(), a.referencia
+    FROM alertas a
+    WHERE NOT EXISTS (
+        -- ix_notificacoes_usuario_referencia
+        SELECT 1 FROM notificacoes n
+        WHERE n.usuario_id = a.usuario_id
+          AND n.referencia = a.referencia
+    )
+"""
+
+
 def verificar_orcamentos(cursor):
     """
     Compara o 'valor_limite' definido no Onboarding (tabela orcamentos)
-    com o total gasto no mês atual (tabela transacoes).
+    com o total gasto no mês atual (tabela transacoes) e grava os alertas
+    em 'notificacoes' para o Frontend ler depois, tudo numa única instrução.
     """
     logging.info('📊 Verificando orçamentos mensais...')
 
-    # Esta query faz o "match" entre o orçamento definido e as transações do mês
-    query = """
-        SELECT 
-            o.usuario_id,
-            o.categoria_chave,
-            o.valor_limite,
-            ISNULL(SUM(t.valor), 0) as total_gasto
-        FROM orcamentos o
-        -- Relaciona orçamento com transações do mesmo usuário
-        LEFT JOIN transacoes t ON 
-            t.usuario_id = o.usuario_id 
-            -- Tenta cruzar pela chave da categoria (ex: 'mercado') que salvamos no onboarding
-            -- Ajuste isso se sua transacao usa apenas ID, mas aqui assumimos que podemos cruzar chaves ou IDs
-            AND (
-                t.categoria_cache = o.categoria_chave 
-                OR 
-                t.categoria_id = o.categoria_id
-            )
-            AND t.tipo = 'despesa'
-            AND MONTH(t.data) = MONTH(GETDATE())
-            AND YEAR(t.data) = YEAR(GETDATE())
-        WHERE o.ativo = 1
-        GROUP BY o.usuario_id, o.categoria_chave, o.valor_limite
-    """
-    
-    cursor.execute(query)
-    resultados = cursor.fetchall()
-    
-    for linha in resultados:
-        usuario_id, categoria, limite, gasto = linha
-        
-        # Evita divisão por zero
-        if limite <= 0: 
-            continue
-            
-        percentual = (float(gasto) / float(limite)) * 100
-        
-        # Regra 1: Estourou o orçamento (>= 100%)
-        if percentual >= 100:
-            criar_notificacao(
-                cursor, 
-                usuario_id, 
-                'orcamento_estourado', 
-                f'🚨 Limite de {categoria.capitalize()} excedido! Gasto: R$ {gasto:.2f} / Limite: R$ {limite:.2f}'
-            )
-        
-        # Regra 2: Alerta de perigo (>= 80%)
-        elif percentual >= 80:
-            criar_notificacao(
-                cursor, 
-                usuario_id, 
-                'orcamento_alerta', 
-                f'⚠️ Atenção: Você já consumiu {percentual:.0f}% do orçamento de {categoria.capitalize()}.'
-            )
-
-def criar_notificacao(cursor, usuario_id, tipo, mensagem):
-    """
-    Insere o alerta na tabela 'notificacoes' para o Frontend ler depois.
-    Evita duplicar o mesmo aviso se já foi enviado nas últimas 24h.
-    """
-    
-    # Define um título bonitinho baseado no tipo
-    titulo = "Aviso Financeiro"
-    if tipo == 'orcamento_estourado':
-        titulo = "Orçamento Estourado"
-    elif tipo == 'orcamento_alerta':
-        titulo = "Alerta de Gastos"
-
-    # Verifica se já avisamos isso hoje (para não floodar o usuário)
-    check_query = """
-        SELECT id FROM notificacoes 
-        WHERE usuario_id = ? 
-          AND tipo = ? 
-          AND mensagem = ? 
-          AND created_at > DATEADD(hour, -24, GETDATE())
-    """
-    cursor.execute(check_query, (usuario_id, tipo, mensagem))
-    
-    if cursor.fetchone():
-        logging.info(f'⏭️ Notificação duplicada ignorada para user {usuario_id}')
-        return
-
-    # Insere a notificação
-    insert_query = """
-        INSERT INTO notificacoes (usuario_id, tipo, titulo, mensagem, lida, created_at)
-        VALUES (?, ?, ?, ?, 0, GETDATE())
-    """
-    cursor.execute(insert_query, (usuario_id, tipo, titulo, mensagem))
-    logging.info(f'📬 Notificação criada para user {usuario_id}: {titulo}')
\ No newline at end of file
+    cursor.execute(QUERY_ALERTAS_ORCAMENTO)
+
+    logging.info(f'📬 Notificações de orçamento criadas: {cursor.rowcount}')